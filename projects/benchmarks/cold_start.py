@@ -0,0 +1,166 @@
+import argparse
+import ast
+import glob
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PROJECTS = os.path.join(HERE, '..')
+
+## Cold start budget of the apps.
+# Times every module-level import of each app script (projects/<app>/app*.py)
+# in a fresh interpreter: those at the top, the work every new replica does
+# before it can serve, and those further down, which run on the first script
+# run (streamlit itself is imported by the server either way and is left
+# out). The imports are read from the scripts, so the check follows them as
+# they change. Heavy libraries that are only needed once data is loaded or a
+# chart is drawn must not be imported at the top; loading one there fails
+# the check, as does going over the time budget with all the imports. The
+# import profile (python -X importtime) is recorded per app.
+#
+#   python cold_start.py                       # check, exit code 1 on failure
+#   python cold_start.py --budget 0.8 --output cold_start.json
+
+DEFAULT_BUDGET = float(os.getenv('COLD_START_BUDGET', 1.5))
+
+# loaded on first use only (warehouse drivers, plotting)
+DEFERRED = ['plotly', 'snowflake', 'sqlalchemy']
+
+_probe = '''
+import json, sys, time
+sys.path[:0] = {paths!r}
+start = time.perf_counter()
+{start_imports}
+start_seconds = time.perf_counter() - start
+loaded = sorted(set(name.split('.')[0] for name in sys.modules))
+{later_imports}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'start_seconds': start_seconds, 'loaded_at_start': loaded}}))
+'''
+
+def find_apps():
+  # app name -> entry script
+  apps = {}
+  for script in sorted(glob.glob(os.path.join(PROJECTS, '*', 'app*.py'))):
+    apps.setdefault(os.path.basename(os.path.dirname(script)), script)
+  return apps
+
+def script_imports(script):
+  # (at the top, further down): source of the module-level import statements
+  # of script, those in top-level if/try/with blocks included and those in
+  # functions not, split at its first function or class. streamlit's are
+  # left out
+  with open(script) as f:
+    source = f.read()
+  top, later = [], []
+
+  def walk(nodes, statements):
+    for node in nodes:
+      if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        statements = later
+        continue
+      if isinstance(node, ast.Import):
+        names = [alias.name for alias in node.names]
+      elif isinstance(node, ast.ImportFrom):
+        names = [node.module or '']
+      else:
+        for field in ('body', 'orelse', 'finalbody', 'handlers'):
+          statements = walk(getattr(node, field, []), statements)
+        continue
+      if not any(name.split('.')[0] == 'streamlit' for name in names):
+        statements.append(ast.get_source_segment(source, node))
+    return statements
+
+  walk(ast.parse(source).body, top)
+  return top, later
+
+def parse_importtime(stderr, top):
+  # the slowest imports by cumulative time, as (module, cumulative seconds)
+  rows = []
+  for line in stderr.splitlines():
+    if not line.startswith('import time:') or 'cumulative' in line:
+      continue
+    _, cumulative, module = line[len('import time:'):].split('|')
+    rows.append((module.strip(), int(cumulative) / 1e6))
+  # cumulative times include nested imports, so parents and children both show
+  rows.sort(key = lambda row: row[1], reverse = True)
+  return rows[:top]
+
+def profile(app, script, repeat = 5, top = 15):
+  paths = [os.path.abspath(PROJECTS), os.path.dirname(os.path.abspath(script))]
+  start_imports, later_imports = script_imports(script)
+  code = _probe.format(paths = paths, start_imports = '\n'.join(start_imports),
+    later_imports = '\n'.join(later_imports))
+
+  times = []
+  start_times = []
+  slowest = None
+  loaded = []
+  for i in range(repeat):
+    args = [sys.executable, '-X', 'importtime', '-c', code] if i == 0 else [sys.executable, '-c', code]
+    done = subprocess.run(args, capture_output = True, text = True, check = True)
+    result = json.loads(done.stdout.strip().splitlines()[-1])
+    if i == 0:
+      # importtime slows the run down, it is only used for the profile
+      slowest = parse_importtime(done.stderr, top)
+      loaded = result['loaded_at_start']
+    else:
+      times.append(result['seconds'])
+      start_times.append(result['start_seconds'])
+
+  return {
+    'app': app,
+    'imports': start_imports + later_imports,
+    'median_s': statistics.median(times) if times else None,
+    'min_s': min(times) if times else None,
+    'start_median_s': statistics.median(start_times) if start_times else None,
+    'deferred_loaded': [name for name in DEFERRED if name in loaded],
+    'slowest_imports': slowest,
+  }
+
+def check(result, budget = DEFAULT_BUDGET):
+  # failure messages of one app's profile, empty when it passes
+  failures = []
+  if result['median_s'] > budget:
+    failures.append('{} imports in {:.3f}s, over the {:.3f}s budget'.format(result['app'], result['median_s'], budget))
+  for name in result['deferred_loaded']:
+    failures.append('{} imports {} at start, it should be loaded on first use'.format(result['app'], name))
+  return failures
+
+def main(argv = None):
+  parser = argparse.ArgumentParser(description = 'Check the cold start import time of the apps.')
+  parser.add_argument('--budget', type = float, default = DEFAULT_BUDGET,
+    help = 'seconds allowed per app (median), default COLD_START_BUDGET or 1.5')
+  parser.add_argument('--repeat', type = int, default = 5)
+  parser.add_argument('--only', default = None, help = 'run only this app')
+  parser.add_argument('--output', default = None, help = 'write the profiles as json')
+  args = parser.parse_args(argv)
+
+  failures = []
+  profiles = []
+  for app, script in find_apps().items():
+    if args.only and app != args.only:
+      continue
+    result = profile(app, script, repeat = max(args.repeat, 2))
+    profiles.append(result)
+
+    print('{:<30} median {:.3f}s (top {:.3f}s)  min {:.3f}s  budget {:.3f}s'.format(app,
+      result['median_s'], result['start_median_s'], result['min_s'], args.budget))
+    for module, seconds in result['slowest_imports'][:5]:
+      print('    {:<40} {:.3f}s'.format(module, seconds))
+    failures.extend(check(result, args.budget))
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump({'budget_s': args.budget, 'python': sys.version.split()[0], 'apps': profiles}, f, indent = 2)
+    print('wrote {}'.format(args.output))
+
+  for failure in failures:
+    print('FAIL ' + failure)
+  return 1 if failures else 0
+
+if __name__ == '__main__':
+  sys.exit(main())
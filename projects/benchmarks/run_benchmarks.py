@@ -0,0 +1,258 @@
+import argparse
+import datetime
+import inspect
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, '..'))
+sys.path.append(os.path.join(HERE, '..', 'mkt_tv_optimizer'))
+sys.path.append(os.path.join(HERE, '..', 'customer_retention_dashboard'))
+
+import numpy as np
+import pandas as pd
+
+import synthetic
+import optimizer
+import portfolio
+import ranking
+import retention
+from common import compute, filters
+
+## Benchmarks for the dashboard computations.
+# Every benchmark runs on seeded synthetic tables (see synthetic.py) at each
+# requested size, e.g.
+#
+#   python run_benchmarks.py --sizes 1e4 1e5 1e6 --output results.json
+#   python run_benchmarks.py --sizes 1e5 --only orders. --compare results.json
+#
+# Wall time is the min/median over --repeat runs, peak memory is measured in
+# a separate run under tracemalloc. Memoized and instrumented functions are
+# unwrapped so every run does the work. The groupbys run on the compute
+# backend of COMPUTE_BACKEND (common/compute.py), recorded with the results.
+
+BENCHMARKS = {}
+
+basic_filtering = inspect.unwrap(optimizer.basic_filtering)
+aggregate_programs = inspect.unwrap(optimizer.aggregate_programs)
+user_moments = inspect.unwrap(optimizer.user_moments)
+
+def benchmark(name, table):
+  # register func(data) -> callable; data is the prepared synthetic table
+  def decorator(setup):
+    BENCHMARKS[name] = (table, setup)
+    return setup
+  return decorator
+
+## TV optimizer
+@benchmark('tv.convert_types', 'tv_raw')
+def _(df):
+  return lambda: optimizer.convert_types(df.copy())
+
+@benchmark('tv.basic_filtering', 'tv')
+def _(df):
+  return lambda: basic_filtering(df, False)
+
+@benchmark('tv.basic_filtering_remove_outlier', 'tv')
+def _(df):
+  return lambda: basic_filtering(df, True)
+
+@benchmark('tv.user_moments', 'tv')
+def _(df):
+  df_filtered = basic_filtering(df, False)
+  return lambda: user_moments(df_filtered)
+
+@benchmark('tv.aggregate_programs', 'tv')
+def _(df):
+  df_filtered = basic_filtering(df, False)
+  return lambda: aggregate_programs(df_filtered, 0)
+
+@benchmark('tv.rank_programs', 'tv')
+def _(df):
+  df_aggregate = aggregate_programs(basic_filtering(df, False), 0)
+  return lambda: ranking.rank_programs(df_aggregate, 11, k = 50)
+
+@benchmark('tv.penalty_sweep', 'tv')
+def _(df):
+  df_aggregate = aggregate_programs(basic_filtering(df, False), 0)
+  return lambda: ranking.penalty_sweep(df_aggregate, list(range(1, 102, 10)), k = 50)
+
+@benchmark('tv.portfolio_greedy', 'tv')
+def _(df):
+  df_aggregate = aggregate_programs(basic_filtering(df, False), 0)
+  budget = df_aggregate['total_cost'].sum() / 10
+  max_spots = int(df_aggregate['total_spots'].sum() / 20)
+  return lambda: portfolio.solve_portfolio(df_aggregate, budget, max_spots, method = 'greedy')
+
+## Customer retention
+@benchmark('orders.prepare', 'orders_raw')
+def _(df):
+  return lambda: retention.prepareCustomerOrder(df.copy())
+
+@benchmark('orders.build_rollup', 'orders')
+def _(df):
+  return lambda: retention.buildRepurchaseRollup(df)
+
+@benchmark('orders.monthly_repurchase', 'orders')
+def _(df):
+  rollup = retention.buildRepurchaseRollup(df)
+  def run():
+    rollup_filtered = retention.filterRollupByDate(retention.removeShortTermRepurchase(rollup, True),
+      datetime.date(2019, 1, 1), datetime.date(2021, 6, 30))
+    retention.monthlyRepurchaseSummary(rollup_filtered)
+    retention.overallRepurchaseSummary(rollup_filtered)
+  return run
+
+@benchmark('orders.delay_histograms', 'orders')
+def _(df):
+  repurchases = df[df['is_repurchase']]
+  selected_month = repurchases[repurchases['year_month'] == '2020-06']
+  return lambda: retention.delayHistograms(repurchases, selected_month)
+
+@benchmark('orders.nth_order', 'orders')
+def _(df):
+  return lambda: retention.nthOrderSummary(df)
+
+
+@benchmark('orders.build_sketches', 'orders')
+def _(df):
+  return lambda: retention.buildOrderSketches(df)
+
+@benchmark('orders.nth_order_approx', 'orders')
+def _(df):
+  sketches = retention.buildOrderSketches(df)
+  return lambda: retention.nthOrderSummaryApprox(sketches, datetime.date(2019, 1, 1), datetime.date(2021, 6, 30), 'all')
+@benchmark('orders.cohort_index', 'orders')
+def _(df):
+  return lambda: retention.cohortIndex(df)
+
+@benchmark('orders.cohort_retention', 'orders')
+def _(df):
+  cohort_index = retention.cohortIndex(df)
+  mask = df['has_mattress'].to_numpy()
+  def run():
+    retention.cohortRetention(cohort_index, value = 'customers')
+    retention.cohortRetention(cohort_index, mask, value = 'orders')
+  return run
+
+
+@benchmark('orders.lazy_filters', 'orders')
+def _(df):
+  # section 2 and 3 filter sets from cold caches, sharing the product mask
+  def run():
+    filters._predicate_mask.cache_clear()
+    filters._collect.cache_clear()
+    orders = filters.LazyFilter(df)
+    repurchases = orders.where(('repurchase', True), retention.repurchasePredicate(True)) \
+      .where(('product', 'mattress'), retention.productPredicate('mattress'))
+    repurchases.collect()
+    repurchases.where(('year_month', '2020-06'), retention.monthPredicate('2020-06')).collect()
+    orders.between('created_at_tz', datetime.date(2019, 6, 1), datetime.date(2020, 12, 31)) \
+      .where(('product', 'mattress'), retention.productPredicate('mattress')).collect()
+  return run
+
+
+def make_table(table, rows, seed):
+  if table == 'tv_raw':
+    return synthetic.tv_program_optimizer(rows, seed)
+  if table == 'tv':
+    return optimizer.convert_types(synthetic.tv_program_optimizer(rows, seed))
+  if table == 'orders_raw':
+    return synthetic.customer_order(rows, seed)
+  if table == 'orders':
+    return retention.prepareCustomerOrder(synthetic.customer_order(rows, seed))
+  raise ValueError(table)
+
+def measure(run, repeat):
+  times = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    run()
+    times.append(time.perf_counter() - start)
+
+  tracemalloc.start()
+  run()
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  return {
+    'times_s': times,
+    'min_s': min(times),
+    'median_s': statistics.median(times),
+    'peak_mb': peak / 1024 ** 2,
+  }
+
+def run_all(sizes, repeat = 3, only = None, seed = 0):
+  results = []
+  for rows in sizes:
+    tables = {}
+    for name, (table, setup) in BENCHMARKS.items():
+      if only and not any(pattern in name for pattern in only):
+        continue
+      if table not in tables:
+        tables[table] = make_table(table, rows, seed)
+
+      result = measure(setup(tables[table]), repeat)
+      result.update({'benchmark': name, 'rows': rows, 'repeat': repeat})
+      results.append(result)
+      print('{:<36} {:>11,} rows  min {:>9.4f}s  median {:>9.4f}s  peak {:>9.1f} MB'.format(
+        name, rows, result['min_s'], result['median_s'], result['peak_mb']))
+    tables.clear()
+  return results
+
+def metadata(seed):
+  return {
+    'timestamp': datetime.datetime.now().isoformat(timespec = 'seconds'),
+    'python': platform.python_version(),
+    'platform': platform.platform(),
+    'pandas': pd.__version__,
+    'numpy': np.__version__,
+    'compute': compute.get_compute().name,
+    'seed': seed,
+  }
+
+def compare(results, baseline_path):
+  # ratio of median times against an earlier results file, > 1 is faster now
+  with open(baseline_path) as f:
+    baseline = {(r['benchmark'], r['rows']): r for r in json.load(f)['results']}
+
+  print('\ncompared to {}'.format(baseline_path))
+  for result in results:
+    before = baseline.get((result['benchmark'], result['rows']))
+    if before is None:
+      continue
+    print('{:<36} {:>11,} rows  speedup {:>6.2f}x  memory {:>6.2f}x'.format(
+      result['benchmark'], result['rows'],
+      before['median_s'] / result['median_s'] if result['median_s'] else float('inf'),
+      before['peak_mb'] / result['peak_mb'] if result['peak_mb'] else float('inf')))
+
+def main(argv = None):
+  parser = argparse.ArgumentParser(description = 'Benchmark the dashboard computations on synthetic data.')
+  parser.add_argument('--sizes', nargs = '+', default = ['1e4', '1e5', '1e6'],
+    help = 'row counts, e.g. 1e4 1e6 1e8')
+  parser.add_argument('--repeat', type = int, default = 3)
+  parser.add_argument('--only', nargs = '+', default = None,
+    help = 'only run benchmarks whose name contains one of these')
+  parser.add_argument('--seed', type = int, default = 0)
+  parser.add_argument('--output', default = 'benchmark_results.json')
+  parser.add_argument('--compare', default = None,
+    help = 'earlier results file to compare against')
+  args = parser.parse_args(argv)
+
+  sizes = [int(float(size)) for size in args.sizes]
+  results = run_all(sizes, args.repeat, args.only, args.seed)
+
+  with open(args.output, 'w') as f:
+    json.dump({'meta': metadata(args.seed), 'results': results}, f, indent = 2)
+  print('wrote {}'.format(args.output))
+
+  if args.compare:
+    compare(results, args.compare)
+
+if __name__ == '__main__':
+  main()
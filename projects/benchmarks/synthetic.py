@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+## Seeded synthetic tables.
+# Same columns and value ranges as the warehouse tables, generated with
+# vectorized numpy so 1e8 rows only costs memory, not python loops. The
+# output looks like what pd.read_sql_query returns (strings and objects),
+# so the apps' own load time conversions can be benchmarked on it too.
+
+TIMEZONES = ['Australia/Adelaide', 'Australia/Brisbane', 'Australia/Melbourne',
+  'Australia/Perth', 'Australia/Sydney', 'Europe/London', 'Pacific/Auckland']
+
+def tv_program_optimizer(rows, seed = 0, programs = 2000, channels = 40):
+  # TV_PROGRAM_OPTIMIZER: one row per aired spot
+  rng = np.random.default_rng(seed)
+
+  start = np.datetime64('2020-07-01T00:00:00')
+  ad_time = start + rng.integers(0, 365 * 86400, rows).astype('timedelta64[s]')
+  program_ids = rng.zipf(1.3, rows) % programs
+
+  df = pd.DataFrame({
+    'ad_time_ntz': ad_time,
+    'month': ad_time.astype('datetime64[M]').astype('datetime64[D]'),
+    'timezone': np.array(TIMEZONES)[rng.integers(0, len(TIMEZONES), rows)],
+    'channel': pd.Categorical.from_codes(program_ids % channels, ['channel {}'.format(i) for i in range(channels)]).astype(str),
+    'program': pd.Categorical.from_codes(program_ids, ['program {}'.format(i) for i in range(programs)]).astype(str),
+    'spot': np.ones(rows, dtype = 'int64'),
+    # some free spots and some that never had an impression
+    'cost': np.where(rng.random(rows) < 0.1, 0.0, np.round(rng.lognormal(5, 1, rows), 2)),
+    'impression': np.where(rng.random(rows) < 0.05, 0, rng.poisson(2000, rows)),
+  })
+  df['users'] = rng.poisson(df['impression'].to_numpy() / 400.0)
+  return df
+
+def customer_order(rows, seed = 0, orders_per_customer = 1.6):
+  # CUSTOMER_ORDER: one row per order, with its customer's purchase sequence
+  rng = np.random.default_rng(seed)
+  customers = max(1, int(rows / orders_per_customer))
+
+  customer_id = rng.integers(0, customers, rows)
+  start = np.datetime64('2019-01-01T00:00:00')
+  created = start + rng.integers(0, 900 * 86400, rows).astype('timedelta64[s]')
+
+  # sequence within each customer, by order time
+  order = np.lexsort((created, customer_id))
+  customer_id = customer_id[order]
+  created = created[order]
+  first = np.r_[True, customer_id[1:] != customer_id[:-1]]
+  group_start = np.maximum.accumulate(np.where(first, np.arange(rows), 0))
+  purchase_sequence = np.arange(rows) - group_start + 1
+
+  previous = np.r_[created[:1], created[:-1]]
+  delay = (created - previous).astype('int64')
+  week_delay = np.where(first, np.nan, np.floor(delay / (7 * 86400)))
+  previous = np.where(first, np.datetime64('NaT'), previous)
+
+  created_at_tz = pd.DatetimeIndex(created).tz_localize('UTC').tz_convert('Australia/Melbourne')
+  previous_at_tz = pd.DatetimeIndex(previous).tz_localize('UTC').tz_convert('Australia/Melbourne')
+
+  df = pd.DataFrame({
+    'order_id': rng.permutation(rows),
+    'customer_id': customer_id,
+    'created_at_tz': created_at_tz,
+    'previous_created_at_tz': previous_at_tz,
+    'purchase_sequence': purchase_sequence,
+    'week_delay': week_delay,
+    'is_repurchase': ~first,
+    'has_mattress': rng.random(rows) < 0.6,
+    'has_accessory': rng.random(rows) < 0.5,
+  })
+  # flags arrive as python objects from the warehouse
+  for column in ['is_repurchase', 'has_mattress', 'has_accessory']:
+    df[column] = df[column].astype(object)
+  return df.sort_values('created_at_tz', ignore_index = True)
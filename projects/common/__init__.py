@@ -0,0 +1 @@
+# shared helpers used by the streamlit apps under projects/
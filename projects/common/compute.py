@@ -0,0 +1,307 @@
+import os
+
+import pandas as pd
+
+from common.query_spec import QuerySpec
+
+## Pluggable compute backend for group aggregations.
+# The apps' heavy groupbys go through group_aggregate, which has one pandas
+# implementation and two out-of-core, vectorized ones, selected with
+# COMPUTE_BACKEND=pandas|duckdb|polars (pandas by default):
+#
+#   pandas  in memory, the reference
+#   duckdb  embedded DuckDB, multi-threaded and spilling to temp_directory
+#           past memory_limit (COMPUTE_MEMORY_LIMIT, e.g. '4GB')
+#   polars  Polars lazy frames, collected with the streaming engine
+#
+# The source is a DataFrame, or the path of a Parquet or Arrow IPC file (the
+# shared store's files, see common/shared_store.py). From a file, only the
+# needed columns are scanned and duckdb and polars never hold the table in
+# memory. duckdb and polars are optional and imported on first use.
+#
+# Results are the same whichever backend runs: one row per group with
+# non-null keys, sorted on the keys, with dtypes that follow from the input
+# columns (see _output_dtypes, integer sums are int64 whatever the input
+# width) and categorical keys that keep the categories of a DataFrame source,
+# or get the sorted observed values from a file. Float sums can differ in the
+# last bits, the engines add in a different order.
+#
+#   compute.get_compute().group_aggregate(df, ['timezone'],
+#     {'users-mean': ('users', 'mean'), 'users-std': ('users', 'std')},
+#     filters = [('cost', '>', 0)])
+
+AGGREGATIONS = ('sum', 'count', 'nunique', 'mean', 'std', 'min', 'max')
+
+def _check(by, aggregations, filters):
+  if not by:
+    raise ValueError('group_aggregate needs at least one key column')
+  for column, func in aggregations.values():
+    if func not in AGGREGATIONS:
+      raise ValueError('unsupported aggregation {} of {}, expected one of {}'.format(func, column, ', '.join(AGGREGATIONS)))
+  # validates the filter operators, the same (column, op, value) as QuerySpec
+  return QuerySpec(None, filters = filters)
+
+def _needed_columns(by, aggregations, filters):
+  columns = list(by)
+  for column in [column for column, _ in aggregations.values()] + [column for column, _, _ in filters]:
+    if column not in columns:
+      columns.append(column)
+  return columns
+
+def _is_parquet(path):
+  return path.endswith('.parquet') or path.endswith('.pq')
+
+def _source_dtypes(source, columns):
+  # pandas dtypes of the source columns, without reading a file's rows
+  if isinstance(source, pd.DataFrame):
+    return source.dtypes[columns]
+  import pyarrow as pa
+  if _is_parquet(source):
+    import pyarrow.parquet as pq
+    schema = pq.read_schema(source)
+  else:
+    schema = pa.ipc.open_file(pa.memory_map(source)).schema
+  return schema.empty_table().to_pandas().dtypes[columns]
+
+def _integral(dtype):
+  return pd.api.types.is_integer_dtype(dtype) or pd.api.types.is_bool_dtype(dtype)
+
+def _output_dtypes(aggregations, dtypes):
+  # dtype of each aggregation, from its input column only. integer sums and
+  # counts are int64 so they never wrap, the engines widen before summing
+  output = {}
+  for name, (column, func) in aggregations.items():
+    dtype = dtypes[column]
+    if func == 'sum':
+      output[name] = 'int64' if _integral(dtype) else 'float64'
+    elif func in ('count', 'nunique'):
+      output[name] = 'int64'
+    elif func in ('mean', 'std'):
+      output[name] = 'float64'
+    else:
+      output[name] = dtype
+  return output
+
+def _conform(result, source, by, aggregations, dtypes):
+  # the pandas result dtypes and row order, see the header
+  for column in by:
+    dtype = dtypes[column]
+    if isinstance(dtype, pd.CategoricalDtype):
+      if isinstance(source, pd.DataFrame):
+        categories = dtype.categories
+      else:
+        categories = pd.Index(pd.unique(result[column].astype(object))).sort_values()
+      result[column] = pd.Categorical(result[column].astype(object), categories = categories, ordered = dtype.ordered)
+    elif result[column].dtype != dtype:
+      result[column] = result[column].astype(dtype)
+
+  output = _output_dtypes(aggregations, dtypes)
+  for name, (column, func) in aggregations.items():
+    values = result[name]
+    if func in ('sum', 'count', 'nunique'):
+      # the sum of an all null group is 0 in pandas, null in sql
+      values = values.fillna(0)
+    if values.dtype != output[name] and not values.isna().any():
+      if _integral(values.dtype) and _integral(output[name]) \
+          and pd.api.types.pandas_dtype(output[name]).itemsize < values.dtype.itemsize:
+        # never narrow, a narrowing cast would wrap large aggregates
+        raise TypeError('{} came back as {}, wider than {}'.format(name, values.dtype, output[name]))
+      values = values.astype(output[name])
+    result[name] = values
+
+  result = result[list(by) + list(aggregations)]
+  return result.sort_values(list(by), kind = 'mergesort').reset_index(drop = True)
+
+
+class PandasCompute:
+  name = 'pandas'
+
+  def group_aggregate(self, source, by, aggregations, filters = ()):
+    # one row per by group with aggregations {name: (column, func)} over the
+    # rows matching filters, (column, op, value) tuples as in QuerySpec
+    spec = _check(by, aggregations, filters)
+    columns = _needed_columns(by, aggregations, filters)
+    if isinstance(source, pd.DataFrame):
+      df = source
+    elif _is_parquet(source):
+      df = pd.read_parquet(source, columns = columns)
+    else:
+      import pyarrow as pa
+      df = pa.ipc.open_file(pa.memory_map(source)).read_all().select(columns).to_pandas()
+    if filters:
+      df = df[spec.mask(df)]
+
+    result = df[columns].groupby(list(by), observed = True, sort = True) \
+      .agg(**{name: pd.NamedAgg(column, func) for name, (column, func) in aggregations.items()}) \
+        .reset_index()
+    return _conform(result, source, by, aggregations, _source_dtypes(source, columns))
+
+
+class DuckDBCompute:
+  name = 'duckdb'
+
+  _functions = {
+    'sum': 'sum({})',
+    'count': 'count({})',
+    'nunique': 'count(DISTINCT {})',
+    'mean': 'avg({})',
+    'std': 'stddev_samp({})',
+    'min': 'min({})',
+    'max': 'max({})',
+  }
+
+  def __init__(self, memory_limit = None, threads = None, temp_directory = None):
+    self.memory_limit = memory_limit
+    self.threads = threads
+    self.temp_directory = temp_directory
+
+  def connect(self):
+    import duckdb
+    connection = duckdb.connect()
+    if self.memory_limit:
+      connection.execute("SET memory_limit = '{}'".format(self.memory_limit))
+    if self.threads:
+      connection.execute('SET threads = {}'.format(int(self.threads)))
+    if self.temp_directory:
+      connection.execute("SET temp_directory = '{}'".format(self.temp_directory))
+    return connection
+
+  def group_aggregate(self, source, by, aggregations, filters = ()):
+    _check(by, aggregations, filters)
+    columns = _needed_columns(by, aggregations, filters)
+    quote = lambda column: '"{}"'.format(column.replace('"', '""'))
+
+    connection = self.connect()
+    try:
+      if isinstance(source, pd.DataFrame):
+        connection.register('source', source[columns])
+        relation = 'source'
+      elif _is_parquet(source):
+        relation = "read_parquet('{}')".format(source.replace("'", "''"))
+      else:
+        import pyarrow as pa
+        # scanned from the memory mapped file, not copied
+        connection.register('source', pa.ipc.open_file(pa.memory_map(source)).read_all().select(columns))
+        relation = 'source'
+
+      clauses = ['{} IS NOT NULL'.format(quote(column)) for column in by]
+      params = []
+      for column, op, value in filters:
+        if op == 'in':
+          clauses.append('{} IN ({})'.format(quote(column), ', '.join('?' * len(value))))
+          params.extend(value)
+        else:
+          clauses.append('{} {} ?'.format(quote(column), op))
+          params.append(value)
+
+      dtypes = _source_dtypes(source, columns)
+      select = [quote(column) for column in by]
+      for name, (column, func) in aggregations.items():
+        expression = self._functions[func].format(quote(column))
+        if func == 'sum' and _integral(dtypes[column]):
+          # sum of integers is a HUGEINT, which pandas gets as a float64.
+          # BIGINT keeps it exact, and raises rather than wraps on overflow
+          expression = 'CAST({} AS BIGINT)'.format(expression)
+        select.append('{} AS {}'.format(expression, quote(name)))
+      sql = 'SELECT {} FROM {}'.format(', '.join(select), relation)
+      if clauses:
+        sql += ' WHERE ' + ' AND '.join(clauses)
+      sql += ' GROUP BY ' + ', '.join(quote(column) for column in by)
+      result = connection.execute(sql, params).df()
+    finally:
+      connection.close()
+    return _conform(result, source, by, aggregations, dtypes)
+
+
+class PolarsCompute:
+  name = 'polars'
+
+  def group_aggregate(self, source, by, aggregations, filters = ()):
+    import polars as pl
+    _check(by, aggregations, filters)
+    columns = _needed_columns(by, aggregations, filters)
+
+    if isinstance(source, pd.DataFrame):
+      lazy = pl.from_pandas(source[columns]).lazy()
+    elif _is_parquet(source):
+      lazy = pl.scan_parquet(source)
+    else:
+      lazy = pl.scan_ipc(source)
+    lazy = lazy.select(columns)
+
+    schema = lazy.collect_schema() if hasattr(lazy, 'collect_schema') else lazy.schema
+    condition = pl.all_horizontal([pl.col(column).is_not_null() for column in by])
+    for column, op, value in filters:
+      if isinstance(value, str) and schema[column] in (pl.Datetime, pl.Date):
+        # sql compares timestamps to date strings, polars does not
+        value = pd.Timestamp(value).to_pydatetime()
+      expression = pl.col(column)
+      if op == 'in':
+        expression = expression.is_in(list(value))
+      else:
+        expression = {
+          '>': expression > value,
+          '>=': expression >= value,
+          '<': expression < value,
+          '<=': expression <= value,
+          '=': expression == value,
+          '!=': expression != value,
+        }[op]
+      condition = condition & expression
+
+    dtypes = _source_dtypes(source, columns)
+    expressions = []
+    for name, (column, func) in aggregations.items():
+      expression = pl.col(column)
+      if func == 'sum' and _integral(dtypes[column]):
+        # polars sums in the column's width and wraps, widen first
+        expression = expression.cast(pl.Int64).sum()
+      elif func == 'count':
+        expression = expression.is_not_null().sum()
+      elif func == 'nunique':
+        expression = expression.drop_nulls().n_unique()
+      elif func == 'std':
+        expression = expression.std(ddof = 1)
+      else:
+        expression = getattr(expression, func)()
+      expressions.append(expression.alias(name))
+
+    lazy = lazy.filter(condition)
+    lazy = lazy.group_by(list(by)).agg(expressions) if hasattr(lazy, 'group_by') else lazy.groupby(list(by)).agg(expressions)
+    try:
+      result = lazy.collect(engine = 'streaming')
+    except TypeError:
+      # polars before the engine argument
+      result = lazy.collect(streaming = True)
+    return _conform(result.to_pandas(), source, by, aggregations, dtypes)
+
+
+BACKENDS = {
+  'pandas': PandasCompute,
+  'duckdb': DuckDBCompute,
+  'polars': PolarsCompute,
+}
+
+def compute_from_env():
+  name = os.getenv('COMPUTE_BACKEND', 'pandas')
+  if name not in BACKENDS:
+    raise ValueError('unknown COMPUTE_BACKEND {}, expected one of {}'.format(name, ', '.join(BACKENDS)))
+  if name == 'duckdb':
+    return DuckDBCompute(memory_limit = os.getenv('COMPUTE_MEMORY_LIMIT'),
+      temp_directory = os.getenv('COMPUTE_TEMP_DIR'))
+  return BACKENDS[name]()
+
+
+_compute = None
+
+def get_compute():
+  global _compute
+  if _compute is None:
+    _compute = compute_from_env()
+  return _compute
+
+def set_compute(compute):
+  # swap the process-wide backend, e.g. PandasCompute() to compare results
+  global _compute
+  _compute = compute
+  return compute
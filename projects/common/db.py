@@ -0,0 +1,215 @@
+import logging
+import os
+import re
+import threading
+
+import pandas as pd
+
+from common import dtypes
+
+## Data access layer shared by all apps.
+# Engines are created once per process and pooled, so a cache miss only
+# checks out an existing warehouse connection instead of logging in again.
+# The backend is pluggable: snowflake in production, a local sqlite/duckdb
+# file for tests and benchmarks (DATA_BACKEND=sqlite:///path/to/file.db).
+# sqlalchemy and the drivers are imported on first use, not at app start.
+#
+# Results are streamed in chunks: arrow record batches where the driver has
+# them (snowflake), fetchmany otherwise. Each chunk is converted (compact
+# dtypes, filters) as it arrives, so only one chunk of raw python rows is
+# alive at a time instead of the whole result.
+
+DEFAULT_WAREHOUSE = 'STREAMLIT_PUBLIC_WH'
+DEFAULT_ROLE = 'STREAMLIT_PUBLIC_ROLE'
+
+DEFAULT_CHUNKSIZE = int(os.getenv('FETCH_CHUNKSIZE', 100000))
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+class SnowflakeBackend:
+  name = 'snowflake'
+  supports_pushdown = True
+
+  def __init__(self, account = None, user = None, password = None,
+      warehouse = DEFAULT_WAREHOUSE, role = DEFAULT_ROLE,
+      pool_size = 5, max_overflow = 5, pool_recycle = 3600):
+    # Loading Env Variable for logging into snowflake
+    self.account = account or os.getenv('SNOWFLAKE_ACCOUNT')
+    self.user = user or os.getenv('SNOWFLAKE_USERNAME')
+    self.password = password or os.getenv('SNOWFLAKE_PASSWORD')
+    self.warehouse = warehouse
+    self.role = role
+    self.pool_size = pool_size
+    self.max_overflow = max_overflow
+    self.pool_recycle = pool_recycle
+
+  def key(self):
+    return (self.name, self.account, self.warehouse, self.role)
+
+  def create_engine(self):
+    # imported here so the local backend works without the snowflake driver
+    from snowflake.sqlalchemy import URL
+    from sqlalchemy import create_engine
+    from sqlalchemy.dialects import registry
+    registry.register('snowflake', 'snowflake.sqlalchemy', 'dialect')
+
+    return create_engine(URL(
+        account = self.account,
+        user = self.user,
+        password = self.password,
+        warehouse = self.warehouse,
+        role = self.role,
+      ),
+      pool_size = self.pool_size,
+      max_overflow = self.max_overflow,
+      pool_recycle = self.pool_recycle,
+      pool_pre_ping = True)
+
+  def translate(self, sql):
+    return sql
+
+
+class LocalBackend:
+  # stand-in for the warehouse backed by a local sqlite (or duckdb) file.
+  # fully qualified "DB"."SCHEMA"."TABLE" names are rewritten to "TABLE" so
+  # the app queries run unchanged.
+  name = 'local'
+  _qualified_name = re.compile(r'"[^"]+"\s*\.\s*"[^"]+"\s*\.\s*("[^"]+")')
+
+  def __init__(self, url = 'sqlite://', supports_pushdown = True):
+    self.url = url
+    self.supports_pushdown = supports_pushdown
+
+  def key(self):
+    return (self.name, self.url)
+
+  def in_memory(self):
+    # sqlite://, sqlite:///:memory: or a file:...?mode=memory uri
+    from sqlalchemy.engine.url import make_url
+    url = make_url(self.url)
+    return url.database in (None, '', ':memory:') or url.query.get('mode') == 'memory'
+
+  def create_engine(self):
+    from sqlalchemy import create_engine
+    if not self.url.startswith('sqlite'):
+      return create_engine(self.url)
+    # pooled connections move between threads (prefetch, sessions)
+    connect_args = {'check_same_thread': False}
+    if self.in_memory():
+      from sqlalchemy.pool import StaticPool
+      # single shared connection so in-memory databases survive between
+      # queries. a file gets the default pool, concurrent reads need their own
+      return create_engine(self.url, poolclass = StaticPool, connect_args = connect_args)
+    return create_engine(self.url, connect_args = connect_args)
+
+  def translate(self, sql):
+    return self._qualified_name.sub(r'\1', sql)
+
+
+def backend_from_env():
+  url = os.getenv('DATA_BACKEND', 'snowflake')
+  if url == 'snowflake':
+    return SnowflakeBackend()
+  return LocalBackend(url)
+
+
+_backend = None
+
+def get_backend():
+  global _backend
+  if _backend is None:
+    _backend = backend_from_env()
+  return _backend
+
+def set_backend(backend):
+  # swap the process-wide backend, e.g. LocalBackend('sqlite://') in tests
+  global _backend
+  _backend = backend
+  return backend
+
+def get_engine(backend = None):
+  backend = backend or get_backend()
+  key = backend.key()
+
+  engine = _engines.get(key)
+  if engine is None:
+    with _engines_lock:
+      engine = _engines.get(key)
+      if engine is None:
+        engine = backend.create_engine()
+        _engines[key] = engine
+  return engine
+
+def dispose_engines():
+  # only needed on shutdown or after forking, engines are otherwise long lived
+  with _engines_lock:
+    for engine in _engines.values():
+      engine.dispose()
+    _engines.clear()
+
+def read_batches(sql, params = None, backend = None, chunksize = DEFAULT_CHUNKSIZE, arrow = None):
+  # yields the result as DataFrames of at most chunksize rows (arrow batches
+  # are as large as the warehouse made them). an empty result yields one
+  # empty frame, so the columns are always known. arrow forces the fetch
+  # strategy (True, False), by default arrow is used where the driver has it
+  from sqlalchemy import text
+  backend = backend or get_backend()
+  engine = get_engine(backend)
+
+  with engine.connect() as connection:
+    result = connection.execution_options(stream_results = True) \
+      .execute(text(backend.translate(sql)), params or {})
+    columns = list(result.keys())
+    cursor = result.cursor
+    empty = True
+
+    if arrow is None:
+      arrow = hasattr(cursor, 'fetch_arrow_batches')
+    elif arrow and not hasattr(cursor, 'fetch_arrow_batches'):
+      raise ValueError('the {} backend has no arrow batches'.format(backend.name))
+
+    if arrow:
+      # columnar all the way, no python object per value
+      for batch in cursor.fetch_arrow_batches():
+        empty = False
+        frame = batch.to_pandas()
+        # the driver's names are upper case, the dialect's (and callers') lower
+        frame.columns = columns
+        yield frame
+    else:
+      while True:
+        rows = result.fetchmany(chunksize)
+        if not rows:
+          break
+        empty = False
+        # same conversion as pd.read_sql_query, decimals become floats
+        yield pd.DataFrame.from_records(rows, columns = columns, coerce_float = True)
+
+    if empty:
+      yield pd.DataFrame(columns = columns)
+
+def callable_name(convert):
+  return '{}.{}'.format(convert.__module__, getattr(convert, '__qualname__', convert.__name__))
+
+def read_sql(sql, params = None, backend = None, convert = None, chunksize = DEFAULT_CHUNKSIZE):
+  # convert(chunk) -> chunk runs on every chunk as it arrives, it must only
+  # look at one row at a time (dtype conversion, filters, derived columns)
+  frames = []
+  # deep memory usage is slow on strings, only measured for the log
+  report = convert is not None and dtypes.logger.isEnabledFor(logging.INFO)
+  before = None
+  for chunk in read_batches(sql, params, backend, chunksize):
+    if report:
+      # the raw chunks are not kept, so they are measured as they pass
+      usage = dtypes.memory_usage(chunk)
+      before = usage if before is None else before.add(usage, fill_value = 0)
+    if convert is not None:
+      chunk = convert(chunk)
+    frames.append(chunk)
+
+  df = frames[0] if len(frames) == 1 else dtypes.concat_frames(frames)
+  if report:
+    dtypes.memory_report(callable_name(convert), before, dtypes.memory_usage(df))
+  return df
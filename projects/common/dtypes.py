@@ -0,0 +1,97 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+## Compact dtypes applied at load time.
+# pd.read_sql_query leaves strings and flags as python objects and numbers as
+# 64 bit. A schema maps column -> kind and apply_schema converts to
+# categoricals, booleans and downcast numerics. Columns missing from the
+# frame are skipped, so one schema can serve projected queries too.
+#
+# kinds:
+#   'category'  low cardinality strings (timezone, channel, year_month, ...)
+#   'bool'      flags, missing values become False. this is what the apps'
+#               `== True` comparisons already assume, and keeps masks plain
+#   'boolean'   nullable pandas boolean, keeps missing values
+#   'int'       smallest of int32/int64 that fits, left alone if not integral.
+#               not narrower than int32 so aggregates stay safe
+#   'float32'   single precision, for measures that are only plotted
+#   'datetime'  pd.to_datetime
+
+logger = logging.getLogger(__name__)
+
+def _to_int(s):
+  if not pd.api.types.is_numeric_dtype(s):
+    try:
+      s = pd.to_numeric(s)
+    except (TypeError, ValueError):
+      # e.g. alphanumeric ids, keep them as they are
+      return s
+  if s.isna().any():
+    return s
+  as_float = s.astype('float64')
+  if not np.array_equal(as_float, np.floor(as_float)):
+    return s
+
+  info = np.iinfo(np.int32)
+  if s.min() >= info.min and s.max() <= info.max:
+    return s.astype('int32')
+  return s.astype('int64')
+
+_converters = {
+  'category': lambda s: s.astype('category'),
+  'bool': lambda s: (s == True).astype(bool),
+  'boolean': lambda s: s.astype('boolean'),
+  'int': _to_int,
+  'float32': lambda s: pd.to_numeric(s).astype('float32'),
+  'datetime': pd.to_datetime,
+}
+
+def apply_schema(df, schema):
+  for column, kind in schema.items():
+    if column not in df.columns:
+      continue
+    if kind not in _converters:
+      raise ValueError('unknown dtype kind {} for column {}'.format(kind, column))
+    df[column] = _converters[kind](df[column])
+  return df
+
+def concat_frames(frames):
+  # pd.concat turns categoricals with different categories into objects,
+  # so align the categories first (used when merging incremental deltas and
+  # the chunks of a streamed fetch)
+  frames = [frame for frame in frames if frame is not None]
+  if len(frames) < 2:
+    return pd.concat(frames, ignore_index = True)
+
+  frames = [frame.copy(deep = False) for frame in frames]
+  for column in frames[0].columns:
+    if not all(column in frame.columns and isinstance(frame[column].dtype, pd.CategoricalDtype) for frame in frames):
+      continue
+    values = [frame[column] for frame in frames]
+    try:
+      # sorted like astype('category') on the whole column would be
+      categories = pd.api.types.union_categoricals(values, sort_categories = True).categories
+    except TypeError:
+      categories = pd.api.types.union_categoricals(values).categories
+    for frame in frames:
+      frame[column] = frame[column].cat.set_categories(categories)
+
+  return pd.concat(frames, ignore_index = True)
+
+def memory_usage(df):
+  # bytes per column, including python objects behind object columns
+  return df.memory_usage(index = True, deep = True)
+
+def memory_report(name, before, after):
+  # before/after memory_usage series as a table, and a one line log summary
+  report = pd.DataFrame({'before': before, 'after': after})
+  report['saved %'] = np.round((1 - report['after'] / report['before']) * 100, 1)
+
+  logger.info('%s memory: %.1f MB -> %.1f MB\n%s',
+    name,
+    before.sum() / 1024 ** 2,
+    after.sum() / 1024 ** 2,
+    report.to_string())
+  return report
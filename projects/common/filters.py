@@ -0,0 +1,89 @@
+import numpy as np
+
+from common import memo, time_index
+
+## Lazy row filters.
+# Widgets add named predicates to a LazyFilter instead of each one indexing
+# the table into a new copy. A predicate is evaluated into a boolean mask
+# over the whole table once per table version and cached under its key, so
+# sections that share a filter (the same product selection, say) share the
+# mask. Masks are and-ed over the row range of the sorted time column, and
+# the table is indexed once per distinct set of filters, also cached.
+#
+#   orders = LazyFilter(customer_order) \
+#     .between('created_at_tz', start_date, end_date) \
+#     .where(('product', 'mattress'), lambda df: df['has_mattress'] == True)
+#   orders.collect()
+#
+# Collected frames are shared between callers and must not be modified.
+
+class LazyFilter:
+
+  def __init__(self, df, predicates = (), rows = (0, None)):
+    self.df = df
+    # (key, predicate) pairs, predicate(df) -> boolean mask of the whole table
+    self.predicates = tuple(predicates)
+    # positional [start, stop) range, stop None is the end of the table
+    self.rows = rows
+
+  def where(self, key, predicate):
+    # key identifies the predicate and its parameters, e.g. ('product',
+    # 'mattress'). a None predicate (an 'all' selection) adds nothing
+    if predicate is None:
+      return self
+    return LazyFilter(self.df, self.predicates + ((key, predicate),), self.rows)
+
+  def between(self, column, start = None, end = None):
+    # rows with column in [start, end], column must be sorted ascending.
+    # a binary search, see common/time_index.py
+    lo, hi = time_index.time_range_positions(self.df[column], start, end)
+    start, stop = self._range()
+    start, stop = max(start, lo), min(stop, hi)
+    return LazyFilter(self.df, self.predicates, (start, max(start, stop)))
+
+  def _range(self):
+    start, stop = self.rows
+    return start, len(self.df) if stop is None else stop
+
+  def key(self):
+    # identifies the filtered rows of self.df, whatever order filters were added in
+    return (self._range(), tuple(sorted((key for key, _ in self.predicates), key = repr)))
+
+  def mask(self):
+    # combined mask over the row range, None when there are no predicates
+    start, stop = self._range()
+    combined = None
+    for key, predicate in self.predicates:
+      sub_mask = _predicate_mask(self.df, key, predicate)[start:stop]
+      combined = sub_mask if combined is None else combined & sub_mask
+    return combined
+
+  def full_mask(self):
+    # mask over the whole table, row range included
+    start, stop = self._range()
+    mask = np.zeros(len(self.df), dtype = bool)
+    range_mask = self.mask()
+    mask[start:stop] = True if range_mask is None else range_mask
+    return mask
+
+  def count(self):
+    mask = self.mask()
+    start, stop = self._range()
+    return stop - start if mask is None else int(mask.sum())
+
+  def collect(self):
+    return _collect(self.df, self.key(), self)
+
+
+@memo.memoize(max_entries = 64, max_bytes = 512 * 1024 ** 2,
+  key = lambda df, key, predicate: (df, key))
+def _predicate_mask(df, key, predicate):
+  return np.asarray(predicate(df), dtype = bool)
+
+@memo.memoize(max_entries = 16, max_bytes = 2 * 1024 ** 3,
+  key = lambda df, key, lazy: (df, key))
+def _collect(df, key, lazy):
+  start, stop = lazy._range()
+  rows = df.iloc[start:stop] if (start, stop) != (0, len(df)) else df
+  mask = lazy.mask()
+  return rows if mask is None else rows[mask]
@@ -0,0 +1,78 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+## Server side histograms.
+# px.histogram / go.Histogram ship every raw value to the browser and bin
+# there, so the payload grows with the number of rows, and a bin width of 1
+# over skewed data can produce thousands of bins. These helpers bin with
+# numpy, cap the number of bins and return a small table that is plotted as
+# a bar trace, so the payload only depends on the number of bins.
+
+MAX_BINS = 200
+
+def bin_edges(values, bin_width = None, nbins = None, max_bins = MAX_BINS):
+  # edges aligned on multiples of bin_width, so overlaid histograms that use
+  # the same width line up. the width is widened when it would exceed max_bins
+  values = [np.asarray(v, dtype = 'float64') for v in (values if isinstance(values, (list, tuple)) else [values])]
+  values = [v[~np.isnan(v)] for v in values]
+  values = [v for v in values if len(v)]
+  if not values:
+    return np.array([0.0, 1.0])
+
+  low = min(v.min() for v in values)
+  high = max(v.max() for v in values)
+
+  if bin_width is None:
+    nbins = min(nbins or max_bins, max_bins)
+    if high == low:
+      return np.array([low - 0.5, high + 0.5])
+    return np.linspace(low, high, nbins + 1)
+
+  # widen to a multiple of the requested width when there would be too many
+  # bins, the extra bin leaves room for aligning the start
+  needed = (high - low) / max(max_bins - 2, 1)
+  if needed > bin_width:
+    bin_width = bin_width * math.ceil(needed / bin_width)
+
+  start = math.floor(low / bin_width) * bin_width
+  count = max(1, int(math.floor((high - start) / bin_width)) + 1)
+  return start + bin_width * np.arange(count + 1)
+
+def histogram(values, edges = None, bin_width = None, nbins = None, max_bins = MAX_BINS, histnorm = None):
+  # counts per bin as a DataFrame with left/right/center/width/count columns,
+  # plus 'percent' when histnorm='percent' (same meaning as in plotly)
+  values = np.asarray(pd.Series(values).dropna(), dtype = 'float64')
+  if edges is None:
+    edges = bin_edges(values, bin_width, nbins, max_bins)
+
+  counts, edges = np.histogram(values, bins = edges)
+  hist = pd.DataFrame({
+    'left': edges[:-1],
+    'right': edges[1:],
+    'center': (edges[:-1] + edges[1:]) / 2,
+    'width': np.diff(edges),
+    'count': counts,
+  })
+  if histnorm == 'percent':
+    total = counts.sum()
+    hist['percent'] = hist['count'] / total * 100 if total else 0.0
+
+  return hist
+
+def bar_trace(hist, y = 'count', **kwargs):
+  # pre-binned histogram as a plotly bar trace, kwargs go to go.Bar
+  import plotly.graph_objects as go
+  return go.Bar(x = hist['center'],
+    y = hist[y],
+    width = hist['width'],
+    **kwargs)
+
+def figure(hist, x_title = None, y = 'count', **kwargs):
+  import plotly.graph_objects as go
+  fig = go.Figure(bar_trace(hist, y = y, **kwargs))
+  fig.update_layout(bargap = 0)
+  fig.update_xaxes(title_text = x_title)
+  fig.update_yaxes(title_text = y)
+  return fig
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+
+## HyperLogLog distinct counts.
+# One sketch (2^precision one-byte registers) per partition of a table, e.g.
+# per (year_month, flags). Sketches merge by taking the register-wise max,
+# so the distinct count of any union of partitions is answered from the
+# sketches alone, without touching the rows again. The relative standard
+# error is 1.04 / sqrt(2^precision): 1.6% at 12, 1.15% at 13, 0.8% at 14.
+#
+# Building is vectorized: values are hashed with pandas' 64 bit hash, the
+# top bits pick the register and the position of the first set bit of the
+# rest is the rank, maxed per (partition, register) with a groupby.
+
+DEFAULT_PRECISION = 13
+
+def standard_error(precision = DEFAULT_PRECISION):
+  return 1.04 / np.sqrt(1 << precision)
+
+def _bit_length(values):
+  # bit length of uint64 values. exact: each 32 bit half is exactly
+  # representable as a float64, and frexp returns its bit length
+  _, high = np.frexp((values >> np.uint64(32)).astype(np.float64))
+  _, low = np.frexp((values & np.uint64(0xFFFFFFFF)).astype(np.float64))
+  return np.where(high > 0, high + 32, low)
+
+def _registers_and_ranks(values, precision):
+  hashes = pd.util.hash_array(np.asarray(values))
+  register = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+  rest = hashes << np.uint64(precision)
+  # leading zeros of the remaining 64 - precision bits, plus one
+  rank = np.minimum(65 - _bit_length(rest), 64 - precision + 1)
+  return register, rank.astype(np.uint8)
+
+def estimate(registers):
+  # distinct count of one (merged) sketch
+  registers = np.asarray(registers)
+  m = len(registers)
+  alpha = 0.7213 / (1 + 1.079 / m)
+  raw = alpha * m * m / np.sum(np.exp2(-registers.astype(np.float64)))
+  zeros = int(np.count_nonzero(registers == 0))
+  if raw <= 2.5 * m and zeros:
+    # small range correction, linear counting
+    return m * np.log(m / zeros)
+  return raw
+
+
+class Sketches:
+
+  def __init__(self, keys, registers, precision):
+    # keys: one row per partition, registers: (partitions, 2^precision) uint8
+    self.keys = keys
+    self.registers = registers
+    self.precision = precision
+
+  @classmethod
+  def build(cls, df, value_column, partition_columns, precision = DEFAULT_PRECISION):
+    grouped = df.groupby(partition_columns, observed = True, sort = True)
+    partition = grouped.ngroup().to_numpy()
+    keys = grouped.size().index.to_frame(index = False)
+
+    # rows with a null key have no group (ngroup is -1) and null values are
+    # not counted, as in groupby(...).nunique()
+    values = df[value_column]
+    valid = (partition >= 0) & values.notna().to_numpy()
+    if not valid.all():
+      partition, values = partition[valid], values[valid]
+
+    m = 1 << precision
+    register, rank = _registers_and_ranks(values.to_numpy(), precision)
+    cell = partition.astype(np.int64) * m + register
+    maxima = pd.Series(rank).groupby(cell).max()
+
+    registers = np.zeros(len(keys) * m, dtype = np.uint8)
+    registers[maxima.index.to_numpy()] = maxima.to_numpy()
+    return cls(keys, registers.reshape(len(keys), m), precision)
+
+  @property
+  def error(self):
+    return standard_error(self.precision)
+
+  def count(self, selected = None):
+    # distinct values over the selected partitions (boolean array over keys)
+    registers = self.registers if selected is None else self.registers[np.asarray(selected)]
+    if len(registers) == 0:
+      return 0.0
+    return estimate(registers.max(axis = 0))
+
+  def count_by(self, column, selected = None):
+    # distinct values per value of a partition column, over the selected partitions
+    keys = self.keys if selected is None else self.keys[np.asarray(selected)]
+    registers = self.registers if selected is None else self.registers[np.asarray(selected)]
+    counts = {}
+    for value, positions in keys.groupby(column, observed = True, sort = True).indices.items():
+      counts[value] = estimate(registers[positions].max(axis = 0))
+    return pd.Series(counts, name = 'count', dtype = np.float64)
+
+  def nbytes(self):
+    return self.registers.nbytes
@@ -0,0 +1,278 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+import pandas as pd
+
+from common import db, dtypes, time_index
+from common.result_cache import DEFAULT_DIRECTORY
+
+## Watermark based incremental loading.
+# The first load pulls the whole table, after that only rows with a timestamp
+# at or after (high-water mark - lookback) are fetched. The local rows in that
+# window are replaced by the fetched ones, which picks up late arriving and
+# updated rows without needing a primary key. Derived columns are computed by
+# `derive` on the fetched rows only, chunk by chunk. The table is kept sorted
+# on the timestamp so the window, and date filters downstream, are binary
+# searches.
+#
+# With a shared store (common/shared_store.py) the table is refreshed by one
+# process per host at a time and published, the others map the published
+# version instead of querying and holding their own copy.
+#
+# version only changes when the rows do: a delta that brings nothing new
+# keeps the frame, its version and the published file, so caches keyed on
+# the version stay valid between refreshes of an unchanged table.
+
+class IncrementalTable:
+
+  def __init__(self, table, timestamp_column,
+      columns = '*',
+      lookback = timedelta(days = 3),
+      derive = None,
+      refresh_interval = 300,
+      full_refresh_interval = 24 * 3600,
+      snapshot_interval = 3600,
+      snapshot_dir = DEFAULT_DIRECTORY,
+      backend = None,
+      store = None):
+    self.table = table
+    self.timestamp_column = timestamp_column
+    self.columns = columns
+    self.lookback = lookback
+    self.derive = derive
+    self.refresh_interval = refresh_interval
+    self.full_refresh_interval = full_refresh_interval
+    self.snapshot_interval = snapshot_interval
+    self.backend = backend
+    self.store = store
+    self.name = ''.join(c if c.isalnum() else '_' for c in table).strip('_')
+
+    self.frame = None
+    self.watermark = None
+    # bumped whenever the rows change, cheap cache key for derived data
+    self.version = 0
+    # identifies the rows across processes, published with them
+    self.content_id = None
+    self.last_refresh = 0
+    self.last_full_refresh = 0
+    self.last_snapshot = 0
+    self._lock = threading.RLock()
+    # version of the shared store the frame was taken from
+    self._store_version = None
+
+    self.snapshot_path = None
+    if snapshot_dir is not None:
+      os.makedirs(snapshot_dir, exist_ok = True)
+      self.snapshot_path = os.path.join(snapshot_dir, 'incremental_' + self.name + '.parquet')
+
+  def _select(self):
+    return 'SELECT {} FROM {}'.format(self.columns, self.table)
+
+  def _fetch(self, sql, params = None):
+    # derive runs on each chunk as it is streamed in, see db.read_sql
+    df = db.read_sql(sql, params, backend = self.backend, convert = self.derive)
+    return time_index.sort_by_time(df, self.timestamp_column)
+
+  def _load_snapshot(self):
+    if self.snapshot_path is None or not os.path.exists(self.snapshot_path):
+      return False
+    import pyarrow.parquet as pq
+    try:
+      table = pq.read_table(self.snapshot_path)
+    except (OSError, ValueError):
+      return False
+
+    frame = table.to_pandas()
+    meta = json.loads((table.schema.metadata or {}).get(b'incremental', b'{}'))
+    self.frame = time_index.sort_by_time(frame, self.timestamp_column)
+    self.version += 1
+    self.content_id = meta.get('content_id') or uuid.uuid4().hex
+    self.watermark = frame[self.timestamp_column].max() if len(frame) else None
+    self.last_snapshot = os.path.getmtime(self.snapshot_path)
+    # a snapshot is only as trustworthy as the full load it started from.
+    # without the timestamp (older snapshots) a full refresh is due
+    self.last_full_refresh = meta.get('last_full_refresh', 0)
+    return True
+
+  def _write_snapshot(self):
+    if self.snapshot_path is None:
+      return
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # the full refresh time travels with the rows, rewriting the file does
+    # not reset it
+    table = pa.Table.from_pandas(self.frame, preserve_index = False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[b'incremental'] = json.dumps({
+      'last_full_refresh': self.last_full_refresh,
+      'content_id': self.content_id,
+    }).encode()
+
+    fd, tmp_path = tempfile.mkstemp(dir = os.path.dirname(self.snapshot_path), suffix = '.tmp')
+    os.close(fd)
+    try:
+      pq.write_table(table.replace_schema_metadata(metadata), tmp_path)
+      os.replace(tmp_path, self.snapshot_path)
+    except BaseException:
+      os.remove(tmp_path)
+      raise
+    self.last_snapshot = time.time()
+
+  def _replace(self, frame, compare = True):
+    # takes frame as the table, a new version only if its rows differ
+    if compare and self.frame is not None and same_rows(self.frame, frame):
+      return False
+    self.frame = frame
+    self.version += 1
+    self.content_id = uuid.uuid4().hex
+    return True
+
+  def full_refresh(self):
+    with self._lock:
+      self._replace(self._fetch(self._select()))
+      self.watermark = self.frame[self.timestamp_column].max() if len(self.frame) else None
+      self.last_refresh = self.last_full_refresh = time.time()
+      self._write_snapshot()
+      return self.frame
+
+  def refresh(self, force = False):
+    if self.store is None:
+      return self._refresh(force)
+
+    self._adopt()
+    if not force and not self._due():
+      return self.frame
+
+    with self.store.lock(self.name):
+      # another process may have refreshed while we waited for the lock
+      self._adopt()
+      if force or self._due():
+        version = self.version
+        self._refresh(force)
+        if self.version != version or self._store_version is None:
+          self._publish()
+        else:
+          # nothing new: the published file stays, the others learn it was checked
+          self.store.touch(self.name, checked_at = self.last_refresh,
+            last_full_refresh = self.last_full_refresh)
+      return self.frame
+
+  def _due(self):
+    now = time.time()
+    return (self.frame is None
+      or now - self.last_refresh >= self.refresh_interval
+      or (self.full_refresh_interval is not None and now - self.last_full_refresh > self.full_refresh_interval))
+
+  def _adopt(self):
+    # take the published version if it is newer than the one we hold
+    pointer = self.store.pointer(self.name)
+    if pointer is None:
+      return
+    if pointer['version'] == self._store_version:
+      self._checked(pointer)
+      return
+    pointer, frame = self.store.read(self.name)
+    if frame is None:
+      return
+
+    with self._lock:
+      if pointer['meta'].get('content_id') is None or pointer['meta'].get('content_id') != self.content_id:
+        self.version += 1
+        self.content_id = pointer['meta'].get('content_id')
+      # the same rows otherwise, mapped instead of held: the version stays
+      self.frame = frame
+      self._store_version = pointer['version']
+      self.watermark = frame[self.timestamp_column].max() if len(frame) else None
+      self.last_refresh = pointer['published_at']
+      self.last_full_refresh = pointer['meta'].get('last_full_refresh', pointer['published_at'])
+      self._checked(pointer)
+
+  def _checked(self, pointer):
+    # a refresh by another process that found nothing new, see refresh
+    self.last_refresh = max(self.last_refresh, pointer.get('checked_at', 0))
+    self.last_full_refresh = max(self.last_full_refresh, pointer.get('last_full_refresh', 0))
+
+  def _publish(self):
+    published = self.store.publish(self.name, self.frame,
+      meta = {'last_full_refresh': self.last_full_refresh, 'content_id': self.content_id})
+    pointer, frame = self.store.read(self.name)
+    if pointer is not None and pointer['version'] == published:
+      # same rows, now mapped: this process' private copy can go
+      with self._lock:
+        self.frame = frame
+        self._store_version = published
+
+  def _refresh(self, force = False):
+    now = time.time()
+
+    if self.frame is None:
+      with self._lock:
+        # checked again under the lock, so concurrent sessions load only once
+        if self.frame is None:
+          if not self._load_snapshot():
+            return self.full_refresh()
+          # a snapshot from a previous process still needs the delta below
+          force = True
+
+    if self.full_refresh_interval is not None and now - self.last_full_refresh > self.full_refresh_interval:
+      # periodic full reload picks up deleted rows, which a delta cannot see
+      return self.full_refresh()
+
+    if not force and now - self.last_refresh < self.refresh_interval:
+      return self.frame
+
+    if self.watermark is None:
+      return self.full_refresh()
+
+    with self._lock:
+      since = self.watermark - self.lookback
+      sql = self._select() + ' WHERE {} >= :since'.format(self.timestamp_column)
+      delta = self._fetch(sql, {'since': since.to_pydatetime()})
+
+      # replace everything inside the lookback window with the fresh rows,
+      # unless they are the rows already there
+      start, _ = time_index.time_range_positions(self.frame[self.timestamp_column], start = since)
+      changed = False
+      if not same_rows(self.frame.iloc[start:], delta):
+        changed = self._replace(dtypes.concat_frames([self.frame.iloc[:start], delta]), compare = False)
+      if len(delta):
+        self.watermark = max(self.watermark, delta[self.timestamp_column].max())
+      self.last_refresh = now
+
+      if changed and now - self.last_snapshot > self.snapshot_interval:
+        self._write_snapshot()
+
+      return self.frame
+
+  def current(self):
+    # (version, frame) read together, so caches keyed on the version are
+    # built from that version's rows even if another session refreshes
+    with self._lock:
+      return self.version, self.frame
+
+  def warm(self):
+    # bring the table and its snapshot up to date, e.g. before traffic arrives
+    self.refresh(force = True)
+    with self._lock:
+      self._write_snapshot()
+    return self.frame
+
+
+def same_rows(a, b):
+  # same columns and values in the same order. categoricals are compared by
+  # value, a delta's categories only cover its own rows
+  if len(a) != len(b) or list(a.columns) != list(b.columns):
+    return False
+  for column in a.columns:
+    left, right = a[column], b[column]
+    if isinstance(left.dtype, pd.CategoricalDtype) or isinstance(right.dtype, pd.CategoricalDtype):
+      left, right = left.astype(object), right.astype(object)
+    if not left.reset_index(drop = True).equals(right.reset_index(drop = True)):
+      return False
+  return True
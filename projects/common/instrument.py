@@ -0,0 +1,136 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+from common import memo
+
+## Per component instrumentation.
+# Wraps component functions and records wall time, rows in and out, memory
+# and memoization hits/misses for every call in the current script run. Each
+# record is also logged as one json line on the 'instrument' logger. Records
+# are kept per thread, which in streamlit means per session.
+#
+# Memory tracking uses tracemalloc, which slows allocations down, so it is
+# only on when INSTRUMENT_MEMORY=1. Its peak is process wide and is never
+# reset here (that would lose the peak of an enclosing span): a span's peak
+# is the tracemalloc peak if it rose during the span, otherwise the highest
+# of its own end and its children's peaks, which are folded into the parent
+# on exit.
+#
+# configure_logging sends these records, and the load time memory reports
+# of common/dtypes.py, to stderr at LOG_LEVEL (INFO by default). streamlit
+# only sets up its own logger, without it both are dropped.
+
+logger = logging.getLogger('instrument')
+
+TRACK_MEMORY = os.getenv('INSTRUMENT_MEMORY', '0') == '1'
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+
+_local = threading.local()
+
+def configure_logging(level = LOG_LEVEL):
+  # handlers for the 'common' and 'instrument' loggers, added once per
+  # process however often the script reruns
+  for name in ('common', 'instrument'):
+    log = logging.getLogger(name)
+    log.setLevel(level)
+    if not any(getattr(handler, 'instrument', False) for handler in log.handlers):
+      handler = logging.StreamHandler()
+      handler.instrument = True
+      handler.setFormatter(logging.Formatter('%(asctime)s %(name)s %(levelname)s %(message)s'))
+      log.addHandler(handler)
+
+def start_run():
+  # call at the top of the script, records of the previous rerun are dropped
+  _local.records = []
+  _local.depth = 0
+  # peak memory seen so far by each open span, innermost last
+  _local.peaks = []
+  if TRACK_MEMORY and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+def records():
+  return list(getattr(_local, 'records', []))
+
+def _rows(value):
+  if isinstance(value, (pd.DataFrame, pd.Series)):
+    return len(value)
+  if isinstance(value, tuple) and value:
+    return _rows(value[0])
+  return None
+
+@contextmanager
+def span(name, rows_in = None):
+  # time a block, the yielded record can be updated (e.g. rows_out)
+  if not hasattr(_local, 'records'):
+    start_run()
+
+  record = {'name': name, 'depth': _local.depth, 'rows_in': rows_in, 'rows_out': None}
+  hits, misses = memo.thread_counts()
+  tracing = tracemalloc.is_tracing()
+  if tracing:
+    memory_before, peak_before = tracemalloc.get_traced_memory()
+    _local.peaks.append(memory_before)
+
+  _local.depth += 1
+  start = time.perf_counter()
+  try:
+    yield record
+  finally:
+    record['seconds'] = round(time.perf_counter() - start, 6)
+    _local.depth -= 1
+
+    if tracing:
+      current, peak = tracemalloc.get_traced_memory()
+      own = max(_local.peaks.pop(), current)
+      if peak > peak_before:
+        # a new high was reached during the span
+        own = max(own, peak)
+      if _local.peaks:
+        _local.peaks[-1] = max(_local.peaks[-1], own)
+      record['memory_mb'] = round((current - memory_before) / 1024 ** 2, 3)
+      record['peak_mb'] = round((own - memory_before) / 1024 ** 2, 3)
+
+    hits_after, misses_after = memo.thread_counts()
+    record['cache_hits'] = hits_after - hits
+    record['cache_misses'] = misses_after - misses
+
+    _local.records.append(record)
+    logger.info(json.dumps(record))
+
+def instrumented(name = None):
+  # decorator version of span, rows are taken from the first DataFrame
+  # argument and from the result
+  def decorator(func):
+    label = name or func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+      rows_in = next((_rows(arg) for arg in args if _rows(arg) is not None), None)
+      with span(label, rows_in) as record:
+        result = func(*args, **kwargs)
+        record['rows_out'] = _rows(result)
+      return result
+    return wrapper
+  return decorator
+
+def render_panel(st):
+  # sidebar table of this run's records, off unless ticked so a normal run
+  # pays nothing for it. st is the streamlit module
+  if not st.sidebar.checkbox('Show debug panel', value = False, key = 'instrument_debug_panel'):
+    return
+
+  st.sidebar.header('Debug - component timings')
+  table = pd.DataFrame(records())
+  if len(table):
+    table['name'] = ['  ' * depth + name for depth, name in zip(table['depth'], table['name'])]
+    table = table.drop(columns = ['depth'])
+  st.sidebar.dataframe(table)
+  st.sidebar.write('Memoization', pd.DataFrame(memo.cache_stats()).T)
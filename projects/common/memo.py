@@ -0,0 +1,156 @@
+import functools
+import hashlib
+import itertools
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+
+import pandas as pd
+
+## Keyed, bounded memoization.
+# st.cache hashes every DataFrame argument (and its output) on each call. Here
+# a DataFrame argument is keyed by a version token that is assigned the first
+# time the object is seen and stays the same for its lifetime, so a lookup
+# costs a dict access no matter how big the table is. Entries are evicted
+# least recently used first once max_entries or max_bytes is exceeded.
+#
+# Results are shared between callers and must not be mutated.
+
+_counter = itertools.count(1)
+_tokens = {}
+_tokens_lock = threading.Lock()
+
+# hits/misses of the calling thread over all caches, see thread_counts
+_thread = threading.local()
+
+def version_token(obj):
+  # cheap identity based version for objects that are replaced, not mutated,
+  # when their data changes (loaded tables, cached results)
+  key = id(obj)
+  with _tokens_lock:
+    entry = _tokens.get(key)
+    if entry is not None and entry[0]() is obj:
+      return entry[1]
+
+    token = next(_counter)
+    def forget(_, key = key, token = token):
+      with _tokens_lock:
+        if key in _tokens and _tokens[key][1] == token:
+          del _tokens[key]
+    _tokens[key] = (weakref.ref(obj, forget), token)
+    return token
+
+def _size_of(value):
+  # shallow size, object columns are dominated by shared python objects
+  if isinstance(value, pd.DataFrame):
+    return int(value.memory_usage(index = True, deep = False).sum())
+  if isinstance(value, pd.Series):
+    return int(value.memory_usage(index = True, deep = False))
+  return sys.getsizeof(value)
+
+
+class LRUCache:
+
+  def __init__(self, max_entries = 32, max_bytes = None):
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+    self.hits = 0
+    self.misses = 0
+    self.bytes = 0
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key, default = None):
+    with self._lock:
+      if key in self._entries:
+        self._entries.move_to_end(key)
+        self.hits += 1
+        _thread.hits = getattr(_thread, 'hits', 0) + 1
+        return self._entries[key][0]
+      self.misses += 1
+      _thread.misses = getattr(_thread, 'misses', 0) + 1
+      return default
+
+  def put(self, key, value):
+    size = _size_of(value)
+    with self._lock:
+      if key in self._entries:
+        self.bytes -= self._entries.pop(key)[1]
+      self._entries[key] = (value, size)
+      self.bytes += size
+
+      while self._entries and (len(self._entries) > self.max_entries
+          or (self.max_bytes is not None and self.bytes > self.max_bytes and len(self._entries) > 1)):
+        _, (_, evicted) = self._entries.popitem(last = False)
+        self.bytes -= evicted
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+      self.bytes = 0
+
+  def info(self):
+    return {
+      'hits': self.hits,
+      'misses': self.misses,
+      'entries': len(self._entries),
+      'bytes': self.bytes,
+    }
+
+
+# caches live here rather than on the decorated function, so functions that
+# are redefined on every streamlit rerun keep their cache
+_registry = {}
+_registry_lock = threading.Lock()
+_missing = object()
+
+def _key_part(value):
+  if isinstance(value, (pd.DataFrame, pd.Series)):
+    return ('version', version_token(value))
+  if isinstance(value, (list, tuple)):
+    return tuple(_key_part(item) for item in value)
+  return value
+
+def memoize(max_entries = 32, max_bytes = None, key = None):
+  # key, if given, maps the call arguments to the parts that identify the
+  # result (e.g. the filter state a derived table was built from)
+  def decorator(func):
+    code = getattr(func, '__code__', None)
+    code_hash = hashlib.sha1(code.co_code).hexdigest() if code else ''
+    name = '{}.{}:{}'.format(func.__module__, func.__qualname__, code_hash)
+
+    with _registry_lock:
+      cache = _registry.get(name)
+      if cache is None:
+        cache = _registry[name] = LRUCache(max_entries, max_bytes)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+      if key is not None:
+        entry_key = _key_part(tuple(key(*args, **kwargs)))
+      else:
+        entry_key = tuple(_key_part(arg) for arg in args) \
+          + tuple((k, _key_part(v)) for k, v in sorted(kwargs.items()))
+
+      result = cache.get(entry_key, _missing)
+      if result is _missing:
+        result = func(*args, **kwargs)
+        cache.put(entry_key, result)
+      return result
+
+    wrapper.cache = cache
+    wrapper.cache_info = cache.info
+    wrapper.cache_clear = cache.clear
+    return wrapper
+  return decorator
+
+def cache_stats():
+  # hit/miss counters of every memoized function, by name
+  with _registry_lock:
+    return {name.split(':')[0]: cache.info() for name, cache in _registry.items()}
+
+def thread_counts():
+  # (hits, misses) of lookups made by the current thread, over all caches.
+  # cache_stats counts every session, deltas of these only the caller's
+  return getattr(_thread, 'hits', 0), getattr(_thread, 'misses', 0)
@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+
+## Mergeable per group moments.
+# count, mean and M2 (sum of squared deviations from the mean) per group,
+# from which the mean, variance and std follow. Moments of disjoint sets of
+# rows merge exactly (Chan et al.'s pairwise update), so the stats of a table
+# are updated with those of the new rows instead of recomputed over all of
+# them, and per chunk moments combine into the table's.
+#
+# Rows are grouped by the codes of a categorical column (factorized
+# otherwise) and reduced with bincount, one vectorized pass with no groupby.
+# Per row values (the limits of an outlier cut, say) are looked up through
+# the same codes rather than merged onto the table.
+#
+#   moments = GroupMoments.from_groups(df['timezone'], df['users'])
+#   moments = moments.update(new_rows['timezone'], new_rows['users'])
+#   df[moments.within(df['timezone'], df['users'], sigmas = 5)]
+
+class GroupMoments:
+
+  def __init__(self, keys, count, mean, m2, dtype = None):
+    # one entry per key, groups without rows have count 0. dtype is the
+    # categorical dtype of the group column, for frame()
+    self.keys = pd.Index(keys)
+    self.count = np.asarray(count, dtype = np.int64)
+    self._mean = np.asarray(mean, dtype = np.float64)
+    self.m2 = np.asarray(m2, dtype = np.float64)
+    self.dtype = dtype
+
+  @classmethod
+  def from_codes(cls, keys, codes, values, dtype = None):
+    # codes index keys, -1 (no group) and NaN values are left out, as in a groupby
+    values = np.asarray(values, dtype = np.float64)
+    valid = (codes >= 0) & ~np.isnan(values)
+    codes, values = codes[valid], values[valid]
+
+    count = np.bincount(codes, minlength = len(keys))
+    sums = np.bincount(codes, weights = values, minlength = len(keys))
+    mean = np.divide(sums, count, out = np.zeros(len(keys)), where = count > 0)
+    # second pass over the deviations, more accurate than sums of squares
+    m2 = np.bincount(codes, weights = (values - mean[codes]) ** 2, minlength = len(keys))
+    return cls(keys, count, mean, m2, dtype)
+
+  @classmethod
+  def from_groups(cls, groups, values):
+    if isinstance(groups.dtype, pd.CategoricalDtype):
+      return cls.from_codes(groups.cat.categories, groups.cat.codes.to_numpy(), values, groups.dtype)
+    codes, keys = pd.factorize(groups, sort = True)
+    return cls.from_codes(keys, codes, values)
+
+  def merge(self, other):
+    # moments of the rows of both, which must not overlap
+    keys = self.keys.append(other.keys[~other.keys.isin(self.keys)])
+    size = len(keys)
+
+    def scatter(positions, values):
+      out = np.zeros(size, dtype = values.dtype)
+      out[positions] = values
+      return out
+
+    positions = keys.get_indexer(other.keys)
+    count_a, mean_a, m2_a = (scatter(np.arange(len(self.keys)), values) for values in (self.count, self._mean, self.m2))
+    count_b, mean_b, m2_b = (scatter(positions, values) for values in (other.count, other._mean, other.m2))
+
+    count = count_a + count_b
+    delta = mean_b - mean_a
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+      mean = np.where(count > 0, mean_a + delta * count_b / count, 0.0)
+      m2 = np.where(count > 0, m2_a + m2_b + delta ** 2 * count_a * count_b / count, 0.0)
+    dtype = self.dtype if self.dtype == other.dtype else None
+    return GroupMoments(keys, count, mean, m2, dtype)
+
+  def update(self, groups, values):
+    # merged with the moments of new rows
+    return self.merge(GroupMoments.from_groups(groups, values))
+
+  def mean(self):
+    return np.where(self.count > 0, self._mean, np.nan)
+
+  def variance(self, ddof = 1):
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+      return np.where(self.count > ddof, self.m2 / (self.count - ddof), np.nan)
+
+  def std(self, ddof = 1):
+    return np.sqrt(self.variance(ddof))
+
+  def positions(self, groups):
+    # position of each row's group in keys, -1 for groups without moments
+    if isinstance(groups.dtype, pd.CategoricalDtype):
+      # one lookup per category, then per row through the codes
+      lookup = np.append(self.keys.get_indexer(groups.cat.categories), -1)
+      return lookup[groups.cat.codes.to_numpy()]
+    return self.keys.get_indexer(groups)
+
+  def within(self, groups, values, sigmas):
+    # rows whose value is at most mean + sigmas * std of their group. rows
+    # of unknown groups, or of groups with an undefined std, are not
+    limit = np.append(self.mean() + sigmas * self.std(), np.nan)
+    with np.errstate(invalid = 'ignore'):
+      return np.asarray(values, dtype = np.float64) <= limit[self.positions(groups)]
+
+  def frame(self, key_name, value_name):
+    # observed groups as a DataFrame (key, value-mean, value-std), in key order,
+    # the same as a groupby(key)[value].agg(['mean', 'std'])
+    observed = np.flatnonzero(self.count > 0)
+    keys = self.keys[observed]
+    if self.dtype is not None:
+      keys = pd.Categorical(keys, dtype = self.dtype)
+    frame = pd.DataFrame({
+      key_name: keys,
+      value_name + '-mean': self.mean()[observed],
+      value_name + '-std': self.std()[observed],
+    })
+    return frame.sort_values(key_name, kind = 'mergesort').reset_index(drop = True)
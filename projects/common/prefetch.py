@@ -0,0 +1,169 @@
+import argparse
+import importlib.util
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+## Concurrent query prefetch and cache warming.
+# Each app declares its warehouse queries as a QUERIES dict of name -> callable
+# in its compute module (optimizer.py, retention.py). A Prefetcher runs them
+# concurrently on a thread pool and reports progress, so the app can show a
+# progress bar instead of blocking on serial queries.
+#
+# The loaders write to the on-disk caches (result_cache, incremental table
+# snapshots), so warming them from a separate process before traffic
+# arrives makes the first session start warm:
+#
+#   python projects/common/prefetch.py projects/mkt_tv_optimizer/optimizer.py \
+#     projects/customer_retention_dashboard/retention.py [--every 3600]
+
+class Prefetcher:
+
+  def __init__(self, queries, max_workers = 4):
+    self.queries = dict(queries)
+    self.max_workers = max_workers
+    self.futures = {}
+    self.started = {}
+    self.finished = {}
+    self._lock = threading.Lock()
+    self._pool = None
+
+  def start(self):
+    with self._lock:
+      if self._pool is not None:
+        return self
+      self._pool = ThreadPoolExecutor(max_workers = self.max_workers, thread_name_prefix = 'prefetch')
+      for name, fetch in self.queries.items():
+        self.futures[name] = self._pool.submit(self._run, name, fetch)
+      # no new work is accepted, the threads exit once the queries are done
+      self._pool.shutdown(wait = False)
+    return self
+
+  def _run(self, name, fetch):
+    self.started[name] = time.time()
+    try:
+      return fetch()
+    finally:
+      self.finished[name] = time.time()
+
+  def progress(self):
+    # (finished, total) queries
+    return sum(future.done() for future in self.futures.values()), len(self.queries)
+
+  def done(self):
+    finished, total = self.progress()
+    return self._pool is not None and finished == total
+
+  def status(self):
+    rows = []
+    for name in self.queries:
+      future = self.futures.get(name)
+      if future is None or name not in self.started:
+        state = 'pending'
+      elif not future.done():
+        state = 'running'
+      elif future.exception() is not None:
+        state = 'failed'
+      else:
+        state = 'done'
+      seconds = self.finished.get(name, time.time()) - self.started[name] if name in self.started else None
+      rows.append({'query': name, 'state': state, 'seconds': seconds})
+    return rows
+
+  def result(self, name, timeout = None):
+    self.start()
+    return self.futures[name].result(timeout)
+
+  def wait(self, on_progress = None, poll = 0.25, timeout = None):
+    # block until every query finished, calling on_progress(finished, total)
+    # whenever the count changes. failures are raised by result(), not here
+    self.start()
+    deadline = None if timeout is None else time.time() + timeout
+    last = None
+    while True:
+      current = self.progress()
+      if on_progress is not None and current != last:
+        on_progress(*current)
+        last = current
+      if current[0] == current[1]:
+        return
+      if deadline is not None and time.time() > deadline:
+        raise TimeoutError('prefetch did not finish in {}s'.format(timeout))
+      time.sleep(poll)
+
+
+def streamlit_progress(prefetcher, st, label = 'Loading data'):
+  # progress bar for the first session while the prefetch runs
+  if prefetcher.done():
+    return
+  text = st.empty()
+  bar = st.progress(0)
+  def update(finished, total):
+    text.info('{} ... {} of {} queries done'.format(label, finished, total))
+    bar.progress(int(100 * finished / max(total, 1)))
+  prefetcher.wait(update)
+  text.empty()
+  bar.empty()
+
+def warm(queries, max_workers = 4, report = print):
+  prefetcher = Prefetcher(queries, max_workers).start()
+  prefetcher.wait(lambda finished, total: report('warming: {}/{} queries done'.format(finished, total)))
+  for row in prefetcher.status():
+    report('{query}: {state} in {seconds:.1f}s'.format(**row))
+    if row['state'] == 'failed':
+      report('  {!r}'.format(prefetcher.futures[row['query']].exception()))
+  return prefetcher
+
+def schedule(queries, interval, max_workers = 4, report = print):
+  # re-warm every interval seconds on a daemon thread, set the event to stop
+  stop = threading.Event()
+  def loop():
+    while not stop.is_set():
+      warm(queries, max_workers, report)
+      stop.wait(interval)
+  threading.Thread(target = loop, name = 'prefetch-schedule', daemon = True).start()
+  return stop
+
+def load_queries(path):
+  # QUERIES from a module file, with its directory importable like streamlit does
+  directory = os.path.dirname(os.path.abspath(path))
+  for entry in (directory, os.path.join(directory, '..')):
+    if entry not in sys.path:
+      sys.path.append(entry)
+  name = os.path.splitext(os.path.basename(path))[0]
+  spec = importlib.util.spec_from_file_location(name, path)
+  module = importlib.util.module_from_spec(spec)
+  sys.modules[name] = module
+  spec.loader.exec_module(module)
+  return {'{}.{}'.format(name, query): fetch for query, fetch in module.QUERIES.items()}
+
+def main(argv = None):
+  parser = argparse.ArgumentParser(description = 'Warm the on-disk query caches of the apps.')
+  parser.add_argument('modules', nargs = '+', help = 'module files declaring QUERIES')
+  parser.add_argument('--workers', type = int, default = 4)
+  parser.add_argument('--every', type = float, default = None,
+    help = 'keep running and re-warm every this many seconds')
+  args = parser.parse_args(argv)
+
+  queries = {}
+  for path in args.modules:
+    queries.update(load_queries(path))
+
+  if args.every is None:
+    prefetcher = warm(queries, args.workers)
+    failed = [row for row in prefetcher.status() if row['state'] == 'failed']
+    return 1 if failed else 0
+
+  stop = schedule(queries, args.every, args.workers)
+  try:
+    while not stop.is_set():
+      time.sleep(1)
+  except KeyboardInterrupt:
+    stop.set()
+  return 0
+
+if __name__ == '__main__':
+  sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+  sys.exit(main())
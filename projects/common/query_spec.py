@@ -0,0 +1,96 @@
+import operator
+
+from common import db, result_cache
+
+## Declarative query description.
+# A QuerySpec lists the columns and row filters a computation needs. It is
+# compiled into sql so that only those columns and rows leave the warehouse,
+# and can be applied to a DataFrame as the fallback for backends that cannot
+# push filters down (and to re-apply the same filters locally).
+
+_operators = {
+  '>': operator.gt,
+  '>=': operator.ge,
+  '<': operator.lt,
+  '<=': operator.le,
+  '=': operator.eq,
+  '!=': operator.ne,
+}
+
+
+class QuerySpec:
+
+  def __init__(self, table, columns = None, filters = ()):
+    # filters are (column, op, value) tuples, op is one of _operators or 'in'
+    self.table = table
+    self.columns = list(columns) if columns else None
+    self.filters = list(filters)
+
+    for _, op, _ in self.filters:
+      if op not in _operators and op != 'in':
+        raise ValueError('unsupported filter operator: {}'.format(op))
+
+  def to_sql(self):
+    select = ', '.join(self.columns) if self.columns else '*'
+    sql = 'SELECT {} FROM {}'.format(select, self.table)
+
+    clauses = []
+    params = {}
+    for i, (column, op, value) in enumerate(self.filters):
+      if op == 'in':
+        names = []
+        for j, item in enumerate(value):
+          name = 'p{}_{}'.format(i, j)
+          params[name] = item
+          names.append(':' + name)
+        clauses.append('{} IN ({})'.format(column, ', '.join(names)))
+      else:
+        name = 'p{}'.format(i)
+        params[name] = value
+        clauses.append('{} {} :{}'.format(column, op, name))
+
+    if clauses:
+      sql += ' WHERE ' + ' AND '.join(clauses)
+    return sql, params
+
+  def mask(self, df):
+    keep = None
+    for column, op, value in self.filters:
+      if op == 'in':
+        condition = df[column].isin(value)
+      else:
+        condition = _operators[op](df[column], value)
+      keep = condition if keep is None else keep & condition
+    return keep
+
+  def apply(self, df):
+    # pandas equivalent of to_sql, for data that was not pushed down
+    if self.filters:
+      df = df[self.mask(df)]
+    if self.columns:
+      df = df[self.columns]
+    return df
+
+
+def read_spec(spec, ttl = None, backend = None, convert = None, convert_chunk = None):
+  # fetch the rows described by spec, pushing the work into the backend when
+  # it supports it. convert_chunk runs on each chunk as it is fetched, before
+  # local filtering and caching, for example to parse timestamps that come
+  # back as strings. convert runs on the whole frame afterwards.
+  backend = backend or db.get_backend()
+
+  if getattr(backend, 'supports_pushdown', False):
+    sql, params = spec.to_sql()
+    df = result_cache.cached_read_sql(sql, params, ttl = ttl, backend = backend, convert = convert_chunk)
+    return convert(df) if convert else df
+
+  # filtered chunk by chunk, so the unfiltered table is never held whole
+  def chunk(df):
+    if convert_chunk is not None:
+      df = convert_chunk(df)
+    return spec.apply(df)
+  variant = '{!r} {}'.format(spec.to_sql(), db.callable_name(convert_chunk) if convert_chunk else None)
+
+  df = result_cache.cached_read_sql('SELECT * FROM {}'.format(spec.table), ttl = ttl, backend = backend,
+    convert = chunk, variant = variant)
+  return convert(df) if convert else df
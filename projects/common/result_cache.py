@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+import pandas as pd
+
+from common import db
+
+## Persistent query result cache.
+# Results are stored as parquet files keyed by a hash of the normalized sql
+# text, its parameters and the backend, next to a small json file holding
+# the ttl and bookkeeping. Unlike st.cache this survives restarts and is
+# shared by every process pointed at the same directory.
+
+DEFAULT_DIRECTORY = os.getenv('RESULT_CACHE_DIR',
+  os.path.join(tempfile.gettempdir(), 'projects_result_cache'))
+DEFAULT_MAX_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+DEFAULT_TTL = 24 * 3600
+
+_whitespace = re.compile(r'\s+')
+
+def normalize_sql(sql):
+  # collapse whitespace and drop a trailing semicolon, so that reformatting
+  # a query does not change its key. case is kept because of string literals.
+  return _whitespace.sub(' ', sql).strip().rstrip(';').strip()
+
+def query_key(sql, params = None, backend = None, variant = None):
+  # variant tells apart results of the same query stored after different
+  # conversions, e.g. the name of the per-chunk convert function
+  backend = backend or db.get_backend()
+  payload = {
+    'sql': normalize_sql(sql),
+    'params': params or {},
+    'backend': [str(part) for part in backend.key()],
+  }
+  if variant is not None:
+    payload['variant'] = variant
+  payload = json.dumps(payload, sort_keys = True, default = str)
+  return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+
+  def __init__(self, directory = DEFAULT_DIRECTORY, max_bytes = DEFAULT_MAX_BYTES, default_ttl = DEFAULT_TTL):
+    self.directory = directory
+    self.max_bytes = max_bytes
+    self.default_ttl = default_ttl
+    self._lock = threading.Lock()
+    os.makedirs(directory, exist_ok = True)
+
+  def _paths(self, key):
+    base = os.path.join(self.directory, key)
+    return base + '.parquet', base + '.json'
+
+  def _read_meta(self, meta_path):
+    try:
+      with open(meta_path) as f:
+        return json.load(f)
+    except (OSError, ValueError):
+      return None
+
+  def _write_atomic(self, path, write):
+    # write next to the target and rename, so readers in other processes
+    # never see a half written file
+    fd, tmp_path = tempfile.mkstemp(dir = self.directory, suffix = '.tmp')
+    os.close(fd)
+    try:
+      write(tmp_path)
+      os.replace(tmp_path, path)
+    except BaseException:
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+      raise
+
+  def get(self, sql, params = None, backend = None, variant = None):
+    data_path, meta_path = self._paths(query_key(sql, params, backend, variant))
+
+    meta = self._read_meta(meta_path)
+    if meta is None or not os.path.exists(data_path):
+      return None
+
+    if meta['ttl'] is not None and time.time() - meta['created_at'] > meta['ttl']:
+      self._remove(data_path, meta_path)
+      return None
+
+    try:
+      df = pd.read_parquet(data_path)
+    except (OSError, ValueError):
+      # lost a race with eviction or a corrupted file, treat as a miss
+      return None
+
+    # the data file mtime doubles as the LRU access time
+    try:
+      os.utime(data_path)
+    except OSError:
+      pass
+    return df
+
+  def put(self, sql, df, params = None, ttl = None, backend = None, variant = None):
+    key = query_key(sql, params, backend, variant)
+    data_path, meta_path = self._paths(key)
+
+    self._write_atomic(data_path, lambda path: df.to_parquet(path, index = False))
+    meta = {
+      'sql': normalize_sql(sql),
+      'params': params or {},
+      'variant': variant,
+      'created_at': time.time(),
+      'ttl': self.default_ttl if ttl is None else ttl,
+      'rows': len(df),
+    }
+    def write_meta(path):
+      with open(path, 'w') as f:
+        json.dump(meta, f, default = str)
+    self._write_atomic(meta_path, write_meta)
+
+    self.evict()
+    return key
+
+  def invalidate(self, sql = None, params = None, backend = None, variant = None):
+    # drop a single query, or everything when no sql is given
+    if sql is not None:
+      self._remove(*self._paths(query_key(sql, params, backend, variant)))
+      return
+
+    for name in os.listdir(self.directory):
+      if name.endswith(('.parquet', '.json')):
+        self._remove(os.path.join(self.directory, name))
+
+  def evict(self):
+    # least recently used entries go first until the cache fits in max_bytes
+    with self._lock:
+      entries = []
+      total = 0
+      for name in os.listdir(self.directory):
+        if not name.endswith('.parquet'):
+          continue
+        path = os.path.join(self.directory, name)
+        try:
+          stat = os.stat(path)
+        except OSError:
+          continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+
+      entries.sort()
+      for _, size, path in entries:
+        if total <= self.max_bytes:
+          break
+        self._remove(path, path[:-len('.parquet')] + '.json')
+        total -= size
+
+  def _remove(self, *paths):
+    for path in paths:
+      try:
+        os.remove(path)
+      except OSError:
+        pass
+
+
+_default_cache = None
+
+def get_cache():
+  global _default_cache
+  if _default_cache is None:
+    _default_cache = ResultCache()
+  return _default_cache
+
+def cached_read_sql(sql, params = None, ttl = None, cache = None, backend = None, convert = None, variant = None):
+  # db.read_sql with a persistent cache in front of it. with convert, the
+  # converted chunks are what gets cached, keyed on the convert function
+  cache = cache or get_cache()
+  if variant is None and convert is not None:
+    variant = db.callable_name(convert)
+
+  df = cache.get(sql, params, backend, variant)
+  if df is None:
+    df = db.read_sql(sql, params, backend, convert = convert)
+    cache.put(sql, df, params, ttl, backend, variant)
+  return df
+
+def invalidate(sql = None, params = None, backend = None, variant = None, convert = None):
+  # the entry cached_read_sql stored for the same arguments
+  if variant is None and convert is not None:
+    variant = db.callable_name(convert)
+  get_cache().invalidate(sql, params, backend, variant)
@@ -0,0 +1,204 @@
+import contextlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+## Cross-process dataset store.
+# One process fetches a table and publishes it as an uncompressed arrow IPC
+# file, every other process on the host memory-maps that file instead of
+# pulling and holding its own copy. Numeric and timestamp columns stay backed
+# by the shared page cache, only strings and categories are materialized.
+#
+# Each publish writes a new version file and then swaps a small json pointer
+# with os.replace, so readers see either the old or the new table, never a
+# half-written one. Files of superseded versions are removed after a grace
+# period; a reader that still maps one keeps its pages until it lets go.
+#
+# get_or_load takes a per-table file lock around the fetch, so N replicas
+# that start together cause a single warehouse query.
+
+DEFAULT_DIRECTORY = os.getenv('SHARED_STORE_DIR',
+  os.path.join(tempfile.gettempdir(), 'projects_shared_store'))
+# superseded versions are kept this long for readers that already hold the old pointer
+DEFAULT_GRACE = 300
+
+
+class SharedStore:
+
+  def __init__(self, directory = DEFAULT_DIRECTORY, grace = DEFAULT_GRACE):
+    self.directory = directory
+    self.grace = grace
+    # name -> (version, DataFrame), so a version is mapped once per process
+    # and callers get the same object back (stable memo keys)
+    self._loaded = {}
+    self._lock = threading.Lock()
+    os.makedirs(directory, exist_ok = True)
+
+  def _pointer_path(self, name):
+    return os.path.join(self.directory, name + '.json')
+
+  def pointer(self, name):
+    # {'version', 'file', 'published_at', 'rows', 'meta'} of the current version
+    try:
+      with open(self._pointer_path(name)) as f:
+        return json.load(f)
+    except (OSError, ValueError):
+      return None
+
+  def path(self, name):
+    # file of the current version, None when there is none. for scanning it
+    # out of core (common/compute.py) rather than mapping it into a frame;
+    # a superseded file is removed after the grace period
+    pointer = self.pointer(name)
+    return None if pointer is None else os.path.join(self.directory, pointer['file'])
+
+  @contextlib.contextmanager
+  def lock(self, name):
+    # exclusive across processes (and threads, each open gets its own lock)
+    try:
+      import fcntl
+    except ImportError:
+      # no flock on this platform, concurrent loaders may fetch twice
+      yield
+      return
+
+    with open(os.path.join(self.directory, name + '.lock'), 'a+') as f:
+      fcntl.flock(f, fcntl.LOCK_EX)
+      try:
+        yield
+      finally:
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+  def publish(self, name, df, meta = None):
+    import pyarrow as pa
+
+    version = '{}-{}'.format(int(time.time() * 1000), os.getpid())
+    file_name = '{}.{}.arrow'.format(name, version)
+    table = pa.Table.from_pandas(df, preserve_index = False)
+
+    fd, tmp_path = tempfile.mkstemp(dir = self.directory, suffix = '.tmp')
+    os.close(fd)
+    try:
+      with pa.OSFile(tmp_path, 'wb') as sink:
+        writer = pa.ipc.new_file(sink, table.schema)
+        writer.write_table(table)
+        writer.close()
+      os.replace(tmp_path, os.path.join(self.directory, file_name))
+
+      pointer = {
+        'version': version,
+        'file': file_name,
+        'published_at': time.time(),
+        'rows': len(df),
+        'meta': meta or {},
+      }
+      with open(tmp_path, 'w') as f:
+        json.dump(pointer, f, default = str)
+      # the swap readers see
+      os.replace(tmp_path, self._pointer_path(name))
+    except BaseException:
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+      raise
+
+    self._remove_superseded(name, file_name)
+    return version
+
+  def touch(self, name, **fields):
+    # adds fields to the current pointer without publishing a new version,
+    # e.g. when a refresh found nothing new. call under lock(name)
+    pointer = self.pointer(name)
+    if pointer is None:
+      return
+    pointer.update(fields)
+    fd, tmp_path = tempfile.mkstemp(dir = self.directory, suffix = '.tmp')
+    with os.fdopen(fd, 'w') as f:
+      json.dump(pointer, f, default = str)
+    os.replace(tmp_path, self._pointer_path(name))
+
+  def _remove_superseded(self, name, current):
+    # a version is superseded when the next one is published, which is when
+    # the grace period starts, not when the version itself was written
+    now = time.time()
+    prefix = name + '.'
+    versions = []
+    for file_name in os.listdir(self.directory):
+      if not file_name.startswith(prefix) or not file_name.endswith('.arrow'):
+        continue
+      try:
+        # file names are name.<publish ms>-<pid>.arrow, see publish
+        published = int(file_name[len(prefix):-len('.arrow')].split('-')[0]) / 1000
+      except ValueError:
+        continue
+      versions.append((published, file_name))
+
+    versions.sort()
+    for (_, file_name), (superseded_at, _) in zip(versions, versions[1:]):
+      if file_name == current or now - superseded_at <= self.grace:
+        continue
+      try:
+        os.remove(os.path.join(self.directory, file_name))
+      except OSError:
+        pass
+
+  def read(self, name):
+    # (pointer, DataFrame) of the current version, (None, None) when there is
+    # none. the frame must not be modified, it is shared
+    pointer = self.pointer(name)
+    if pointer is None:
+      return None, None
+
+    with self._lock:
+      loaded = self._loaded.get(name)
+      if loaded is not None and loaded[0] == pointer['version']:
+        return pointer, loaded[1]
+
+    import pyarrow as pa
+    try:
+      source = pa.memory_map(os.path.join(self.directory, pointer['file']))
+    except (OSError, IOError):
+      # superseded and removed between reading the pointer and opening it
+      return None, None
+    table = pa.ipc.open_file(source).read_all()
+    # split_blocks lets pandas keep columns as views of the mapped buffers
+    df = table.to_pandas(split_blocks = True)
+
+    with self._lock:
+      self._loaded[name] = (pointer['version'], df)
+    return pointer, df
+
+  def load(self, name, max_age = None):
+    # the current version, or None when there is none or it is older than
+    # max_age seconds
+    pointer = self.pointer(name)
+    if pointer is None:
+      return None
+    if max_age is not None and time.time() - pointer['published_at'] > max_age:
+      return None
+    return self.read(name)[1]
+
+  def get_or_load(self, name, loader, max_age = None):
+    # the shared table, running loader() and publishing its result when it is
+    # missing or stale. only one process runs the loader at a time
+    df = self.load(name, max_age)
+    if df is not None:
+      return df
+
+    with self.lock(name):
+      # another process may have published while we waited for the lock
+      df = self.load(name, max_age)
+      if df is None:
+        self.publish(name, loader())
+        df = self.load(name)
+    return df
+
+
+_default_store = None
+
+def get_store():
+  global _default_store
+  if _default_store is None:
+    _default_store = SharedStore()
+  return _default_store
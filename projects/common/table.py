@@ -0,0 +1,98 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from common import memo
+
+## Paginated tables.
+# st.write(df) serializes the whole frame to the browser on every rerun.
+# paginated_table keeps the frame on the server and sends one page of it,
+# sorted and filtered server side. The row order of each (table, filter,
+# sort) and the page frames are cached, so turning a page or rerunning for
+# another widget costs an iloc of page_size rows.
+#
+# Both caches are keyed on the identity of the frame (common/memo.py), so
+# pass a frame that is itself cached, e.g. a memoized function's result. A
+# frame rebuilt on every rerun never hits and only fills the caches.
+#
+# Filters are case insensitive substrings for text columns, and comparisons
+# ('> 10', '<= 0.5', '= 3') or ranges ('10..20') for numeric columns.
+
+DEFAULT_PAGE_SIZE = 50
+
+_comparison = re.compile(r'^\s*(<=|>=|<|>|==|=|!=)?\s*([-+]?[0-9.]+(?:[eE][-+]?[0-9]+)?)\s*$')
+_range = re.compile(r'^\s*([-+]?[0-9.]+)\s*\.\.\s*([-+]?[0-9.]+)\s*$')
+_operators = {
+  '<': np.less,
+  '<=': np.less_equal,
+  '>': np.greater,
+  '>=': np.greater_equal,
+  '=': np.equal,
+  '==': np.equal,
+  '!=': np.not_equal,
+  None: np.equal,
+}
+
+def filter_mask(values, query):
+  # boolean array of the values matching query, ValueError if it cannot apply
+  if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+    numbers = values.to_numpy(dtype = np.float64, na_value = np.nan)
+    match = _range.match(query)
+    if match:
+      low, high = float(match.group(1)), float(match.group(2))
+      return (numbers >= low) & (numbers <= high)
+    match = _comparison.match(query)
+    if match:
+      return _operators[match.group(1)](numbers, float(match.group(2)))
+    raise ValueError('expected a comparison like "> 10" or a range like "10..20"')
+
+  if isinstance(values.dtype, pd.CategoricalDtype):
+    # match each category once and look the codes up
+    matches = values.cat.categories.astype(str).str.contains(query, case = False, regex = False)
+    codes = values.cat.codes.to_numpy()
+    return np.append(np.asarray(matches, dtype = bool), False)[codes]
+  return values.astype(str).str.contains(query, case = False, regex = False).to_numpy(dtype = bool)
+
+@memo.memoize(max_entries = 32)
+def row_order(df, filter_column = None, query = '', sort_by = None, ascending = True):
+  # positions of the filtered rows, in display order
+  positions = np.arange(len(df))
+  if filter_column is not None and query:
+    positions = positions[filter_mask(df[filter_column], query)]
+  if sort_by is not None:
+    values = pd.Series(df[sort_by].to_numpy()[positions], index = positions)
+    positions = values.sort_values(ascending = ascending, kind = 'mergesort', na_position = 'last').index.to_numpy()
+  return positions
+
+@memo.memoize(max_entries = 128, key = lambda df, order_key, order, page, page_size: (df, order_key, page, page_size))
+def page_frame(df, order_key, order, page, page_size):
+  start = (page - 1) * page_size
+  return df.iloc[order[start:start + page_size]]
+
+def paginated_table(st, df, key, page_size = DEFAULT_PAGE_SIZE, columns = None):
+  # renders one page of df with sort, filter and page widgets, keyed by key.
+  # columns limits what is shown (and sortable), the table itself is not copied
+  columns = list(df.columns) if columns is None else list(columns)
+
+  sort_by = st.selectbox('Sort by', options = ['(none)'] + columns, key = key + '_sort')
+  descending = st.checkbox('Descending', key = key + '_descending')
+  filter_column = st.selectbox('Filter on', options = ['(none)'] + columns, key = key + '_filter_column')
+  query = st.text_input('Filter', key = key + '_filter') if filter_column != '(none)' else ''
+
+  sort_by = None if sort_by == '(none)' else sort_by
+  filter_column = None if filter_column == '(none)' else filter_column
+  try:
+    order = row_order(df, filter_column, query, sort_by, not descending)
+  except ValueError as e:
+    st.warning('Filter ignored: {}'.format(e))
+    order = row_order(df, None, '', sort_by, not descending)
+
+  pages = max(1, -(-len(order) // page_size))
+  # no max_value, so a narrower filter does not invalidate the widget state
+  page = min(int(st.number_input('Page', min_value = 1, value = 1, step = 1, key = key + '_page')), pages)
+
+  order_key = (filter_column, query, sort_by, descending)
+  st.dataframe(page_frame(df, order_key, order, page, page_size)[columns])
+  st.write('Page {} of {}, rows {:,} to {:,} of {:,}'.format(page, pages,
+    min(len(order), (page - 1) * page_size + 1), min(len(order), page * page_size), len(order)))
@@ -0,0 +1,51 @@
+import datetime
+
+import pandas as pd
+
+## Range slicing on time sorted tables.
+# Tables are sorted on their timestamp once at load time, after which a date
+# filter is two binary searches and a positional slice, instead of comparing
+# every row (or worse, a python date object per row) on each rerun.
+
+def sort_by_time(df, column):
+  # stable sort so rows with equal timestamps keep their load order
+  if df[column].is_monotonic_increasing:
+    return df
+  return df.sort_values(column, kind = 'mergesort', ignore_index = True)
+
+def _bound(value, tz):
+  ts = pd.Timestamp(value)
+  if tz is not None:
+    # plain dates are taken as calendar dates in the column's own timezone,
+    # the same as comparing against `.dt.date`
+    return ts.tz_localize(tz) if ts.tz is None else ts.tz_convert(tz)
+  if ts.tz is not None:
+    return ts.tz_localize(None)
+  return ts
+
+def _is_date(value):
+  return isinstance(value, datetime.date) and not isinstance(value, datetime.datetime)
+
+def time_range_positions(values, start = None, end = None):
+  tz = values.dt.tz
+
+  lo = 0
+  if start is not None:
+    lo = values.searchsorted(_bound(start, tz), side = 'left')
+
+  hi = len(values)
+  if end is not None:
+    if _is_date(end):
+      # a date as the end bound includes that whole day, up to the next
+      # local midnight, which is not 24 hours later on a DST change
+      hi = values.searchsorted(_bound(pd.Timestamp(end) + pd.Timedelta(days = 1), tz), side = 'left')
+    else:
+      hi = values.searchsorted(_bound(end, tz), side = 'right')
+
+  return int(lo), int(max(lo, hi))
+
+def slice_time_range(df, column, start = None, end = None):
+  # rows with start <= df[column] <= end, df must be sorted on column
+  # (see sort_by_time). returns a positional slice, not a filtered copy.
+  lo, hi = time_range_positions(df[column], start, end)
+  return df.iloc[lo:hi]
@@ -1,92 +1,71 @@
-from plotly.tools import make_subplots
 import streamlit as st
-import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine
-from snowflake.sqlalchemy import URL
 import os
-from sqlalchemy.dialects import registry
-registry.register('snowflake', 'snowflake.sqlalchemy', 'dialect')
-import plotly.express as px
-import plotly.graph_objects as go
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import filters, histogram, instrument, memo, prefetch
+import retention
 import datetime
-import math
 
 
 ## set app page config
 st.set_page_config(page_title = 'customer retention',
   layout = 'wide')
 
-## data connection credentials
-# Loading Env Variable for logging into snowflake
-ACCOUNT = os.getenv('SNOWFLAKE_ACCOUNT')
-USERNAME = os.getenv('SNOWFLAKE_USERNAME')
-PASSWORD = os.getenv('SNOWFLAKE_PASSWORD')
-
-# ACCOUNT = st.secrets['SNOWFLAKE_ACCOUNT']
-# USERNAME = st.secrets['SNOWFLAKE_USERNAME']
-# PASSWORD = st.secrets['SNOWFLAKE_PASSWORD']
-
-WAREHOUSE = 'STREAMLIT_PUBLIC_WH'
-ROLE = 'STREAMLIT_PUBLIC_ROLE'
-
-
-
-## Utility Functions
-@st.cache(suppress_st_warning = True, show_spinner = False)
-def loadData(sql):
-  
-  st.warning('No cache found! First data')
-
-  # creating the sqlalchemy engine
-  engine = create_engine(URL(
-      account = ACCOUNT,
-      user = USERNAME,
-      password = PASSWORD,
-      warehouse = WAREHOUSE,
-      role=ROLE,
-  ))
-
-  # Data Loading
-  connection = engine.connect()
-
-  # pull query into dataframe
-  df = pd.read_sql_query(sql, engine)
-
-  # close connection and dispose of engine once done.
-  connection.close()
-  engine.dispose()
-
-  return df
-
 ## Core Functions
-@st.cache(suppress_st_warning = True, show_spinner = False)
-def loadCustomerOrder():
-
-  sql = '''
-    SELECT *
-    FROM "STREAMLIT_PUBLIC"."CUSTOMER_RETENTION"."CUSTOMER_ORDER"
-  '''
-  customer_order = loadData(sql).copy()
-
-  # convert to date time, and add a year month column
-  customer_order['created_at_tz'] = pd.to_datetime(customer_order['created_at_tz'])
-  customer_order['previous_created_at_tz'] = pd.to_datetime(customer_order['previous_created_at_tz'])
-  customer_order['year_month'] = customer_order['created_at_tz'].dt.strftime('%Y-%m')
-  
-  return customer_order
+@st.cache(allow_output_mutation = True, show_spinner = False)
+def customerOrderTable():
+  # one incremental table per process, shared by every session
+  return retention.newCustomerOrderTable()
 
-def removeShortTermRepurchaseFilter(customer_order):
+@instrument.instrumented()
+def loadCustomerOrder():
+  table = customerOrderTable()
+  if table.frame is None:
+    st.warning('No cache found! First data')
+    # the load runs on the prefetch pool with a progress bar, see common/prefetch.py
+    prefetch.streamlit_progress(prefetch.Prefetcher({'CUSTOMER_ORDER': table.refresh}).start(), st)
+
+  table.refresh()
+  # (version, frame) taken once per rerun, every loader below gets this frame
+  return table.current()
+
+# the loaders are keyed on the table version alone, the frame passed with it
+# is that version's and is not hashed. one entry per version, the previous
+# one is kept for sessions still on it
+_versionKeyed = {pd.DataFrame: lambda customer_order: None}
+
+@instrument.instrumented()
+@st.cache(suppress_st_warning = True, show_spinner = False, max_entries = 2, hash_funcs = _versionKeyed)
+def loadRepurchaseRollup(version, customer_order):
+  # version changes whenever the order table is refreshed, so the rollup is
+  # rebuilt once per data load instead of hashing the whole table
+  return retention.buildRepurchaseRollup(customer_order)
+
+@instrument.instrumented()
+@st.cache(suppress_st_warning = True, show_spinner = False, allow_output_mutation = True,
+  max_entries = 2, hash_funcs = _versionKeyed)
+def loadCohortIndex(version, customer_order):
+  # per order cohort and months since first order, built once per data load.
+  # one row per order, so the output is not hashed on every rerun
+  return retention.cohortIndex(customer_order)
+
+@instrument.instrumented()
+def removeShortTermRepurchaseFilter(orders, rollup):
   to_remove = st.sidebar.radio(label = 'Remove short term repurchase? (<2week)',
     options = [False, True],
     key = 'remove_short_term_key')
 
-  if to_remove == True:
-    customer_order.loc[customer_order['week_delay'] < 2, 'is_repurchase'] = False
+  # a predicate instead of writing to is_repurchase, so the shared order
+  # table does not need a full copy on every rerun
+  repurchases = orders.where(('repurchase', to_remove), retention.repurchasePredicate(to_remove))
+
+  rollup = retention.removeShortTermRepurchase(rollup, to_remove)
 
-  return customer_order
+  return repurchases, rollup
 
-def dateFilterComponent(customer_order):
+@instrument.instrumented()
+def dateFilterComponent(rollup):
   start_date = st.sidebar.date_input(
         label = 'Start Date',
         value = datetime.date(2019, 1, 1))
@@ -95,52 +74,16 @@ def dateFilterComponent(customer_order):
         label = 'End Date')
 
   # applying date filter
-  customer_order_filtered = customer_order[(customer_order['created_at_tz'].dt.date >= start_date)
-    & (customer_order['created_at_tz'].dt.date <= end_date)]
+  rollup_filtered = retention.filterRollupByDate(rollup, start_date, end_date)
 
-  return customer_order_filtered
+  return rollup_filtered
 
-def monthlyRepurchaseRateComponent(customer_order_filtered):
+@instrument.instrumented()
+def monthlyRepurchaseRateComponent(rollup_filtered):
+  import plotly.express as px
   #######
   # monthly graph
-  monthly_orders = customer_order_filtered[['year_month', 'order_id']]\
-    .groupby('year_month') \
-      .nunique() \
-        .reset_index() \
-          .rename(columns = {'order_id': 'order_count'})
-
-  monthly_repeats = customer_order_filtered[customer_order_filtered['is_repurchase'] == True][['year_month', 'order_id']] \
-    .groupby('year_month') \
-      .nunique() \
-        .reset_index() \
-          .rename(columns = {'order_id': 'repurchase_count'})
-
-  monthly_mattress_repeats = customer_order_filtered[(customer_order_filtered['is_repurchase'] == True)
-    & (customer_order_filtered['has_mattress'] == True)][['year_month', 'order_id']] \
-      .groupby('year_month') \
-        .nunique() \
-          .reset_index() \
-            .rename(columns = {'order_id': 'mattress_repurchase_count'})
-
-  monthly_accessory_repeats = customer_order_filtered[(customer_order_filtered['is_repurchase'] == True)
-    & (customer_order_filtered['has_accessory'] == True)][['year_month', 'order_id']] \
-      .groupby('year_month') \
-        .nunique() \
-          .reset_index() \
-            .rename(columns = {'order_id': 'accessory_repurchase_count'})      
-
-  # merging all aggregated tables
-  monthly_repurchase_summary = monthly_orders.merge(monthly_repeats, how = 'outer', on = 'year_month')
-  monthly_repurchase_summary = monthly_repurchase_summary.merge(monthly_mattress_repeats, how = 'outer', on = 'year_month')       
-  monthly_repurchase_summary = monthly_repurchase_summary.merge(monthly_accessory_repeats, how = 'outer', on = 'year_month')            
-            
-  # calculating percentages
-  monthly_repurchase_summary['all repurchase %'] = np.round((monthly_repurchase_summary['repurchase_count'] / monthly_repurchase_summary['order_count'])*100, 2)
-  monthly_repurchase_summary['mattress repurchase %'] = np.round((monthly_repurchase_summary['mattress_repurchase_count'] / monthly_repurchase_summary['order_count'])*100, 2)
-  monthly_repurchase_summary['accessorry repurchase %'] = np.round((monthly_repurchase_summary['accessory_repurchase_count'] / monthly_repurchase_summary['order_count'])*100, 2)
-
-  # re-order the table by date
-  monthly_repurchase_summary.sort_values('year_month', ascending = True, inplace = True)
+  monthly_repurchase_summary = retention.monthlyRepurchaseSummary(rollup_filtered)
 
   # plotly plot
   fig = px.line(monthly_repurchase_summary, 
@@ -151,39 +94,22 @@ def monthlyRepurchaseRateComponent(customer_order_filtered):
   fig.update_yaxes(title_text='% repurchases (repeat / total order)')
   st.plotly_chart(fig)
 
-def overallRepurchaseRateComponent(customer_order_filtered):
-  total_orders = customer_order_filtered['order_id'].nunique()
-  repeat_orders = customer_order_filtered[customer_order_filtered['is_repurchase'] == True]['order_id'] \
-    .nunique()
-
-  repeat_orders_with_mattress = customer_order_filtered[(customer_order_filtered['is_repurchase'] == True)
-    & (customer_order_filtered['has_mattress'] == True)]['order_id'] \
-      .nunique()
-
-  repeat_orders_with_accessory = customer_order_filtered[(customer_order_filtered['is_repurchase'] == True)
-    & (customer_order_filtered['has_accessory'] == True)]['order_id'] \
-      .nunique()
-
-  repeats_percent = np.round((repeat_orders/total_orders) * 100, 2)
-  repeats_mattress_percent = np.round((repeat_orders_with_mattress/total_orders) * 100, 2)
-  repeats_accessory_percent = np.round((repeat_orders_with_accessory/total_orders) * 100, 2)
+@instrument.instrumented()
+def overallRepurchaseRateComponent(rollup_filtered):
+  summary = retention.overallRepurchaseSummary(rollup_filtered)
 
-  st.write('Total orders: ', total_orders)
-  st.write('Repeats: ', repeats_percent, '%')
-  st.write('Repeats (mattress): ', repeats_mattress_percent, '%')
-  st.write('Repeats (accessory): ', repeats_accessory_percent, '%')
+  st.write('Total orders: ', summary['total_orders'])
+  st.write('Repeats: ', summary['repeats_percent'], '%')
+  st.write('Repeats (mattress): ', summary['repeats_mattress_percent'], '%')
+  st.write('Repeats (accessory): ', summary['repeats_accessory_percent'], '%')
 
+@instrument.instrumented()
 def productFilter(repurchases):
   product_selection = st.sidebar.selectbox(label = 'Which product to include?',
                       options = ['all', 'mattress', 'accessory'],
                       key = 'section-2_select_box')
 
-  if product_selection == 'mattress': 
-    repurchases = repurchases[repurchases['has_mattress'] == True]
-  elif product_selection == 'accessory':
-    repurchases = repurchases[repurchases['has_accessory'] == True]
-
-  return repurchases
+  return repurchases.where(('product', product_selection), retention.productPredicate(product_selection))
 
 def includedDatasetFilter():
   included_dataset = st.sidebar.multiselect(label = 'Which data set to include?', 
@@ -192,56 +118,47 @@ def includedDatasetFilter():
     key = 'section3-multi-select')
   return included_dataset
 
+@instrument.instrumented()
 def monthSelectorFilter(repurchases):
   month_selector = st.sidebar.selectbox(label = 'select year-month',
-    options = repurchases['year_month'].sort_values(ascending = False).unique().tolist(),
+    options = repurchases.collect()['year_month'].sort_values(ascending = False).unique().tolist(),
     key = 'section-2_year_month_selector')
   
-  selected_month = repurchases[repurchases['year_month'] == month_selector]
-  return selected_month
+  return repurchases.where(('year_month', month_selector), retention.monthPredicate(month_selector))
 
-def purchaseDelayDistributionComponent(repurchases, selected_month, included_dataset):
-  baseline = repurchases[repurchases['year_month'].isin(['2021-01', 
-                                                          '2021-02', 
-                                                          '2021-03', 
-                                                          '2021-04', 
-                                                          '2021-05'])]                     
+# week_delay histograms, binned server side. collected frames are cached per
+# filter set (common/filters.py), so their identity is the filter state
+@memo.memoize(max_entries = 64)
+def delayHistograms(repurchases, selected_month):
+  return retention.delayHistograms(repurchases, selected_month)
 
-  lightning = repurchases[repurchases['year_month'] == '2021-06']
+@instrument.instrumented()
+def purchaseDelayDistributionComponent(repurchases, selected_month, included_dataset):
+  import plotly.graph_objects as go
+  histograms = delayHistograms(repurchases.collect(), selected_month.collect())
 
   # Create distribution plot
   fig = go.Figure()
 
   if 'Baseline' in included_dataset:
-    bin_width = 10
-    nbinsx = math.ceil((baseline['week_delay'].max() - baseline['week_delay'].min()) / bin_width)
-    
-    fig.add_trace(go.Histogram(x = baseline['week_delay'], 
-                                histnorm='percent',
+    fig.add_trace(histogram.bar_trace(histograms['Baseline'],
+                                y = 'percent',
                                 marker = {'color': '#2ab7ca'},
-                                nbinsx = nbinsx,
                                 name = 'Baseline (Jan - May, 21)'))
 
   if 'Lightning' in included_dataset:     
-    bin_width = 10
-    nbinsx = math.ceil((lightning['week_delay'].max() - lightning['week_delay'].min()) / bin_width)                         
-    fig.add_trace(go.Histogram(x = lightning['week_delay'], 
-                                histnorm='percent',
+    fig.add_trace(histogram.bar_trace(histograms['Lightning'],
+                                y = 'percent',
                                 marker = {'color': '#fed766'},
-                                nbinsx = nbinsx,
                                 name = 'Lightning Sale (June, 21)'))
 
   if 'Selected Month' in included_dataset:       
-    bin_width = 10
-    nbinsx = math.ceil((selected_month['week_delay'].max() - selected_month['week_delay'].min()) / bin_width)
-
-    fig.add_trace(go.Histogram(x = selected_month['week_delay'], 
-                                histnorm='percent',
+    fig.add_trace(histogram.bar_trace(histograms['Selected Month'],
+                                y = 'percent',
                                 marker = {'color': '#fe4a49'},
-                                nbinsx = nbinsx,
                                 name = 'Selected month'))
 
-  fig.update_layout(barmode='overlay')
+  fig.update_layout(barmode='overlay', bargap = 0)
   fig.update_traces(opacity=0.6)
   fig.update_xaxes(title_text='Delay in weeks')
   fig.update_yaxes(title_text='% of all repurchases')
@@ -249,7 +166,8 @@ def purchaseDelayDistributionComponent(repurchases, selected_month, included_dat
 
   # st.write('debug', selected_month)
   
-def section3DateFilter(customer_order):
+@instrument.instrumented()
+def section3DateFilter(orders):
   start_date = st.sidebar.date_input(
           label = 'Start Date',
           value = datetime.date(2019, 1, 1),
@@ -259,37 +177,46 @@ def section3DateFilter(customer_order):
         label = 'End Date',
         key = 'section-3_date_end')
 
-  # applying date filter
-  customer_order_filtered = customer_order[(customer_order['created_at_tz'].dt.date >= start_date)
-    & (customer_order['created_at_tz'].dt.date <= end_date)]
-  
-  return customer_order_filtered
+  # applying date filter, the order table is kept sorted on created_at_tz
+  return orders.between('created_at_tz', start_date, end_date), start_date, end_date
 
-def section3FilterProduct(customer_order_filtered):
+@instrument.instrumented()
+def section3FilterProduct(orders):
   product_selection = st.sidebar.selectbox(label = 'Which product to include?',
                         options = ['all', 'mattress', 'accessory'],
                         key = 'section-3_select_box')
 
-  if product_selection == 'mattress': 
-    customer_order_filtered = customer_order_filtered[customer_order_filtered['has_mattress'] == True]
-  elif product_selection == 'accessory':
-    customer_order_filtered = customer_order_filtered[customer_order_filtered['has_accessory'] == True]
+  # same predicate key as section 2, the mask is shared when both match
+  return orders.where(('product', product_selection), retention.productPredicate(product_selection)), product_selection
 
-  return customer_order_filtered
+def approximateCountsFilter():
+  return st.sidebar.checkbox(label = 'Approximate counts (faster on long ranges)',
+    key = 'section-3_approximate')
 
-def nthOrderComponent(customer_order_filtered):
-  purchase_sequence = customer_order_filtered[['purchase_sequence', 'order_id']].groupby('purchase_sequence') \
-    .nunique() \
-      .reset_index() \
-        .rename(columns = {'purchase_sequence': 'nth order',
-          'order_id': 'order_count'})
+@instrument.instrumented()
+@st.cache(suppress_st_warning = True, show_spinner = False, allow_output_mutation = True,
+  max_entries = 2, hash_funcs = _versionKeyed)
+def loadOrderSketches(version, customer_order):
+  # built once per data load, see retention.buildOrderSketches
+  return retention.buildOrderSketches(customer_order)
 
-  total_orders = customer_order_filtered['order_id'].nunique()
+@instrument.instrumented()
+def nthOrderApproxComponent(sketches, start_date, end_date, product_selection):
+  import plotly.express as px
+  purchase_sequence, total_orders, error = retention.nthOrderSummaryApprox(sketches, start_date, end_date, product_selection)
 
-  purchase_sequence['% of all orders'] = np.round((purchase_sequence['order_count'] / total_orders) * 100, 2)
-  purchase_sequence = purchase_sequence[purchase_sequence['nth order'] > 1]
+  fig = px.bar(purchase_sequence,
+    x = 'nth order',
+    y = '% of all orders')
 
+  st.plotly_chart(fig)
+  # 95% of estimates fall within two standard errors
+  st.write('All orders: ~', total_orders, ' (± {:.1f}%, whole months)'.format(200 * error))
 
+@instrument.instrumented()
+def nthOrderComponent(orders):
+  import plotly.express as px
+  purchase_sequence, total_orders = retention.nthOrderSummary(orders.collect())
 
   fig = px.bar(purchase_sequence,
     x = 'nth order',
@@ -298,32 +225,70 @@ def nthOrderComponent(customer_order_filtered):
   st.plotly_chart(fig)
   st.write('All orders: ', total_orders)
 
+# cohort matrices are cached per data load and filter, see retention.cohortRetention
+@memo.memoize(max_entries = 16, key = lambda cohort_index, orders, value: (cohort_index, orders.df, orders.key(), value))
+def cohortRetention(cohort_index, orders, value):
+  mask = orders.full_mask() if orders.predicates else None
+  return retention.cohortRetention(cohort_index, mask, value)
+
+@instrument.instrumented()
+def cohortFilter(orders):
+  product_selection = st.sidebar.selectbox(label = 'Which product to include?',
+                        options = ['all', 'mattress', 'accessory'],
+                        key = 'section-4_select_box')
+
+  value = st.sidebar.radio(label = 'Count active',
+    options = ['customers', 'orders'],
+    key = 'section-4_value')
+
+  return orders.where(('product', product_selection), retention.productPredicate(product_selection)), value
+
+@instrument.instrumented()
+def cohortRetentionComponent(cohort_index, orders, value):
+  import plotly.express as px
+  counts, rates, sizes = cohortRetention(cohort_index, orders, value)
+
+  fig = px.imshow(rates,
+    labels = dict(x = 'Months since first order', y = 'First order month', color = '% of cohort'),
+    aspect = 'auto',
+    color_continuous_scale = 'Blues')
+  st.plotly_chart(fig)
+
+  st.write('% of cohort')
+  st.write(rates)
+  st.write('Counts')
+  st.write(pd.concat([sizes, counts], axis = 1))
+
 ## MAIN
+instrument.configure_logging()
+instrument.start_run()
 st.title('Customer Retention Dashboard')
-customer_order = loadCustomerOrder().copy()
+# shared between sessions, treat as read only
+version, customer_order = loadCustomerOrder()
+rollup = loadRepurchaseRollup(version, customer_order)
+# every section filters this lazily and materializes once, see common/filters.py
+orders = filters.LazyFilter(customer_order)
 
 # Global Filters ####################################################
 st.sidebar.header('Global Filter')
 # note: this filter just turns off the is_purchase boolean for short term repurchase. 
 # does not delete the row of data. Therefore total order count will still be accurate.
-customer_order = removeShortTermRepurchaseFilter(customer_order) 
+repurchases, rollup = removeShortTermRepurchaseFilter(orders, rollup)
 
 # SECTION 1 #########################################################
 st.sidebar.header('Section 1 - Filters')
-customer_order_filtered = dateFilterComponent(customer_order)
+rollup_filtered = dateFilterComponent(rollup)
 
 st.title('Section 1')
 st.subheader('How many % of orders every month are from repeat purchases?')
 st.warning('Note: Metrics here are displayed as a % of the total sales (denominator).')
-monthlyRepurchaseRateComponent(customer_order_filtered)
-overallRepurchaseRateComponent(customer_order_filtered)
+monthlyRepurchaseRateComponent(rollup_filtered)
+overallRepurchaseRateComponent(rollup_filtered)
 
 # SECTION 2 #########################################################
 st.title('Section 2')
 st.subheader('What is the usual time delay between the repeat purchases?')
 st.warning('Note: Metric here are displayed as a % of the count of REPEAT orders (denominator).')
-repurchases = customer_order[customer_order['is_repurchase'] == True]
-
 # Filters
 st.sidebar.header('Section 2 - Filters')
 repurchases = productFilter(repurchases)
@@ -343,11 +308,26 @@ st.warning('''Note: All order here refers to all orders that contains the releva
 st.sidebar.header('Section 3 - Filters')
 
 # filters
-customer_order_filtered = section3DateFilter(customer_order)
-customer_order_filtered = section3FilterProduct(customer_order_filtered)
+orders_filtered, start_date, end_date = section3DateFilter(orders)
+orders_filtered, product_selection = section3FilterProduct(orders_filtered)
+approximate = approximateCountsFilter()
 
-nthOrderComponent(customer_order_filtered)
+if approximate:
+  sketches = loadOrderSketches(version, customer_order)
+  nthOrderApproxComponent(sketches, start_date, end_date, product_selection)
+else:
+  nthOrderComponent(orders_filtered)
 
+# SECTION 4 #########################################################
+st.title('Section 4')
+st.subheader('How many customers of each first-order month come back, and when?')
+st.warning('Note: % are of all customers whose first order was in that month, whatever the product filter.')
 
+st.sidebar.header('Section 4 - Filters')
+cohort_orders, value = cohortFilter(orders)
 
+cohort_index = loadCohortIndex(version, customer_order)
+cohortRetentionComponent(cohort_index, cohort_orders, value)
 
+# per section load and component timings, see common/instrument.py
+instrument.render_panel(st)
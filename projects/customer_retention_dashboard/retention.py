@@ -0,0 +1,326 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from common import compute, dtypes, histogram, hll, incremental, shared_store, time_index
+
+## Loading
+# compact dtypes for the order table, see common/dtypes.py
+CUSTOMER_ORDER_SCHEMA = {
+  'created_at_tz': 'datetime',
+  'previous_created_at_tz': 'datetime',
+  'year_month': 'category',
+  'timezone': 'category',
+  'order_id': 'int',
+  'purchase_sequence': 'int',
+  'week_delay': 'float32',
+  'is_repurchase': 'bool',
+  'has_mattress': 'bool',
+  'has_accessory': 'bool',
+}
+
+def yearMonth(created_at):
+  # '%Y-%m' labels as a categorical, formatting each distinct month once
+  # rather than running strftime on every row
+  key = created_at.dt.year * 100 + created_at.dt.month
+  codes, uniques = pd.factorize(key, sort = True)
+  labels = ['{:04d}-{:02d}'.format(int(k) // 100, int(k) % 100) for k in uniques]
+  return pd.Series(pd.Categorical.from_codes(codes, labels), index = created_at.index)
+
+def prepareCustomerOrder(customer_order):
+  # convert to date time, and add a year month column.
+  # runs on each fetched chunk, of the full table on first load and of each
+  # delta afterwards, so it must only look at one row at a time
+  customer_order['created_at_tz'] = pd.to_datetime(customer_order['created_at_tz'])
+  customer_order['year_month'] = yearMonth(customer_order['created_at_tz'])
+
+  return dtypes.apply_schema(customer_order, CUSTOMER_ORDER_SCHEMA)
+
+def newCustomerOrderTable():
+  # only orders newer than the high-water mark (minus the lookback window)
+  # are fetched once the table is loaded, see common/incremental.py
+  return incremental.IncrementalTable(
+    table = '"STREAMLIT_PUBLIC"."CUSTOMER_RETENTION"."CUSTOMER_ORDER"',
+    timestamp_column = 'created_at_tz',
+    lookback = datetime.timedelta(days = 3),
+    derive = prepareCustomerOrder,
+    refresh_interval = 5 * 60,
+    # refreshed by one process per host, mapped by the others
+    store = shared_store.get_store())
+
+# warming forces a refresh and rewrites the snapshot, the app itself only
+# fetches orders past the high-water mark
+QUERIES = {
+  'CUSTOMER_ORDER': lambda: newCustomerOrderTable().warm(),
+}
+
+## Pre-aggregated order rollup.
+# Built once per data load, one row per (order_date, year_month, is_repurchase,
+# has_mattress, has_accessory, short_delay) with the distinct order count.
+# The section 1 metrics are then answered by summing a few thousand rows
+# instead of filtering and running nunique over every order on each rerun.
+# Summing per group distinct counts is exact because the flags and the
+# order date are attributes of the order, so an order falls in one group.
+
+ROLLUP_KEYS = ['order_date', 'year_month', 'is_repurchase', 'has_mattress', 'has_accessory', 'short_delay']
+
+def orderDates(customer_order):
+  # calendar date of the order in its own timezone, as a naive datetime
+  order_date = customer_order['created_at_tz'].dt.normalize()
+  if order_date.dt.tz is not None:
+    order_date = order_date.dt.tz_localize(None)
+  return order_date
+
+def buildRepurchaseRollup(customer_order):
+  keys = pd.DataFrame({
+    'order_date': orderDates(customer_order),
+    'year_month': customer_order['year_month'],
+    # same semantic as the `== True` comparisons in the dashboard
+    'is_repurchase': customer_order['is_repurchase'] == True,
+    'has_mattress': customer_order['has_mattress'] == True,
+    'has_accessory': customer_order['has_accessory'] == True,
+    # repurchases within 2 weeks, see removeShortTermRepurchaseFilter
+    'short_delay': customer_order['week_delay'] < 2,
+    'order_id': customer_order['order_id'],
+  })
+
+  # grouped by the configured compute backend, see common/compute.py
+  rollup = compute.get_compute().group_aggregate(keys, ROLLUP_KEYS, {'order_count': ('order_id', 'nunique')})
+
+  # sorted on the date so date filters are a slice
+  return time_index.sort_by_time(rollup, 'order_date')
+
+def removeShortTermRepurchase(rollup, to_remove):
+  # rollup version of setting is_repurchase = False where week_delay < 2
+  if to_remove == True:
+    rollup = rollup.copy()
+    rollup.loc[rollup['short_delay'], 'is_repurchase'] = False
+  return rollup
+
+def filterRollupByDate(rollup, start_date, end_date):
+  return time_index.slice_time_range(rollup, 'order_date', start_date, end_date)
+
+def _repurchaseCounts(rollup, by = None):
+  counts = pd.DataFrame({
+    'order_count': rollup['order_count'],
+    'repurchase_count': rollup['order_count'].where(rollup['is_repurchase'], 0),
+    'mattress_repurchase_count': rollup['order_count'].where(rollup['is_repurchase'] & rollup['has_mattress'], 0),
+    'accessory_repurchase_count': rollup['order_count'].where(rollup['is_repurchase'] & rollup['has_accessory'], 0),
+  })
+  if by is None:
+    return counts.sum()
+
+  counts[by] = rollup[by]
+  return counts.groupby(by, observed = True).sum().reset_index()
+
+def monthlyRepurchaseSummary(rollup):
+  monthly_repurchase_summary = _repurchaseCounts(rollup, by = 'year_month')
+
+  # calculating percentages
+  monthly_repurchase_summary['all repurchase %'] = np.round((monthly_repurchase_summary['repurchase_count'] / monthly_repurchase_summary['order_count'])*100, 2)
+  monthly_repurchase_summary['mattress repurchase %'] = np.round((monthly_repurchase_summary['mattress_repurchase_count'] / monthly_repurchase_summary['order_count'])*100, 2)
+  monthly_repurchase_summary['accessorry repurchase %'] = np.round((monthly_repurchase_summary['accessory_repurchase_count'] / monthly_repurchase_summary['order_count'])*100, 2)
+
+  # re-order the table by date
+  monthly_repurchase_summary.sort_values('year_month', ascending = True, inplace = True)
+
+  return monthly_repurchase_summary
+
+def overallRepurchaseSummary(rollup):
+  counts = _repurchaseCounts(rollup)
+  total_orders = int(counts['order_count'])
+
+  return {
+    'total_orders': total_orders,
+    'repeats_percent': np.round((counts['repurchase_count']/total_orders) * 100, 2),
+    'repeats_mattress_percent': np.round((counts['mattress_repurchase_count']/total_orders) * 100, 2),
+    'repeats_accessory_percent': np.round((counts['accessory_repurchase_count']/total_orders) * 100, 2),
+  }
+
+## Order filters
+# predicates for common/filters.py, shared by the sections so a selection
+# used in two of them is evaluated once. None means no filtering
+
+def repurchasePredicate(remove_short_term):
+  # repeat orders; with remove_short_term, those within 2 weeks of the
+  # previous order do not count as repurchases
+  def predicate(customer_order):
+    is_repurchase = customer_order['is_repurchase'].to_numpy() == True
+    if remove_short_term == True:
+      is_repurchase &= ~(customer_order['week_delay'].to_numpy() < 2)
+    return is_repurchase
+  return predicate
+
+def productPredicate(product_selection):
+  if product_selection == 'mattress':
+    return lambda customer_order: customer_order['has_mattress'].to_numpy() == True
+  if product_selection == 'accessory':
+    return lambda customer_order: customer_order['has_accessory'].to_numpy() == True
+  return None
+
+def monthPredicate(year_month):
+  return lambda customer_order: customer_order['year_month'] == year_month
+
+## Section 2 and 3 computations
+
+def delayHistograms(repurchases, selected_month):
+  # week_delay histograms (percent) for the baseline, lightning sale and
+  # selected month populations
+  baseline = repurchases[repurchases['year_month'].isin(['2021-01', 
+                                                          '2021-02', 
+                                                          '2021-03', 
+                                                          '2021-04', 
+                                                          '2021-05'])]                     
+
+  lightning = repurchases[repurchases['year_month'] == '2021-06']
+
+  # same edges for all three, so the overlaid bars line up
+  bin_width = 10
+  edges = histogram.bin_edges([baseline['week_delay'], lightning['week_delay'], selected_month['week_delay']], bin_width)
+
+  return {
+    'Baseline': histogram.histogram(baseline['week_delay'], edges = edges, histnorm = 'percent'),
+    'Lightning': histogram.histogram(lightning['week_delay'], edges = edges, histnorm = 'percent'),
+    'Selected Month': histogram.histogram(selected_month['week_delay'], edges = edges, histnorm = 'percent'),
+  }
+
+def nthOrderSummary(customer_order_filtered):
+  # share of all orders that are the nth purchase of their customer, n > 1
+  purchase_sequence = compute.get_compute().group_aggregate(customer_order_filtered, ['purchase_sequence'],
+    {'order_count': ('order_id', 'nunique')}) \
+      .rename(columns = {'purchase_sequence': 'nth order'})
+
+  total_orders = customer_order_filtered['order_id'].nunique()
+
+  purchase_sequence['% of all orders'] = np.round((purchase_sequence['order_count'] / total_orders) * 100, 2)
+  purchase_sequence = purchase_sequence[purchase_sequence['nth order'] > 1]
+
+  return purchase_sequence, total_orders
+
+## Approximate order counts.
+# HyperLogLog sketches of order_id per (year_month, flags, purchase_sequence),
+# built once per data load (common/hll.py). The nth order metrics of any
+# month range and product filter are then merged from a few hundred sketches
+# instead of hashing every order in the range, at ~1% error.
+
+ORDER_SKETCH_KEYS = ['year_month', 'has_mattress', 'has_accessory', 'purchase_sequence']
+
+def buildOrderSketches(customer_order, precision = hll.DEFAULT_PRECISION):
+  return hll.Sketches.build(customer_order, 'order_id', ORDER_SKETCH_KEYS, precision)
+
+def nthOrderSummaryApprox(sketches, start_date, end_date, product_selection):
+  # nthOrderSummary from the sketches, plus the relative standard error.
+  # sketches are per month, so every month overlapping the range counts whole
+  year_month = sketches.keys['year_month'].astype(str)
+  selected = ((year_month >= '{:%Y-%m}'.format(start_date)) & (year_month <= '{:%Y-%m}'.format(end_date))).to_numpy()
+  predicate = productPredicate(product_selection)
+  if predicate is not None:
+    selected &= predicate(sketches.keys)
+
+  counts = sketches.count_by('purchase_sequence', selected)
+  total_orders = int(round(sketches.count(selected)))
+
+  purchase_sequence = pd.DataFrame({
+    'nth order': counts.index.astype(np.int64),
+    'order_count': np.round(counts.to_numpy()).astype(np.int64),
+  })
+  purchase_sequence['% of all orders'] = np.round((purchase_sequence['order_count'] / max(total_orders, 1)) * 100, 2)
+  purchase_sequence = purchase_sequence[purchase_sequence['nth order'] > 1]
+
+  return purchase_sequence, total_orders, sketches.error
+
+## Cohort retention.
+# A customer's cohort is the month of their first order. The cohort index
+# places every order by its customer, cohort and months since the first
+# order, once per data load, so a cohort x months-since matrix is a single
+# bincount over integer cell codes. No per-customer python.
+
+def monthNumber(year_month):
+  # months since year 0 of the year_month categorical, so month differences
+  # are plain subtraction. parsed once per category, then looked up by code
+  numbers = np.array([int(label[:4]) * 12 + int(label[5:7]) - 1 for label in year_month.cat.categories],
+    dtype = np.int32)
+  return numbers[year_month.cat.codes.to_numpy()]
+
+def cohortIndex(customer_order):
+  # aligned with customer_order by position, which must be sorted on
+  # created_at_tz (it is, see newCustomerOrderTable). orders without a
+  # customer_id or year_month belong to no cohort, they get -1 throughout
+  codes = customer_order['year_month'].cat.codes.to_numpy()
+  valid = customer_order['customer_id'].notna().to_numpy() & (codes >= 0)
+  customer, _ = pd.factorize(customer_order['customer_id'][valid])
+  month = monthNumber(customer_order['year_month'])[valid]
+
+  # factorize numbers customers in order of appearance, so a customer's
+  # first order is where its code exceeds every earlier code
+  running_max = np.maximum.accumulate(customer)
+  is_first = np.ones(len(customer), dtype = bool)
+  is_first[1:] = customer[1:] > running_max[:-1]
+  first_month = month[is_first][customer]
+
+  def aligned(values, dtype):
+    out = np.full(len(valid), -1, dtype = dtype)
+    out[valid] = values
+    return out
+
+  return pd.DataFrame({
+    'customer': aligned(customer, np.int32),
+    'cohort': aligned(first_month, first_month.dtype),
+    'months_since': aligned(month - first_month, np.int16),
+  })
+
+def cohortLabels(cohorts):
+  return ['{:04d}-{:02d}'.format(int(c) // 12, int(c) % 12 + 1) for c in cohorts]
+
+def cohortRetention(cohort_index, mask = None, value = 'customers'):
+  # (counts, rates, sizes): cohorts as rows and months since the first order
+  # as columns. value 'customers' counts distinct active customers per cell,
+  # 'orders' counts orders. mask (aligned with the index) selects the orders
+  # that count, e.g. has_mattress. rates are % of the whole cohort, cells
+  # past the end of the data are NaN
+  if value not in ('customers', 'orders'):
+    raise ValueError('unknown value {}, expected customers or orders'.format(value))
+
+  customer = cohort_index['customer'].to_numpy()
+  cohort = cohort_index['cohort'].to_numpy()
+  months_since = cohort_index['months_since'].to_numpy()
+  # orders of no cohort (customer -1, see cohortIndex) are left out
+  valid = customer >= 0
+  if mask is not None:
+    mask = np.asarray(mask)[valid]
+  if not valid.all():
+    customer, cohort, months_since = customer[valid], cohort[valid], months_since[valid]
+  if len(cohort) == 0:
+    empty = pd.DataFrame()
+    return empty, empty, pd.Series(dtype = np.int64)
+
+  first_cohort = int(cohort.min())
+  last_month = int((cohort + months_since).max())
+  n_cohorts = int(cohort.max()) - first_cohort + 1
+  n_months = last_month - first_cohort + 1
+
+  # every order of a customer carries the same cohort
+  customer_cohort = np.zeros(customer.max() + 1, dtype = np.int64)
+  customer_cohort[customer] = cohort - first_cohort
+  sizes = np.bincount(customer_cohort, minlength = n_cohorts)
+
+  if mask is not None:
+    customer, cohort, months_since = customer[mask], cohort[mask], months_since[mask]
+  cell = (cohort - first_cohort).astype(np.int64) * n_months + months_since
+  if value == 'customers':
+    # one (customer, cell) pair per active customer
+    pairs = pd.unique(customer.astype(np.int64) * (n_cohorts * n_months) + cell)
+    cell = pairs % (n_cohorts * n_months)
+  counts = np.bincount(cell, minlength = n_cohorts * n_months).reshape(n_cohorts, n_months)
+
+  cohorts = np.arange(first_cohort, first_cohort + n_cohorts)
+  observed = np.arange(n_months)[None, :] <= (last_month - cohorts)[:, None]
+  counts = np.where(observed, counts, np.nan)
+  rates = np.round(counts / np.where(sizes > 0, sizes, np.nan)[:, None] * 100, 2)
+
+  index = pd.Index(cohortLabels(cohorts), name = 'cohort')
+  columns = pd.RangeIndex(n_months, name = 'months since first order')
+  return (pd.DataFrame(counts, index = index, columns = columns),
+    pd.DataFrame(rates, index = index, columns = columns),
+    pd.Series(sizes, index = index, name = 'cohort size'))
@@ -1,91 +1,51 @@
 import streamlit as st
-import numpy as np
-import pandas as pd
-from sqlalchemy import create_engine
-from snowflake.sqlalchemy import URL
 import os
-from sqlalchemy.dialects import registry
-registry.register('snowflake', 'snowflake.sqlalchemy', 'dialect')
-import plotly.express as px
-import plotly.graph_objects as go
-import math
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import histogram, instrument, memo, prefetch, table
+import optimizer
 
 ## FUNCTIONS
+# filtering, aggregation and rating live in optimizer.py so they can also run
+# headless, see batch_export.py
 
-@st.cache(suppress_st_warning = True, show_spinner = False)
+# the table is never mutated, so skip st.cache's hash of the output on hits
+@instrument.instrumented()
+@st.cache(suppress_st_warning = True, show_spinner = False, allow_output_mutation = True)
 def load_data():
   st.write('No cache found! Attempt data load ...')
 
- # Loading Env Variable for logging into snowflake
-  ACCOUNT = os.getenv('SNOWFLAKE_ACCOUNT')
-  USERNAME = os.getenv('SNOWFLAKE_USERNAME')
-  PASSWORD = os.getenv('SNOWFLAKE_PASSWORD')
-  WAREHOUSE = 'STREAMLIT_PUBLIC_WH'
-  ROLE = 'STREAMLIT_PUBLIC_ROLE'
-
-  # creating the sqlalchemy engine
-  engine = create_engine(URL(
-      account = ACCOUNT,
-      user = USERNAME,
-      password = PASSWORD,
-      warehouse = WAREHOUSE,
-      role=ROLE,
-  ))
-
-  # Data Loading
-  connection = engine.connect()
-
-  # write your custom query
-  sql = '''
-      SELECT * 
-      FROM "STREAMLIT_PUBLIC"."MKT_TV"."TV_PROGRAM_OPTIMIZER"
-  '''
-
-  # pull query into dataframe
-  df = pd.read_sql_query(sql, engine)
-
-  # close connection and dispose of engine once done.
-  connection.close()
-  engine.dispose()
+  # queries run concurrently with a progress bar, see common/prefetch.py
+  prefetcher = prefetch.Prefetcher(optimizer.QUERIES).start()
+  prefetch.streamlit_progress(prefetcher, st)
+  df = prefetcher.result('TV_PROGRAM_OPTIMIZER')
 
   return df
 
-@st.cache(suppress_st_warning = True, show_spinner = False)
-def basic_filtering(df, remove_outlier = False):
-  
-  df['ad_time_ntz'] = pd.to_datetime(df['ad_time_ntz'])
-  df['month'] = pd.to_datetime(df['month']).dt.date
-
-  # don't want to look at free spots
-  df = df[df['cost'] > 0]
-
-  # remove spots that never had any impression
-  df = df[df['impression'] > 0]
+# histograms are binned here rather than in the browser, and cached per
+# filter state. see common/histogram.py
+@instrument.instrumented()
+@memo.memoize(max_entries = 64)
+def users_histogram(df_filtered, state):
+  return histogram.histogram(df_filtered.loc[df_filtered['timezone'] == state, 'users'], bin_width = 1)
 
-  # we want the more recent data, based on the past 6 months because the cost and performance have varied greated during covid
-  df = df[df['ad_time_ntz'] >= '2021-01-01']
-
-  if remove_outlier == True: 
-    # remove extream outliers
-    user_stats = df[['timezone', 'users']].groupby(['timezone']).agg(['mean', 'std']).reset_index()
-    user_stats.columns = user_stats.columns.map('-'.join)
-    user_stats.rename(columns = {'timezone-':'timezone'}, inplace = True)
-
-    df = df.merge(user_stats, on = 'timezone')
-
-    ## remove extreme outliers 5 std from the mean
-    df = df[df['users'] <= df['users-mean'] + 5 * df['users-std']]
-
-  return df
+@instrument.instrumented()
+@memo.memoize(max_entries = 64)
+def aggregate_histograms(df_aggregate):
+  return (histogram.histogram(df_aggregate['total_impression'], bin_width = 20),
+    histogram.histogram(df_aggregate['total_users'], nbins = 50))
 
 
 
 ## MAIN ###################################
+instrument.configure_logging()
+instrument.start_run()
 st.title('WEIGHTED: TV program picking optimization')
 df = load_data()
 
 st.write('Data Sample')
-st.write(df.head(30))
+# one page at a time, the full table stays on the server. see common/table.py
+table.paginated_table(st, df, key = 'data_sample', page_size = 30)
 
 
 ## PRELIMINARY DATA CLEANING, REMOVING OUTLIERS
@@ -96,7 +56,7 @@ st.write('Remove all 0 impression, as these should not have any users attributed
 st.write('Also only filter for this year\'s data')
 
 remove_outlier = st.radio('Remove spots with extreme user counts?', options = [False, True])
-df_filtered = basic_filtering(df.copy(), remove_outlier) # cached operation, use copy
+df_filtered = optimizer.basic_filtering(df, remove_outlier) # cached operation, no copy needed
 
 # st.write(df_filtered.head())
 
@@ -113,10 +73,9 @@ state = st.selectbox('Location', df_filtered['timezone'].sort_values(ascending =
 
 df_filtered_stated = df_filtered[df_filtered['timezone'] == state]
 
-bin_width= 1
-nbins = math.ceil((df_filtered_stated["users"].max() - df_filtered_stated["users"].min()) / bin_width)
-users_hist = px.histogram(df_filtered_stated, x = 'users', nbins = nbins)
-st.plotly_chart(users_hist)
+with instrument.span('users histogram chart'):
+  users_hist = histogram.figure(users_histogram(df_filtered, state), x_title = 'users')
+  st.plotly_chart(users_hist)
 
 st.write('Programs with highest user count.')
 st.write(df_filtered_stated.sort_values('users', ascending = False).head())
@@ -125,9 +84,7 @@ st.write('Calculate mean and standard deviation for users based on each state.')
 st.write('We don\'t want to consider programs that have total users that are less than a specific threshold')
 
 # get users mean and standard deviation based on states.
-user_stats = df_filtered[['timezone', 'users']].groupby(['timezone']).agg(['mean', 'std']).reset_index()
-user_stats.columns = user_stats.columns.map('-'.join)
-user_stats.rename(columns = {'timezone-':'timezone'}, inplace = True)
+user_stats = optimizer.user_stats(df_filtered)
 st.write(user_stats)
 
 ## Recommendation list
@@ -135,40 +92,21 @@ st.title('Filtering out programs that have low AGGREGATED users')
 
 user_threshold = st.number_input('Mininum user threshold: Mean + Threadhold * STD (unit of STD)', min_value = 0)
 
-df_aggregate = df_filtered[['timezone', 
-                    'channel',
-                    'program',
-                    'spot',
-                    'cost',
-                    'impression',
-                    'users']].groupby(['timezone', 'channel', 'program']) \
-                      .sum() \
-                        .reset_index() \
-                          .rename(columns = {'spot': 'total_spots',
-                                              'cost': 'total_cost',
-                                              'impression': 'total_impression',
-                                              'users': 'total_users'})
-
-df_aggregate = df_aggregate.merge(user_stats, on = 'timezone')
-
-## Filter out those where cost and impression is 0
-df_aggregate = df_aggregate[(df_aggregate['total_users'] >= df_aggregate['users-mean'] + user_threshold * df_aggregate['users-std']) 
-                          & (df_aggregate['total_impression'] > 0)]
+# totals per program, filtered on the threshold, with cpu and upm
+df_aggregate = optimizer.aggregate_programs(df_filtered, user_threshold)
 
 
 ## CHECKING OUT DISTRIBUTION AFTER FILTERING HAS COMPLETED
-st.write(df_aggregate[['timezone','total_cost']].groupby('timezone').count().rename(columns = {'total_cost': 'count'}))
+st.write(df_aggregate[['timezone','total_cost']].groupby('timezone', observed = True).count().rename(columns = {'total_cost': 'count'}))
+
+impression_bins, users_bins = aggregate_histograms(df_aggregate)
 
-bin_width= 20
-nbins = math.ceil((df_aggregate["total_impression"].max() - df_aggregate["total_impression"].min()) / bin_width)
-impression_hist = px.histogram(df_aggregate, x = 'total_impression', nbins = nbins)
-st.plotly_chart(impression_hist)
+with instrument.span('aggregate histogram charts'):
+  impression_hist = histogram.figure(impression_bins, x_title = 'total_impression')
+  st.plotly_chart(impression_hist)
 
-bin_width= 20
-# here you can choose your rounding method, I've chosen math.ceil
-nbins = math.ceil((df_aggregate["total_users"].max() - df_aggregate["total_users"].min()) / bin_width)
-users_hist = px.histogram(df_aggregate, x = 'total_users', nbins = 50)
-st.plotly_chart(users_hist)
+  users_hist = histogram.figure(users_bins, x_title = 'total_users')
+  st.plotly_chart(users_hist)
 
 st.write('summary stats')
 st.write(df_aggregate[['total_impression', 'total_users']].describe())
@@ -177,46 +115,44 @@ st.write(df_aggregate.sort_values('total_users', ascending = False).head())
 
 ## RECOMMENDATION LIST
 
-df_aggregate['cpu'] = df_aggregate['total_cost'] / df_aggregate['total_users']
-df_aggregate['upm'] = df_aggregate['total_users'] / df_aggregate['total_impression']
-
 # cost penalty input
-df_final = df_aggregate.copy()
-
-state = st.multiselect('Location', df_final['timezone'].sort_values(ascending = True) \
+state = st.multiselect('Location', df_aggregate['timezone'].sort_values(ascending = True) \
   .unique() \
     .tolist()) 
-  
-df_final = df_final[df_final['timezone'].isin(state)]
 
 cost_penalty = st.number_input('Cost penalty as CPU^n (unit of n)', min_value = 1, step = 10)
+top_k = st.number_input('Programs to show per location', min_value = 1, value = 50)
 
+# ratings are computed in log space, log(upm / cpu^n) = log(upm) - n * log(cpu),
+# which ranks the same as upm / cpu^n without overflowing for large n.
+# only the top_k programs per location are selected, see ranking.py
 
-df_final['cpu_weighted'] = np.power(df_final['cpu'], cost_penalty)
-# df_final['cpu_weighted'] = df_final['cpu'] * np.power(10, cost_penalty)
-df_final['rating'] = df_final['upm']/df_final['cpu_weighted']
+# memoized on df_aggregate and the inputs, so the tables below keep their
+# sort and page caches across reruns
 
 # rank by cpu
-df_final = df_final.sort_values(by = ['timezone', 'cpu'],
-                                    ascending = [True, True]).reset_index(drop = True)
-
+df_cheapest = optimizer.recommendations(df_aggregate, cost_penalty, timezones = state, k = top_k, by = 'cpu')
 
 st.write('Most cost effective program: ', state)
-st.write(df_final[['timezone', 'channel','program', 'cpu', 'upm', 'total_cost', 'total_impression', 'total_users']])
+table.paginated_table(st, df_cheapest, key = 'cheapest',
+  columns = ['timezone', 'channel','program', 'cpu', 'upm', 'total_cost', 'total_impression', 'total_users'])
 
 # rank by rating
-df_final = df_final.sort_values(by = ['timezone', 'rating'],
-                                    ascending = [True, False]).reset_index(drop = True)
+df_final = optimizer.recommendations(df_aggregate, cost_penalty, timezones = state, k = top_k)
 
 st.write('Most recommended programs in: ', state)
-st.write(df_final[['timezone', 'channel','program', 'cpu', 'upm', 'rating', 'total_cost', 'total_impression', 'total_users']])
+table.paginated_table(st, df_final, key = 'recommended',
+  columns = ['timezone', 'channel','program', 'cpu', 'upm', 'log_rating', 'total_cost', 'total_impression', 'total_users'])
 
 ## plot upm versus cpu (top 20)
+# plotly is loaded here rather than at start, see benchmarks/cold_start.py
+import plotly.graph_objects as go
+
 trace2 = go.Scatter(
-  x = df_final['cpu_weighted'].head(10),
+  x = df_final['log_cpu_weighted'].head(10),
   y = df_final['upm'].head(10),
   mode = 'markers+text',
-  text = df_final['program'],
+  text = df_final['program'].head(10),
   textposition = 'bottom right'
 )
 
@@ -224,14 +160,37 @@ fig2 = go.Figure(data = trace2)
 
 fig2.update_layout(
     title="Top 10 Rated Programs",
-    xaxis_title='Expensiveness (CPU weighted)',
+    xaxis_title='Expensiveness (log CPU weighted)',
     yaxis_title='Freshness (UPM)'
     )
 
-st.plotly_chart(fig2)
+with instrument.span('top 10 chart'):
+  st.plotly_chart(fig2)
 
 # st.write(df_final)
-# df_final.to_csv('program_list.csv', index = False)
+# recommendation lists for every location are exported by batch_export.py
+
+## BUDGET PORTFOLIO
+st.title('Budget portfolio')
+st.write('Programs of the selected locations that reach the most users within a budget.')
+
+budget = st.number_input('Budget', min_value = 0.0, value = 100000.0, step = 10000.0)
+budget_scope = st.radio('Budget applies to', options = ['all selected locations', 'each location'])
+max_spots = st.number_input('Spot limit (0 for none)', min_value = 0, value = 0, step = 10)
+method = st.selectbox('Solver', options = ['auto', 'exact', 'greedy'])
+
+if budget_scope == 'each location':
+  budget = {timezone: budget for timezone in state}
+# exact for small inputs, greedy on the LP relaxation otherwise, see portfolio.py
+selection, portfolio_summary = optimizer.budget_portfolio(df_aggregate, budget,
+  max_spots = max_spots or None, timezones = state, method = method)
+
+st.write(portfolio_summary)
+table.paginated_table(st, selection, key = 'portfolio',
+  columns = ['timezone', 'channel', 'program', 'total_spots', 'total_cost', 'total_users', 'users_per_cost'])
+
+# load, filtering, aggregation and chart timings, see common/instrument.py
+instrument.render_panel(st)
 
 
 
@@ -0,0 +1,84 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import optimizer
+
+## Batch export of program recommendations.
+# Computes the recommendation table for every timezone over a grid of
+# user_threshold x cost_penalty values, without a browser session, e.g.
+#
+#   python batch_export.py --thresholds 0 1 2 --penalties 1 11 21 --top-k 50 \
+#     --output-dir exports --format parquet
+#
+# The spots table is loaded and filtered once, then each user_threshold is
+# aggregated and rated (all penalties in one pass) in a worker process.
+# One file is written per threshold.
+
+_df_filtered = None
+
+def _init_worker(df_filtered):
+  # the filtered table is sent once per worker, not once per task
+  global _df_filtered
+  _df_filtered = df_filtered
+
+def _export_threshold(user_threshold, cost_penalties, top_k, output_dir, file_format):
+  grid = optimizer.recommendation_grid(_df_filtered, user_threshold, cost_penalties, k = top_k)
+  grid.insert(0, 'user_threshold', user_threshold)
+
+  path = os.path.join(output_dir, 'program_list_threshold-{}.{}'.format(user_threshold, file_format))
+  if file_format == 'parquet':
+    grid.to_parquet(path, index = False)
+  else:
+    grid.to_csv(path, index = False)
+  return path, len(grid)
+
+def run(user_thresholds, cost_penalties, top_k = None, remove_outlier = False,
+    output_dir = '.', file_format = 'parquet', workers = None, df = None):
+  os.makedirs(output_dir, exist_ok = True)
+
+  if df is None:
+    df = optimizer.load_shared_spots()
+  df_filtered = optimizer.basic_filtering(df, remove_outlier)
+
+  paths = []
+  with ProcessPoolExecutor(max_workers = workers, initializer = _init_worker, initargs = (df_filtered,)) as pool:
+    futures = [pool.submit(_export_threshold, threshold, cost_penalties, top_k, output_dir, file_format)
+      for threshold in user_thresholds]
+    for future in as_completed(futures):
+      path, rows = future.result()
+      print('wrote {} ({} rows)'.format(path, rows))
+      paths.append(path)
+
+  return sorted(paths)
+
+def main(argv = None):
+  parser = argparse.ArgumentParser(description = 'Export TV program recommendations for every timezone.')
+  parser.add_argument('--thresholds', type = float, nargs = '+', default = [0],
+    help = 'user thresholds, in units of std above the timezone mean')
+  parser.add_argument('--penalties', type = float, nargs = '+', default = [1],
+    help = 'cost penalties n, rating = upm / cpu^n')
+  parser.add_argument('--top-k', type = int, default = None,
+    help = 'programs per timezone and penalty (default: all)')
+  parser.add_argument('--remove-outlier', action = 'store_true',
+    help = 'drop spots more than 5 std above their timezone mean')
+  parser.add_argument('--output-dir', default = '.')
+  parser.add_argument('--format', choices = ['parquet', 'csv'], default = 'parquet')
+  parser.add_argument('--workers', type = int, default = None,
+    help = 'worker processes (default: one per cpu)')
+  args = parser.parse_args(argv)
+
+  start = time.time()
+  run(args.thresholds, args.penalties,
+    top_k = args.top_k,
+    remove_outlier = args.remove_outlier,
+    output_dir = args.output_dir,
+    file_format = args.format,
+    workers = args.workers)
+  print('done in {:.1f}s'.format(time.time() - start))
+
+if __name__ == '__main__':
+  main()
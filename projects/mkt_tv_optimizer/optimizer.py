@@ -0,0 +1,181 @@
+import pandas as pd
+
+from common import compute, dtypes, instrument, memo, moments, shared_store, time_index
+from common.query_spec import QuerySpec, read_spec
+import portfolio
+import ranking
+
+## Compute core of the TV program optimizer.
+# Pure functions with no streamlit dependency, used by app.py and by the
+# batch export (batch_export.py). Memoized results are shared and must not
+# be modified by callers.
+
+# we want the more recent data, based on the past 6 months because the cost and performance have varied greated during covid
+START_DATE = '2021-01-01'
+
+# columns and rows that basic_filtering and the aggregation below need.
+# compiled into the warehouse query, and re-applied in pandas as a fallback.
+TV_PROGRAM_SPEC = QuerySpec(
+  table = '"STREAMLIT_PUBLIC"."MKT_TV"."TV_PROGRAM_OPTIMIZER"',
+  columns = ['ad_time_ntz', 'month', 'timezone', 'channel', 'program',
+    'spot', 'cost', 'impression', 'users'],
+  filters = [
+    # don't want to look at free spots
+    ('cost', '>', 0),
+    # remove spots that never had any impression
+    ('impression', '>', 0),
+    # only recent data, see START_DATE
+    ('ad_time_ntz', '>=', START_DATE),
+  ])
+
+# compact dtypes for the spots table, see common/dtypes.py. month is a
+# datetime64: a categorical of dates comes back from the result cache's
+# parquet as python objects, cache hits and misses would differ
+TV_PROGRAM_SCHEMA = {
+  'timezone': 'category',
+  'channel': 'category',
+  'program': 'category',
+  'month': 'datetime',
+  'spot': 'int',
+  'impression': 'int',
+  'users': 'int',
+}
+
+def convert_chunk(df):
+  # row by row conversion, applied to each chunk as it is fetched
+  df['ad_time_ntz'] = pd.to_datetime(df['ad_time_ntz'])
+  return dtypes.apply_schema(df, TV_PROGRAM_SCHEMA)
+
+def sort_spots(df):
+  # kept sorted on the spot time so date filters are a slice
+  return time_index.sort_by_time(df, 'ad_time_ntz')
+
+def convert_types(df):
+  return sort_spots(convert_chunk(df))
+
+@instrument.instrumented()
+def load_spots(ttl = 12 * 3600):
+  # pull only the needed columns and rows into dataframe, through the shared
+  # pooled engine, streamed and converted chunk by chunk to bound peak memory.
+  # results are also kept on disk so restarts come up warm
+  return read_spec(TV_PROGRAM_SPEC, ttl = ttl, convert_chunk = convert_chunk, convert = sort_spots)
+
+def load_shared_spots(max_age = 12 * 3600):
+  # one fetch per host, every app process maps the same arrow file instead
+  # of holding its own copy, see common/shared_store.py
+  return shared_store.get_store().get_or_load('TV_PROGRAM_OPTIMIZER', load_spots, max_age)
+
+# the spots table is the only query, loaded once per host through the shared store
+QUERIES = {
+  'TV_PROGRAM_OPTIMIZER': load_shared_spots,
+}
+
+# groupbys of the aggregation, run by the configured compute backend
+# (common/compute.py), in memory or out of core
+PROGRAM_KEYS = ['timezone', 'channel', 'program']
+PROGRAM_TOTALS = {
+  'total_spots': ('spot', 'sum'),
+  'total_cost': ('cost', 'sum'),
+  'total_impression': ('impression', 'sum'),
+  'total_users': ('users', 'sum'),
+}
+USER_STATS = {
+  'users-mean': ('users', 'mean'),
+  'users-std': ('users', 'std'),
+}
+
+def compute_user_stats(df, filters = ()):
+  # users mean and standard deviation per timezone, of a table or a file
+  return compute.get_compute().group_aggregate(df, ['timezone'], USER_STATS, filters)
+
+@memo.memoize(max_entries = 16)
+def user_moments(df):
+  # mergeable users count, mean and M2 per timezone, see common/moments.py
+  return moments.GroupMoments.from_groups(df['timezone'], df['users'])
+
+# spots with more users than mean + OUTLIER_SIGMAS * std of their timezone
+OUTLIER_SIGMAS = 5
+
+# keyed on the identity of df and remove_outlier, no hashing of the table.
+@instrument.instrumented()
+@memo.memoize(max_entries = 8, max_bytes = 2 * 1024 ** 3)
+def basic_filtering(df, remove_outlier = False):
+
+  # free spots, 0 impression and old spots are normally dropped by the
+  # warehouse already, this is a no-op then and the fallback otherwise
+  df = time_index.slice_time_range(df, 'ad_time_ntz', start = START_DATE)
+  df = TV_PROGRAM_SPEC.apply(df)
+
+  if remove_outlier == True: 
+    ## remove extreme outliers 5 std from the mean, looked up per row
+    # through the timezone codes, the table keeps its columns and order
+    df = df[user_moments(df).within(df['timezone'], df['users'], OUTLIER_SIGMAS)]
+
+  return df
+
+@instrument.instrumented()
+@memo.memoize(max_entries = 8)
+def user_stats(df_filtered):
+  return user_moments(df_filtered).frame('timezone', 'users')
+
+def select_programs(df_totals, user_stats, user_threshold = 0):
+  # keeps programs whose total users reach mean + user_threshold * std of
+  # their timezone, with cpu and upm
+  df_aggregate = df_totals.merge(user_stats, on = 'timezone')
+
+  ## Filter out those where cost and impression is 0
+  df_aggregate = df_aggregate[(df_aggregate['total_users'] >= df_aggregate['users-mean'] + user_threshold * df_aggregate['users-std']) 
+                            & (df_aggregate['total_impression'] > 0)]
+
+  df_aggregate = df_aggregate.assign(
+    cpu = df_aggregate['total_cost'] / df_aggregate['total_users'],
+    upm = df_aggregate['total_users'] / df_aggregate['total_impression'])
+
+  return df_aggregate.reset_index(drop = True)
+
+@instrument.instrumented()
+@memo.memoize(max_entries = 32)
+def aggregate_programs(df_filtered, user_threshold = 0):
+  # totals per (timezone, channel, program) of the programs selected by
+  # user_threshold, see select_programs
+  df_totals = compute.get_compute().group_aggregate(df_filtered, PROGRAM_KEYS, PROGRAM_TOTALS)
+  return select_programs(df_totals, user_stats(df_filtered), user_threshold)
+
+@instrument.instrumented()
+def aggregate_spots_file(path, user_threshold = 0):
+  # aggregate_programs(basic_filtering(spots)) of a spots Parquet or Arrow
+  # file, e.g. the shared store's, filtered and grouped by the compute
+  # backend while scanning the file. outliers are not removed
+  filters = TV_PROGRAM_SPEC.filters
+  df_totals = compute.get_compute().group_aggregate(path, PROGRAM_KEYS, PROGRAM_TOTALS, filters)
+  return select_programs(df_totals, compute_user_stats(path, filters), user_threshold)
+
+# memoized so the app's paginated tables get the same frame back on every
+# rerun, see common/table.py. df_aggregate is itself memoized
+@instrument.instrumented()
+@memo.memoize(max_entries = 32)
+def recommendations(df_aggregate, cost_penalty, timezones = None, k = None, by = 'rating'):
+  # top k programs per timezone, see ranking.rank_programs
+  if timezones is not None:
+    df_aggregate = df_aggregate[df_aggregate['timezone'].isin(timezones)]
+  return ranking.rank_programs(df_aggregate, cost_penalty, k = k, by = by)
+
+@instrument.instrumented()
+def recommendation_grid(df_filtered, user_threshold, cost_penalties, k = None):
+  # recommendations for every timezone and every cost penalty at one
+  # user_threshold, as one long table (cost_penalty, timezone, rank, ...)
+  return ranking.penalty_sweep(aggregate_programs(df_filtered, user_threshold), cost_penalties, k = k)
+
+def _portfolio_key(df_aggregate, budget, max_spots = None, timezones = None, method = 'auto'):
+  # a budget per timezone is a dict, keyed as its sorted items
+  if isinstance(budget, dict):
+    budget = tuple(sorted(budget.items()))
+  return df_aggregate, budget, max_spots, timezones, method
+
+@instrument.instrumented()
+@memo.memoize(max_entries = 16, key = _portfolio_key)
+def budget_portfolio(df_aggregate, budget, max_spots = None, timezones = None, method = 'auto'):
+  # the programs reaching the most users within budget and max_spots, see portfolio.py
+  if timezones is not None:
+    df_aggregate = df_aggregate[df_aggregate['timezone'].isin(timezones)]
+  return portfolio.solve_portfolio(df_aggregate, budget, max_spots, method)
@@ -0,0 +1,247 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+## Budget constrained program portfolio.
+# Picks the set of (timezone, channel, program) candidates of the aggregate
+# table that maximizes total_users, with total_cost within a budget and
+# total_spots within a spot limit (a 0/1 knapsack with two constraints).
+# The budget is either one total, or one per timezone, solved separately.
+#
+#   exact   branch and bound over candidates sorted by users per cost, bounded
+#           by the fractional (LP) fill of the budget. exponential in the
+#           worst case, used for up to EXACT_LIMIT candidates. a search that
+#           visits EXACT_NODES nodes stops, and the better of its best
+#           selection so far ('exact, stopped') and greedy's is used
+#   greedy  the LP relaxation with the spot limit priced in: candidates are
+#           ranked by (users - price * spots) / cost and taken while the
+#           budget lasts, with the price found by bisection so the spot limit
+#           holds. then one pass adds whatever still fits, and the best
+#           single candidate is kept if it alone does better. O(n log n) per
+#           bisection step, well under a second at 100k candidates
+#
+# Headless use:
+#
+#   python portfolio.py --budget 250000 --max-spots 400 --output portfolio.csv
+#   python portfolio.py --timezone-budget Australia/Sydney=50000 --timezone-budget Europe/London=80000
+#   COMPUTE_BACKEND=duckdb python portfolio.py --budget 250000 --spots spots.parquet
+#
+# --spots aggregates a Parquet or Arrow file out of core (see common/compute.py)
+# instead of loading the spots table into memory.
+
+EXACT_LIMIT = 40
+# search nodes exact may visit (about a second) before it stops with the best
+# selection found so far, see solve
+EXACT_NODES = 200000
+BISECTION_STEPS = 30
+
+def _exact(cost, users, spots, budget, max_spots, max_nodes = None):
+  # (positions, finished). finished is False when the search stopped at
+  # max_nodes (EXACT_NODES by default), the positions are then the best
+  # selection it had found
+  max_nodes = EXACT_NODES if max_nodes is None else max_nodes
+  order = np.argsort(-(users / cost), kind = 'stable')
+  c, v, s = cost[order], users[order], spots[order]
+  n = len(c)
+  cum_cost = np.concatenate([[0.0], np.cumsum(c)])
+  cum_users = np.concatenate([[0.0], np.cumsum(v)])
+
+  def bound(i, remaining):
+    # fractional fill of candidates i.. in ratio order, ignoring the spot limit
+    k = int(np.searchsorted(cum_cost, cum_cost[i] + remaining, side = 'right')) - 1
+    value = cum_users[k] - cum_users[i]
+    if k < n:
+      value += v[k] * (cum_cost[i] + remaining - cum_cost[k]) / c[k]
+    return value
+
+  # depth first with an explicit stack, taking a candidate before skipping
+  # it. chosen is a linked list (i, rest) shared between branches
+  best_value, best_chosen = 0.0, None
+  stack = [(0, budget, max_spots, 0.0, None)]
+  nodes = 0
+  while stack:
+    nodes += 1
+    if nodes > max_nodes:
+      break
+    i, remaining, spots_left, value, chosen = stack.pop()
+    if value > best_value:
+      best_value, best_chosen = value, chosen
+    if i == n or value + bound(i, remaining) <= best_value + 1e-9:
+      continue
+    stack.append((i + 1, remaining, spots_left, value, chosen))
+    if c[i] <= remaining and s[i] <= spots_left:
+      stack.append((i + 1, remaining - c[i], spots_left - s[i], value + v[i], (i, chosen)))
+
+  positions = []
+  while best_chosen is not None:
+    i, best_chosen = best_chosen
+    positions.append(i)
+  return np.sort(order[np.asarray(positions, dtype = np.int64)]), not stack
+
+def _greedy(cost, users, spots, budget, max_spots):
+  def ranked(price):
+    score = users - price * spots
+    candidates = np.flatnonzero((score > 0) & (cost <= budget))
+    return candidates[np.argsort(-(score[candidates] / cost[candidates]), kind = 'stable')]
+
+  def prefix(order):
+    # the longest prefix of order within the budget
+    return order[:int(np.searchsorted(np.cumsum(cost[order]), budget, side = 'right'))]
+
+  order = ranked(0.0)
+  if np.isfinite(max_spots) and spots[prefix(order)].sum() > max_spots:
+    # the cheapest price on a spot that brings the prefix within the limit
+    low, high = 0.0, float(np.max(users / np.maximum(spots, 1)))
+    for _ in range(BISECTION_STEPS):
+      price = (low + high) / 2
+      if spots[prefix(ranked(price))].sum() > max_spots:
+        low = price
+      else:
+        high = price
+    order = ranked(high)
+
+  # take candidates in order while both constraints hold, skipping those that
+  # do not fit rather than stopping at the first one. then the unpriced order,
+  # for whatever room a too high price left
+  selected = []
+  taken = np.zeros(len(cost), dtype = bool)
+  remaining, spots_left = budget, max_spots
+  for i in np.concatenate([order, ranked(0.0)]).tolist():
+    if not taken[i] and cost[i] <= remaining and spots[i] <= spots_left:
+      selected.append(i)
+      taken[i] = True
+      remaining -= cost[i]
+      spots_left -= spots[i]
+
+  # the best single candidate can beat the greedy fill
+  fits = np.flatnonzero((cost <= budget) & (spots <= max_spots))
+  if len(fits):
+    single = fits[np.argmax(users[fits])]
+    if users[single] > users[selected].sum():
+      selected = [single]
+  return np.sort(np.asarray(selected, dtype = np.int64))
+
+def solve(cost, users, spots, budget, max_spots = None, method = 'auto'):
+  # positions of the selected candidates, and the method used
+  cost = np.asarray(cost, dtype = np.float64)
+  users = np.asarray(users, dtype = np.float64)
+  spots = np.asarray(spots, dtype = np.float64)
+  max_spots = np.inf if max_spots is None else max_spots
+
+  # free candidates are always worth taking, the rest compete for the budget
+  free = cost <= 0
+  paid = np.flatnonzero(~free)
+  free_spots = spots[free].sum()
+  if free_spots > max_spots:
+    raise ValueError('free candidates alone need {} spots, above the limit'.format(int(free_spots)))
+
+  if method == 'auto':
+    method = 'exact' if len(paid) <= EXACT_LIMIT else 'greedy'
+  if method not in ('exact', 'greedy'):
+    raise ValueError('unknown method {}, expected auto, exact or greedy'.format(method))
+
+  cost, users, spots = cost[paid], users[paid], spots[paid]
+  max_spots -= free_spots
+  if not len(paid):
+    picked = paid
+  elif method == 'exact':
+    picked, finished = _exact(cost, users, spots, budget, max_spots)
+    if not finished:
+      # too many candidates to prove the optimum in time, the greedy fill
+      # may well beat what the search found
+      greedy = _greedy(cost, users, spots, budget, max_spots)
+      if users[greedy].sum() > users[picked].sum():
+        picked, method = greedy, 'greedy'
+      else:
+        method = 'exact, stopped'
+    picked = paid[picked]
+  else:
+    picked = paid[_greedy(cost, users, spots, budget, max_spots)]
+  return np.sort(np.concatenate([np.flatnonzero(free), picked])), method
+
+def solve_portfolio(df_aggregate, budget, max_spots = None, method = 'auto'):
+  # (selection, summary). budget is a total over all rows, or a dict of
+  # timezone -> budget (other timezones are left out); max_spots applies the
+  # same way. selection is the chosen rows of df_aggregate, summary has one
+  # row per budget with spend, spots, users and the method used
+  if isinstance(budget, dict):
+    groups = [(timezone, df_aggregate.index[df_aggregate['timezone'] == timezone], amount)
+      for timezone, amount in budget.items()]
+  else:
+    groups = [('all', df_aggregate.index, budget)]
+
+  selected = []
+  summary = []
+  for name, index, amount in groups:
+    rows = df_aggregate.loc[index]
+    positions, used = solve(rows['total_cost'], rows['total_users'], rows['total_spots'], amount, max_spots, method)
+    chosen = rows.iloc[positions]
+    selected.append(chosen)
+    summary.append({
+      'budget': name,
+      'amount': amount,
+      'spend': chosen['total_cost'].sum(),
+      'spots': int(chosen['total_spots'].sum()),
+      'users': chosen['total_users'].sum(),
+      'programs': len(chosen),
+      'candidates': len(rows),
+      'method': used,
+    })
+
+  selection = pd.concat(selected) if selected else df_aggregate.iloc[:0]
+  selection = selection.assign(users_per_cost = selection['total_users'] / selection['total_cost']) \
+    .sort_values(['timezone', 'users_per_cost'], ascending = [True, False], kind = 'mergesort')
+  return selection.reset_index(drop = True), pd.DataFrame(summary)
+
+
+def _timezone_budget(text):
+  timezone, _, amount = text.rpartition('=')
+  if not timezone:
+    raise argparse.ArgumentTypeError('expected TIMEZONE=AMOUNT, got {}'.format(text))
+  return timezone, float(amount)
+
+def main(argv = None):
+  parser = argparse.ArgumentParser(description = 'Pick the programs that reach the most users within a budget.')
+  budget = parser.add_mutually_exclusive_group(required = True)
+  budget.add_argument('--budget', type = float, help = 'total budget over all timezones')
+  budget.add_argument('--timezone-budget', type = _timezone_budget, action = 'append',
+    help = 'TIMEZONE=AMOUNT, repeat for each timezone')
+  parser.add_argument('--max-spots', type = int, default = None,
+    help = 'spot limit, per timezone with --timezone-budget')
+  parser.add_argument('--user-threshold', type = float, default = 0,
+    help = 'user threshold of the aggregation, in units of std above the timezone mean')
+  parser.add_argument('--remove-outlier', action = 'store_true')
+  parser.add_argument('--spots', default = None, help = 'Parquet or Arrow file of spots, aggregated out of core')
+  parser.add_argument('--method', choices = ['auto', 'exact', 'greedy'], default = 'auto')
+  parser.add_argument('--output', default = None, help = 'csv or parquet file for the selection')
+  args = parser.parse_args(argv)
+  if args.spots and args.remove_outlier:
+    parser.error('--remove-outlier needs the spots in memory, it cannot be used with --spots')
+
+  # imported here, optimizer imports this module
+  sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+  import optimizer
+
+  start = time.time()
+  if args.spots:
+    df_aggregate = optimizer.aggregate_spots_file(args.spots, args.user_threshold)
+  else:
+    df_filtered = optimizer.basic_filtering(optimizer.load_shared_spots(), args.remove_outlier)
+    df_aggregate = optimizer.aggregate_programs(df_filtered, args.user_threshold)
+  budget = dict(args.timezone_budget) if args.timezone_budget else args.budget
+  selection, summary = solve_portfolio(df_aggregate, budget, args.max_spots, args.method)
+
+  print(summary.to_string(index = False))
+  if args.output:
+    if args.output.endswith('.parquet'):
+      selection.to_parquet(args.output, index = False)
+    else:
+      selection.to_csv(args.output, index = False)
+  print('done in {:.1f}s'.format(time.time() - start))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+
+## Program rating engine.
+# The rating upm / cpu^n overflows to inf for realistic cpu values once n is
+# a few tens. log(rating) = log(upm) - n * log(cpu) has the same ordering and
+# stays finite, and is linear in n, so a whole vector of cost penalties is a
+# single outer product. Only the top k programs per timezone are selected,
+# with argpartition rather than sorting every row.
+
+def log_terms(df):
+  # log(upm) and log(cpu); a cpu of 0 is free (+inf rating), a upm of 0 never rates
+  with np.errstate(divide = 'ignore', invalid = 'ignore'):
+    log_upm = np.log(df['upm'].to_numpy(dtype = 'float64'))
+    log_cpu = np.log(df['cpu'].to_numpy(dtype = 'float64'))
+  return log_upm, log_cpu
+
+def log_rating(df, cost_penalty):
+  log_upm, log_cpu = log_terms(df)
+  with np.errstate(invalid = 'ignore'):
+    rating = log_upm - cost_penalty * log_cpu
+  return np.nan_to_num(rating, nan = -np.inf)
+
+def log_rating_matrix(df, cost_penalties):
+  # one column of log ratings per cost penalty, shape (len(df), len(penalties))
+  log_upm, log_cpu = log_terms(df)
+  penalties = np.asarray(cost_penalties, dtype = 'float64')
+  with np.errstate(invalid = 'ignore'):
+    ratings = log_upm[:, None] - log_cpu[:, None] * penalties[None, :]
+  return np.nan_to_num(ratings, nan = -np.inf)
+
+def top_k_positions(scores, groups, k, ascending = False):
+  # positions of the k best scores within each group, best first, groups in
+  # sorted order. argpartition per group is O(n) instead of a full sort.
+  codes, uniques = pd.factorize(groups, sort = True)
+  order = np.argsort(codes, kind = 'stable')
+  bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+
+  keyed = scores if ascending else -scores
+  positions = []
+  for i in range(len(uniques)):
+    members = order[bounds[i]:bounds[i + 1]]
+    if k is not None and len(members) > k:
+      members = members[np.argpartition(keyed[members], k - 1)[:k]]
+    # stable, so ties keep their original order like sort_values
+    positions.append(members[np.argsort(keyed[members], kind = 'stable')])
+
+  if not positions:
+    return np.array([], dtype = 'int64')
+  return np.concatenate(positions)
+
+def rank_programs(df_aggregate, cost_penalty, k = None, by = 'rating'):
+  # top k rows per timezone with log_cpu_weighted and log_rating added, ordered by
+  # timezone then best first. by='cpu' ranks by cheapest cost per user instead.
+  rating = log_rating(df_aggregate, cost_penalty)
+
+  if by == 'rating':
+    positions = top_k_positions(rating, df_aggregate['timezone'].to_numpy(), k)
+  else:
+    positions = top_k_positions(df_aggregate[by].to_numpy(dtype = 'float64'), df_aggregate['timezone'].to_numpy(), k, ascending = True)
+
+  _, log_cpu = log_terms(df_aggregate)
+  ranked = df_aggregate.iloc[positions].copy()
+  ranked['log_cpu_weighted'] = cost_penalty * log_cpu[positions]
+  ranked['log_rating'] = rating[positions]
+  return ranked.reset_index(drop = True)
+
+def penalty_sweep(df_aggregate, cost_penalties, k = 10):
+  # top k programs per (cost_penalty, timezone) for a whole grid of penalties,
+  # computed from one rating matrix
+  ratings = log_rating_matrix(df_aggregate, cost_penalties)
+  timezones = df_aggregate['timezone'].to_numpy()
+
+  frames = []
+  for j, cost_penalty in enumerate(cost_penalties):
+    positions = top_k_positions(ratings[:, j], timezones, k)
+    ranked = df_aggregate.iloc[positions].copy()
+    ranked.insert(0, 'cost_penalty', cost_penalty)
+    ranked['log_rating'] = ratings[positions, j]
+    ranked['rank'] = ranked.groupby('timezone', observed = True).cumcount() + 1
+    frames.append(ranked)
+
+  if not frames:
+    return df_aggregate.iloc[:0].assign(cost_penalty = [], log_rating = [], rank = [])
+  return pd.concat(frames, ignore_index = True)
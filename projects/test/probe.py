@@ -0,0 +1,206 @@
+import argparse
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import db
+
+## Warehouse latency and throughput probe.
+# Measures, repeated --repeat times:
+#
+#   connect_s      a new engine's login and first round trip (SELECT 1)
+#
+# and for each result size and fetch strategy:
+#
+#   first_row_s    query sent to the first rows received
+#   total_s        query sent to the whole result received, as a DataFrame
+#   rows_per_s     rows / total_s
+#   mb_per_s       in memory size of the result / total_s
+#
+# reported as percentiles (p50, p90, p99, interpolated over the repeats) in
+# JSON. The strategies are those of common/db.py:
+#
+#   read_sql_query  pd.read_sql_query, the whole result in one fetch
+#   chunked         fetchmany of --chunksize rows, converted chunk by chunk
+#   arrow           the driver's arrow batches (snowflake), skipped elsewhere
+#
+#   python probe.py --sizes 1000 100000 1000000 --repeat 5 --output probe.json
+#   python probe.py --local --sizes 1000 100000    # offline, e.g. in CI
+#
+# The backend is DATA_BACKEND's, as in the apps. --local runs against a
+# sqlite stand-in of the table, generated with as many rows as the largest
+# size (and reused by later runs when it is big enough).
+
+DEFAULT_TABLE = '"STREAMLIT_PUBLIC"."TEST_DATA"."DUMMY"'
+STRATEGIES = ['read_sql_query', 'chunked', 'arrow']
+PERCENTILES = [50, 90, 99]
+
+def create_stand_in(path, rows, seed = 0, chunksize = 100000):
+  # sqlite file with a DUMMY table of at least rows synthetic rows, a mix of
+  # the column types the warehouse tables have
+  import sqlite3
+
+  if os.path.exists(path):
+    try:
+      with sqlite3.connect(path) as connection:
+        existing = connection.execute('SELECT COUNT(*) FROM DUMMY').fetchone()[0]
+    except sqlite3.Error:
+      existing = 0
+    if existing >= rows:
+      # generated by an earlier run, big enough
+      return db.LocalBackend('sqlite:///' + path)
+    os.remove(path)
+  rng = np.random.default_rng(seed)
+  names = np.array(['name_{:02d}'.format(i) for i in range(20)])
+  start = pd.Timestamp('2021-01-01')
+
+  with sqlite3.connect(path) as connection:
+    for offset in range(0, rows, chunksize):
+      n = min(chunksize, rows - offset)
+      pd.DataFrame({
+        'id': np.arange(offset, offset + n),
+        'created_at': (start + pd.to_timedelta(rng.integers(0, 365 * 24 * 3600, n), unit = 's')).astype(str),
+        'name': names[rng.integers(0, len(names), n)],
+        'amount': np.round(rng.gamma(2.0, 50.0, n), 2),
+        'quantity': rng.integers(1, 10, n),
+        'flag': rng.integers(0, 2, n),
+      }).to_sql('DUMMY', connection, if_exists = 'append', index = False)
+  return db.LocalBackend('sqlite:///' + path)
+
+def measure_connect(backend):
+  from sqlalchemy import text
+
+  # a new engine, so the login is part of it, unlike the apps' pooled checkouts
+  engine = backend.create_engine()
+  try:
+    start = time.perf_counter()
+    with engine.connect() as connection:
+      connection.execute(text('SELECT 1')).fetchall()
+    return time.perf_counter() - start
+  finally:
+    engine.dispose()
+
+def fetch(strategy, sql, backend, chunksize):
+  # (first_row_s, total_s, frames) of one run, on the pooled engine
+  start = time.perf_counter()
+  first_row = None
+
+  if strategy == 'read_sql_query':
+    from sqlalchemy import text
+    with db.get_engine(backend).connect() as connection:
+      frames = [pd.read_sql_query(text(backend.translate(sql)), connection)]
+  else:
+    frames = []
+    for chunk in db.read_batches(sql, backend = backend, chunksize = chunksize, arrow = strategy == 'arrow'):
+      if first_row is None and len(chunk):
+        first_row = time.perf_counter() - start
+      frames.append(chunk)
+
+  total = time.perf_counter() - start
+  return (total if first_row is None else first_row), total, frames
+
+def percentiles(values):
+  values = np.asarray(values, dtype = np.float64)
+  summary = {'p{}'.format(p): float(np.percentile(values, p)) for p in PERCENTILES}
+  summary.update({'min': float(values.min()), 'max': float(values.max())})
+  return summary
+
+def probe(backend, sizes, strategies = STRATEGIES, repeat = 5, warmup = 1,
+    chunksize = db.DEFAULT_CHUNKSIZE, table = DEFAULT_TABLE):
+  results = []
+
+  for strategy in strategies:
+    for size in sizes:
+      sql = 'SELECT * FROM {} LIMIT {}'.format(table, int(size))
+      result = {'strategy': strategy, 'size': int(size)}
+      runs = []
+      try:
+        for i in range(warmup + repeat):
+          first_row, total, frames = fetch(strategy, sql, backend, chunksize)
+          if i < warmup:
+            continue
+          # measured after the clock stopped, deep sizes of strings are slow
+          rows = sum(len(frame) for frame in frames)
+          size_bytes = sum(int(frame.memory_usage(index = False, deep = True).sum()) for frame in frames)
+          runs.append((first_row, total, rows, size_bytes))
+      except ValueError as e:
+        # no arrow batches on this backend
+        result['skipped'] = str(e)
+        results.append(result)
+        continue
+
+      first_row, total, rows, size_bytes = (np.array(values, dtype = np.float64) for values in zip(*runs))
+      result.update({
+        'rows': int(rows[0]),
+        'mb': float(size_bytes[0] / 1024 ** 2),
+        'chunks': len(frames),
+        'first_row_s': percentiles(first_row),
+        'total_s': percentiles(total),
+        'rows_per_s': percentiles(rows / total),
+        'mb_per_s': percentiles(size_bytes / 1024 ** 2 / total),
+      })
+      results.append(result)
+  return results
+
+def print_results(results):
+  for result in results:
+    if 'skipped' in result:
+      print('{:<15} {:>10,} rows  skipped: {}'.format(result['strategy'], result['size'], result['skipped']))
+      continue
+    print('{:<15} {:>10,} rows  first row p50 {:>8.4f}s  total p50 {:>8.4f}s p90 {:>8.4f}s  {:>12,.0f} rows/s  {:>8.1f} MB/s'.format(
+      result['strategy'], result['rows'], result['first_row_s']['p50'], result['total_s']['p50'],
+      result['total_s']['p90'], result['rows_per_s']['p50'], result['mb_per_s']['p50']))
+
+def main(argv = None):
+  parser = argparse.ArgumentParser(description = 'Measure warehouse latency and throughput per fetch strategy.')
+  parser.add_argument('--sizes', type = float, nargs = '+', default = [100, 10000, 100000],
+    help = 'result sizes in rows, e.g. 1e3 1e5')
+  parser.add_argument('--strategies', nargs = '+', choices = STRATEGIES, default = STRATEGIES)
+  parser.add_argument('--repeat', type = int, default = 5)
+  parser.add_argument('--warmup', type = int, default = 1, help = 'untimed runs before each measurement')
+  parser.add_argument('--chunksize', type = int, default = db.DEFAULT_CHUNKSIZE)
+  parser.add_argument('--table', default = DEFAULT_TABLE)
+  parser.add_argument('--local', action = 'store_true', help = 'run against a generated sqlite stand-in')
+  parser.add_argument('--local-path', default = os.path.join(tempfile.gettempdir(), 'warehouse_probe.db'))
+  parser.add_argument('--output', default = None, help = 'json file, printed when not given')
+  args = parser.parse_args(argv)
+
+  sizes = [int(size) for size in args.sizes]
+  if args.local:
+    backend = create_stand_in(args.local_path, max(sizes))
+  else:
+    backend = db.get_backend()
+
+  repeat = max(args.repeat, 1)
+  connect = percentiles([measure_connect(backend) for _ in range(repeat)])
+  print('connect p50 {:.4f}s p90 {:.4f}s'.format(connect['p50'], connect['p90']))
+  results = probe(backend, sizes, args.strategies, repeat, args.warmup, args.chunksize, args.table)
+  print_results(results)
+
+  report = {
+    'timestamp': datetime.datetime.now().isoformat(timespec = 'seconds'),
+    'backend': backend.name,
+    'local': args.local,
+    'table': args.table,
+    'chunksize': args.chunksize,
+    'repeat': args.repeat,
+    'pandas': pd.__version__,
+    'connect_s': connect,
+    'results': results,
+  }
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(report, f, indent = 2)
+    print('wrote {}'.format(args.output))
+  else:
+    print(json.dumps(report, indent = 2))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+import cold_start
+
+## Cold start budget of the apps, see benchmarks/cold_start.py. The budget
+# is COLD_START_BUDGET seconds, as for the script.
+
+APPS = cold_start.find_apps()
+
+def test_every_app_is_found():
+  assert {'mkt_tv_optimizer', 'customer_retention_dashboard'} <= set(APPS)
+
+def test_imports_are_read_past_the_first_function():
+  top, later = cold_start.script_imports(APPS['mkt_tv_optimizer'])
+  assert 'import optimizer' in top
+  assert 'import plotly.graph_objects as go' in later
+  assert not any('streamlit' in statement for statement in top + later)
+
+@pytest.mark.parametrize('app', sorted(APPS))
+def test_app_imports_within_budget(app):
+  result = cold_start.profile(app, APPS[app], repeat = 3)
+  assert cold_start.check(result) == []
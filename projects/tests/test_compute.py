@@ -0,0 +1,80 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import compute
+
+## Parity of the compute backends, see common/compute.py.
+# duckdb and polars are optional, their cases are skipped when not installed.
+
+def _backends():
+  yield compute.PandasCompute()
+  for module, backend in (('duckdb', compute.DuckDBCompute), ('polars', compute.PolarsCompute)):
+    try:
+      __import__(module)
+    except ImportError:
+      continue
+    yield backend()
+
+BACKENDS = list(_backends())
+
+AGGREGATIONS = {
+  'total': ('value', 'sum'),
+  'flags': ('flag', 'sum'),
+  'rows': ('value', 'count'),
+  'distinct': ('value', 'nunique'),
+  'mean': ('value', 'mean'),
+  'std': ('value', 'std'),
+  'low': ('value', 'min'),
+  'high': ('value', 'max'),
+}
+
+@pytest.fixture
+def large_values():
+  # int32 values whose per group sums are far above 2**31
+  rng = np.random.default_rng(0)
+  n = 20000
+  return pd.DataFrame({
+    'group': pd.Categorical(rng.choice(['a', 'b', 'c'], n)),
+    'value': rng.integers(2 ** 30, 2 ** 31 - 1, n).astype(np.int32),
+    'flag': rng.integers(0, 2, n).astype(bool),
+  })
+
+def _expected(df):
+  grouped = df.groupby('group', observed = True)
+  return pd.DataFrame({
+    'total': grouped['value'].apply(lambda values: int(values.astype(np.int64).sum())),
+    'flags': grouped['flag'].sum().astype(np.int64),
+    'rows': grouped['value'].count().astype(np.int64),
+  })
+
+@pytest.mark.parametrize('backend', BACKENDS, ids = [backend.name for backend in BACKENDS])
+def test_sums_above_int32_do_not_wrap(backend, large_values):
+  result = backend.group_aggregate(large_values, ['group'], AGGREGATIONS)
+  expected = _expected(large_values)
+
+  assert result['total'].dtype == np.int64
+  assert result['rows'].dtype == np.int64
+  assert (result['total'] > 2 ** 31).all()
+  assert result['total'].tolist() == expected['total'].tolist()
+  assert result['flags'].tolist() == expected['flags'].tolist()
+  assert result['rows'].tolist() == expected['rows'].tolist()
+
+@pytest.mark.parametrize('backend', BACKENDS, ids = [backend.name for backend in BACKENDS])
+def test_backends_match_pandas(backend, large_values):
+  reference = compute.PandasCompute().group_aggregate(large_values, ['group'], AGGREGATIONS,
+    filters = [('value', '>', 2 ** 30 + 2 ** 29)])
+  result = backend.group_aggregate(large_values, ['group'], AGGREGATIONS,
+    filters = [('value', '>', 2 ** 30 + 2 ** 29)])
+  pd.testing.assert_frame_equal(result, reference, check_exact = False, rtol = 1e-12)
+
+@pytest.mark.parametrize('backend', BACKENDS, ids = [backend.name for backend in BACKENDS])
+def test_file_source_matches_frame(backend, large_values, tmp_path):
+  path = str(tmp_path / 'values.parquet')
+  large_values.to_parquet(path, index = False)
+  pd.testing.assert_frame_equal(backend.group_aggregate(path, ['group'], AGGREGATIONS),
+    backend.group_aggregate(large_values, ['group'], AGGREGATIONS), check_exact = False, rtol = 1e-12)
@@ -0,0 +1,78 @@
+import os
+import sys
+
+import pandas as pd
+import pyarrow as pa
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import db
+
+## Fetching through common/db.py, with a fake engine in place of a warehouse.
+
+class FakeCursor:
+
+  def __init__(self, batches):
+    self.batches = batches
+
+  def fetch_arrow_batches(self):
+    return iter(self.batches)
+
+
+class FakeResult:
+
+  def __init__(self, columns, cursor):
+    self.columns = columns
+    self.cursor = cursor
+
+  def keys(self):
+    return self.columns
+
+
+class FakeConnection:
+
+  def __init__(self, result):
+    self.result = result
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    return False
+
+  def execution_options(self, **options):
+    return self
+
+  def execute(self, statement, params):
+    return self.result
+
+
+class FakeEngine:
+
+  def __init__(self, result):
+    self.result = result
+
+  def connect(self):
+    return FakeConnection(self.result)
+
+
+def _arrow_backend(monkeypatch, columns, batches):
+  # snowflake's cursor: upper case arrow names, lower case names from the dialect
+  backend = db.LocalBackend()
+  engine = FakeEngine(FakeResult(columns, FakeCursor(batches)))
+  monkeypatch.setattr(db, 'get_engine', lambda backend = None: engine)
+  return backend
+
+def test_arrow_batches_take_the_dialect_column_names(monkeypatch):
+  batches = [
+    pa.RecordBatch.from_pydict({'CUSTOMER_ID': [1, 2], 'CREATED_AT_TZ': ['2021-01-01', '2021-01-02']}),
+    pa.RecordBatch.from_pydict({'CUSTOMER_ID': [3], 'CREATED_AT_TZ': ['2021-01-03']}),
+  ]
+  backend = _arrow_backend(monkeypatch, ['customer_id', 'created_at_tz'], batches)
+
+  chunks = list(db.read_batches('SELECT 1', backend = backend))
+  assert [list(chunk.columns) for chunk in chunks] == [['customer_id', 'created_at_tz']] * 2
+
+  df = db.read_sql('SELECT 1', backend = backend,
+    convert = lambda chunk: chunk.assign(created_at_tz = pd.to_datetime(chunk['created_at_tz'])))
+  assert df['customer_id'].tolist() == [1, 2, 3]
+  assert str(df['created_at_tz'].dtype) == 'datetime64[ns]'
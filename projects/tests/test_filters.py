@@ -0,0 +1,61 @@
+import datetime
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.filters import LazyFilter
+
+## Lazy row filters, against boolean indexing of the table.
+
+def _orders():
+  rng = np.random.default_rng(0)
+  n = 500
+  return pd.DataFrame({
+    'created_at': pd.date_range('2021-01-01', periods = n, freq = '7h'),
+    'has_mattress': rng.integers(0, 2, n).astype(bool),
+    'amount': rng.integers(0, 100, n),
+  })
+
+def test_between_and_where_match_boolean_indexing():
+  df = _orders()
+  start, end = datetime.date(2021, 1, 20), datetime.date(2021, 2, 10)
+  lazy = LazyFilter(df) \
+    .between('created_at', start, end) \
+    .where(('product', 'mattress'), lambda d: d['has_mattress']) \
+    .where(('amount', 50), lambda d: d['amount'] >= 50)
+
+  dates = df['created_at'].dt.date
+  expected = df[(dates >= start) & (dates <= end) & df['has_mattress'] & (df['amount'] >= 50)]
+  pd.testing.assert_frame_equal(lazy.collect(), expected)
+  assert lazy.count() == len(expected)
+  assert lazy.full_mask().tolist() == df.index.isin(expected.index).tolist()
+
+def test_between_twice_intersects():
+  df = _orders()
+  lazy = LazyFilter(df).between('created_at', '2021-01-10', None).between('created_at', None, '2021-01-20')
+  values = df['created_at']
+  expected = df[(values >= '2021-01-10') & (values <= '2021-01-20')]
+  pd.testing.assert_frame_equal(lazy.collect(), expected)
+
+  empty = LazyFilter(df).between('created_at', '2021-02-01', None).between('created_at', None, '2021-01-01')
+  assert empty.count() == 0 and len(empty.collect()) == 0
+
+def test_none_predicate_and_no_filters():
+  df = _orders()
+  lazy = LazyFilter(df).where(('product', 'all'), None)
+  assert lazy.predicates == () and lazy.mask() is None
+  assert lazy.collect() is df
+  assert lazy.count() == len(df)
+
+def test_key_ignores_the_order_filters_were_added_in():
+  df = _orders()
+  mattress = (('product', 'mattress'), lambda d: d['has_mattress'])
+  large = (('amount', 50), lambda d: d['amount'] >= 50)
+  a = LazyFilter(df).where(*mattress).where(*large)
+  b = LazyFilter(df).where(*large).where(*mattress)
+  assert a.key() == b.key()
+  # collected once per distinct set of filters
+  assert a.collect() is b.collect()
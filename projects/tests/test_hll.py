@@ -0,0 +1,61 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import hll
+
+## HyperLogLog distinct counts, against exact nunique. Bounds are 4 standard
+# errors, a seeded run that fails them points at a bug, not bad luck.
+
+def _orders(n = 200000, customers = 60000, seed = 0):
+  rng = np.random.default_rng(seed)
+  return pd.DataFrame({
+    'customer_id': rng.integers(0, customers, n),
+    'year_month': pd.Categorical(rng.choice(['2021-01', '2021-02', '2021-03', '2021-04'], n)),
+    'has_mattress': rng.integers(0, 2, n).astype(bool),
+  })
+
+def test_counts_within_the_error_bound():
+  df = _orders()
+  sketches = hll.Sketches.build(df, 'customer_id', ['year_month', 'has_mattress'])
+  bound = 4 * sketches.error
+
+  exact = df['customer_id'].nunique()
+  assert abs(sketches.count() / exact - 1) < bound
+
+  mattress = sketches.keys['has_mattress'].to_numpy()
+  exact = df.loc[df['has_mattress'], 'customer_id'].nunique()
+  assert abs(sketches.count(mattress) / exact - 1) < bound
+
+  by_month = sketches.count_by('year_month')
+  exact = df.groupby('year_month', observed = True)['customer_id'].nunique()
+  np.testing.assert_array_less(np.abs(by_month.to_numpy() / exact.to_numpy() - 1), bound)
+
+@pytest.mark.parametrize('precision', [10, 12, 14])
+def test_small_counts_are_nearly_exact(precision):
+  # linear counting below 2.5 * 2^precision
+  df = pd.DataFrame({'key': ['a'] * 500, 'value': np.arange(500)})
+  count = hll.Sketches.build(df, 'value', ['key'], precision).count()
+  assert abs(count - 500) < 500 * 2 * hll.standard_error(precision)
+
+def test_merging_partitions_does_not_double_count():
+  df = _orders(n = 50000, customers = 1000)
+  sketches = hll.Sketches.build(df, 'customer_id', ['year_month'])
+  # every customer shows up in every month, the union is not the sum
+  assert sketches.count() < 1.1 * 1000
+
+def test_null_keys_and_values_are_left_out():
+  df = pd.DataFrame({
+    'key': ['a', 'b', None, 'b', np.nan, 'a'],
+    'value': [1.0, 2.0, 3.0, 4.0, 5.0, np.nan],
+  })
+  counts = hll.Sketches.build(df, 'value', ['key']).count_by('key')
+  assert counts.round().to_dict() == {'a': 1.0, 'b': 2.0}
+
+def test_empty_selection():
+  sketches = hll.Sketches.build(_orders(n = 100), 'customer_id', ['year_month'])
+  assert sketches.count(np.zeros(len(sketches.keys), dtype = bool)) == 0.0
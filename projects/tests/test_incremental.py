@@ -0,0 +1,107 @@
+import datetime
+import os
+import sqlite3
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import db, incremental, shared_store
+
+## Incremental loading against a full reload of a local sqlite table.
+
+def _derive(chunk):
+  chunk['created_at'] = pd.to_datetime(chunk['created_at'])
+  return chunk
+
+@pytest.fixture
+def warehouse(tmp_path):
+  path = str(tmp_path / 'orders.db')
+  start = datetime.datetime(2021, 1, 1)
+  with sqlite3.connect(path) as connection:
+    pd.DataFrame({
+      'order_id': range(100),
+      'created_at': [(start + datetime.timedelta(hours = 12 * i)).strftime('%Y-%m-%d %H:%M:%S') for i in range(100)],
+      'amount': [float(i) for i in range(100)],
+    }).to_sql('ORDERS', connection, index = False)
+  return path
+
+def _table(path, tmp_path, store = None, **kwargs):
+  return incremental.IncrementalTable('"DB"."SCHEMA"."ORDERS"', 'created_at',
+    lookback = datetime.timedelta(days = 3), derive = _derive,
+    snapshot_dir = str(tmp_path / 'snapshots'), backend = db.LocalBackend('sqlite:///' + path),
+    store = store, **kwargs)
+
+def _full(path):
+  df = db.read_sql('SELECT * FROM ORDERS', backend = db.LocalBackend('sqlite:///' + path), convert = _derive)
+  return df.sort_values('created_at', kind = 'mergesort', ignore_index = True)
+
+def _execute(path, sql, *params):
+  with sqlite3.connect(path) as connection:
+    connection.execute(sql, params)
+
+def test_delta_matches_a_full_reload(warehouse, tmp_path):
+  table = _table(warehouse, tmp_path)
+  table.refresh()
+  assert table.watermark == pd.Timestamp('2021-02-19 12:00')
+
+  # a new order, a late one inside the lookback window and an update in it
+  _execute(warehouse, "INSERT INTO ORDERS VALUES (100, '2021-02-20 00:00:00', 100.0)")
+  _execute(warehouse, "INSERT INTO ORDERS VALUES (101, '2021-02-18 06:00:00', 101.0)")
+  _execute(warehouse, 'UPDATE ORDERS SET amount = -1 WHERE order_id = 98')
+  table.refresh(force = True)
+
+  pd.testing.assert_frame_equal(table.frame, _full(warehouse))
+  assert table.watermark == pd.Timestamp('2021-02-20 00:00')
+
+def test_changes_before_the_lookback_wait_for_a_full_refresh(warehouse, tmp_path):
+  table = _table(warehouse, tmp_path)
+  table.refresh()
+  _execute(warehouse, 'UPDATE ORDERS SET amount = -1 WHERE order_id = 0')
+  table.refresh(force = True)
+  assert table.frame['amount'].iloc[0] == 0.0
+
+  table.full_refresh()
+  pd.testing.assert_frame_equal(table.frame, _full(warehouse))
+
+def test_version_only_changes_with_the_rows(warehouse, tmp_path):
+  table = _table(warehouse, tmp_path)
+  table.refresh()
+  version, frame = table.current()
+  table.refresh(force = True)
+  assert table.current() == (version, frame)
+
+  _execute(warehouse, "INSERT INTO ORDERS VALUES (100, '2021-02-20 00:00:00', 100.0)")
+  table.refresh(force = True)
+  assert table.version == version + 1
+
+def test_snapshot_restores_rows_and_full_refresh_time(warehouse, tmp_path):
+  table = _table(warehouse, tmp_path)
+  table.warm()
+
+  restarted = _table(warehouse, tmp_path, full_refresh_interval = None)
+  assert restarted._load_snapshot()
+  pd.testing.assert_frame_equal(restarted.frame, table.frame)
+  assert restarted.last_full_refresh == pytest.approx(table.last_full_refresh)
+  assert restarted.content_id == table.content_id
+
+def test_processes_share_the_published_rows(warehouse, tmp_path):
+  store = shared_store.SharedStore(str(tmp_path / 'store'))
+  first = _table(warehouse, tmp_path, store = store)
+  second = _table(warehouse, tmp_path, store = store)
+  first.refresh()
+  second.refresh()
+  pd.testing.assert_frame_equal(second.frame, first.frame)
+
+  # a refresh that finds nothing new publishes nothing
+  files = sorted(os.listdir(store.directory))
+  first.refresh(force = True)
+  assert sorted(os.listdir(store.directory)) == files
+
+  _execute(warehouse, "INSERT INTO ORDERS VALUES (100, '2021-02-20 00:00:00', 100.0)")
+  first.refresh(force = True)
+  version = second.version
+  second.refresh()
+  assert second.version == version + 1
+  pd.testing.assert_frame_equal(second.frame, _full(warehouse))
@@ -0,0 +1,92 @@
+import gc
+import os
+import sys
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import memo
+
+## Identity keyed memoization and its invalidation.
+
+def test_same_frame_hits_and_a_replaced_frame_misses():
+  calls = []
+
+  @memo.memoize(max_entries = 4)
+  def total(df, column):
+    calls.append(column)
+    return df[column].sum()
+
+  df = pd.DataFrame({'a': [1, 2, 3]})
+  assert total(df, 'a') == 6 and total(df, 'a') == 6
+  assert len(calls) == 1
+
+  # a new object, even with equal contents, is a new version
+  assert total(df.copy(), 'a') == 6
+  assert len(calls) == 2
+  assert total.cache_info()['hits'] == 1
+
+def test_token_is_forgotten_with_the_frame():
+  df = pd.DataFrame({'a': [1]})
+  token = memo.version_token(df)
+  assert memo.version_token(df) == token
+  key = id(df)
+  del df
+  gc.collect()
+  assert key not in memo._tokens
+
+def test_evicts_least_recently_used():
+  cache = memo.LRUCache(max_entries = 2)
+  cache.put('a', 1)
+  cache.put('b', 2)
+  assert cache.get('a') == 1
+  cache.put('c', 3)
+  assert cache.get('b') is None and cache.get('a') == 1 and cache.get('c') == 3
+
+def test_evicts_past_max_bytes_but_keeps_the_newest():
+  cache = memo.LRUCache(max_entries = 10, max_bytes = 1000)
+  big = pd.DataFrame({'a': range(100)})
+  cache.put('first', big)
+  cache.put('second', big.copy())
+  assert cache.get('first') is None and cache.get('second') is not None
+  # the newest entry is kept even when it alone is over max_bytes
+  assert cache.info()['entries'] == 1
+
+def test_key_function_and_clear():
+  calls = []
+
+  @memo.memoize(key = lambda df, state, page: (df, state))
+  def section(df, state, page):
+    calls.append(page)
+    return len(df)
+
+  df = pd.DataFrame({'a': [1, 2]})
+  section(df, 'x', 1)
+  section(df, 'x', 2)
+  assert calls == [1]
+
+  section.cache_clear()
+  section(df, 'x', 3)
+  assert calls == [1, 3]
+
+def test_cache_survives_redefinition():
+  # streamlit redefines functions on every rerun, the cache is by name and code
+  def define():
+    @memo.memoize()
+    def double(x):
+      return 2 * x
+    return double
+
+  first = define()
+  first(2)
+  assert define().cache is first.cache
+
+def test_thread_counts_follow_lookups():
+  @memo.memoize()
+  def square(x):
+    return x * x
+
+  hits, misses = memo.thread_counts()
+  square(3)
+  square(3)
+  assert memo.thread_counts() == (hits + 1, misses + 1)
@@ -0,0 +1,73 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.moments import GroupMoments
+
+## Mergeable per group moments, against groupby mean and std.
+
+def _spots(n, seed, timezones = ('Australia/Melbourne', 'Australia/Sydney', 'Europe/London')):
+  rng = np.random.default_rng(seed)
+  return pd.DataFrame({
+    'timezone': pd.Categorical(rng.choice(timezones, n), categories = sorted(timezones)),
+    'users': rng.gamma(2.0, 50.0, n),
+  })
+
+def _reference(df):
+  grouped = df.groupby('timezone', observed = True)['users']
+  return pd.DataFrame({'timezone': grouped.mean().index,
+    'users-mean': grouped.mean().to_numpy(), 'users-std': grouped.std().to_numpy()})
+
+def test_frame_matches_groupby():
+  df = _spots(1000, 0)
+  got = GroupMoments.from_groups(df['timezone'], df['users']).frame('timezone', 'users')
+  pd.testing.assert_frame_equal(got, _reference(df), check_categorical = False)
+
+def test_merge_of_chunks_equals_the_whole():
+  df = _spots(3000, 1)
+  moments = GroupMoments.from_groups(df['timezone'][:1000], df['users'][:1000])
+  for start in (1000, 2000):
+    chunk = df[start:start + 1000]
+    moments = moments.update(chunk['timezone'], chunk['users'])
+
+  whole = GroupMoments.from_groups(df['timezone'], df['users'])
+  np.testing.assert_array_equal(moments.count, whole.count)
+  np.testing.assert_allclose(moments.mean(), whole.mean(), rtol = 1e-12)
+  np.testing.assert_allclose(moments.std(), whole.std(), rtol = 1e-9)
+
+def test_merge_adds_new_groups():
+  a = pd.DataFrame({'timezone': ['x', 'x', 'y'], 'users': [1.0, 3.0, 5.0]})
+  b = pd.DataFrame({'timezone': ['z', 'x'], 'users': [7.0, 5.0]})
+  merged = GroupMoments.from_groups(a['timezone'], a['users']).update(b['timezone'], b['users'])
+  both = pd.concat([a, b])
+  pd.testing.assert_frame_equal(merged.frame('timezone', 'users'), _reference(both))
+
+def test_nan_values_and_single_rows():
+  df = pd.DataFrame({'timezone': ['x', 'x', 'y', 'x'], 'users': [1.0, np.nan, 2.0, 3.0]})
+  moments = GroupMoments.from_groups(df['timezone'], df['users'])
+  assert moments.count.tolist() == [2, 1]
+  assert moments.mean().tolist() == [2.0, 2.0]
+  # one row has no sample std
+  assert np.isnan(moments.std()[1])
+
+def test_within_keeps_rows_up_to_mean_plus_sigmas_std():
+  df = _spots(2000, 2)
+  moments = GroupMoments.from_groups(df['timezone'], df['users'])
+  stats = df.groupby('timezone', observed = True)['users'].agg(['mean', 'std'])
+  limit = df['timezone'].map(stats['mean'] + 1.5 * stats['std']).astype(float)
+  assert moments.within(df['timezone'], df['users'], 1.5).tolist() == (df['users'] <= limit).tolist()
+
+  # rows of groups without moments are never within
+  unknown = pd.Series(['Asia/Tokyo'])
+  assert not moments.within(unknown, [0.0], 5).any()
+
+@pytest.mark.parametrize('categorical', [True, False])
+def test_positions_of_categorical_and_plain_groups(categorical):
+  df = _spots(50, 3)
+  moments = GroupMoments.from_groups(df['timezone'], df['users'])
+  groups = df['timezone'] if categorical else df['timezone'].astype(str)
+  assert moments.keys[moments.positions(groups)].tolist() == df['timezone'].astype(str).tolist()
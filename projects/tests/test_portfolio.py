@@ -0,0 +1,89 @@
+import itertools
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mkt_tv_optimizer'))
+import portfolio
+
+## Budget portfolio, exact against brute force and greedy against exact.
+
+def _candidates(n, seed):
+  rng = np.random.default_rng(seed)
+  cost = rng.uniform(1, 100, n)
+  return cost, cost * rng.uniform(0.5, 2.0, n), rng.integers(1, 5, n).astype(float)
+
+def _brute_force(cost, users, spots, budget, max_spots):
+  best = 0.0
+  for r in range(len(cost) + 1):
+    for chosen in itertools.combinations(range(len(cost)), r):
+      chosen = list(chosen)
+      if cost[chosen].sum() <= budget and spots[chosen].sum() <= max_spots:
+        best = max(best, users[chosen].sum())
+  return best
+
+@pytest.mark.parametrize('seed', range(20))
+def test_exact_is_optimal(seed):
+  cost, users, spots = _candidates(10, seed)
+  budget, max_spots = cost.sum() / 3, 8
+  positions, method = portfolio.solve(cost, users, spots, budget, max_spots, method = 'exact')
+  assert method == 'exact'
+  assert users[positions].sum() == pytest.approx(_brute_force(cost, users, spots, budget, max_spots))
+
+@pytest.mark.parametrize('method', ['exact', 'greedy'])
+def test_selection_is_feasible(method):
+  cost, users, spots = _candidates(30, 1)
+  positions, _ = portfolio.solve(cost, users, spots, 400.0, 20, method = method)
+  assert cost[positions].sum() <= 400.0 and spots[positions].sum() <= 20
+  assert len(np.unique(positions)) == len(positions)
+
+def test_greedy_is_close_to_exact():
+  for seed in range(10):
+    cost, users, spots = _candidates(30, seed)
+    exact, _ = portfolio.solve(cost, users, spots, 500.0, 25, method = 'exact')
+    greedy, _ = portfolio.solve(cost, users, spots, 500.0, 25, method = 'greedy')
+    assert users[greedy].sum() >= 0.85 * users[exact].sum()
+
+def test_auto_picks_by_size():
+  cost, users, spots = _candidates(portfolio.EXACT_LIMIT + 1, 0)
+  assert portfolio.solve(cost[:-1], users[:-1], spots[:-1], 300.0, method = 'auto')[1] == 'exact'
+  assert portfolio.solve(cost, users, spots, 300.0, method = 'auto')[1] == 'greedy'
+
+def test_exact_stops_at_the_node_limit(monkeypatch):
+  # near equal ratios defeat the bound, the search would not finish
+  rng = np.random.default_rng(0)
+  cost = rng.uniform(100, 101, 500)
+  users = cost * rng.uniform(0.99, 1.01, 500)
+  spots = np.ones(500)
+  monkeypatch.setattr(portfolio, 'EXACT_NODES', 2000)
+  positions, method = portfolio.solve(cost, users, spots, 20000.0, method = 'exact')
+  assert method in ('exact, stopped', 'greedy')
+  assert not portfolio._exact(cost, users, spots, 20000.0, np.inf)[1]
+  assert cost[positions].sum() <= 20000.0
+  greedy, _ = portfolio.solve(cost, users, spots, 20000.0, method = 'greedy')
+  assert users[positions].sum() >= users[greedy].sum()
+
+def test_free_candidates_are_always_taken():
+  cost = np.array([0.0, 10.0, 20.0])
+  positions, _ = portfolio.solve(cost, np.array([1.0, 5.0, 50.0]), np.ones(3), 15.0)
+  assert positions.tolist() == [0, 1]
+  with pytest.raises(ValueError):
+    portfolio.solve(cost, np.ones(3), np.array([5.0, 1.0, 1.0]), 15.0, max_spots = 2)
+
+def test_budget_per_timezone():
+  df = pd.DataFrame({
+    'timezone': ['a', 'a', 'b', 'b', 'c'],
+    'channel': ['x'] * 5,
+    'program': ['p1', 'p2', 'p3', 'p4', 'p5'],
+    'total_cost': [10.0, 20.0, 10.0, 30.0, 5.0],
+    'total_users': [10.0, 30.0, 5.0, 40.0, 100.0],
+    'total_spots': [1, 1, 1, 1, 1],
+  })
+  selection, summary = portfolio.solve_portfolio(df, {'a': 20.0, 'b': 40.0})
+  assert sorted(selection['program']) == ['p2', 'p3', 'p4']
+  assert summary.set_index('budget')['spend'].to_dict() == {'a': 20.0, 'b': 40.0}
+  # timezones without a budget are left out
+  assert 'c' not in set(selection['timezone'])
@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mkt_tv_optimizer'))
+from common import db, result_cache
+import optimizer
+
+## Persistent result cache: a hit returns what the miss returned.
+
+def _spots():
+  # raw rows as the warehouse returns them, before convert_chunk
+  return pd.DataFrame({
+    'ad_time_ntz': ['2021-02-01 10:00:00', '2021-01-03 20:30:00', '2021-03-05 08:15:00'],
+    'month': ['2021-02-01', '2021-01-01', '2021-03-01'],
+    'timezone': ['Europe/London', 'Australia/Sydney', 'Europe/London'],
+    'channel': ['c1', 'c2', 'c1'],
+    'program': ['p1', 'p2', 'p3'],
+    'spot': [1, 2, 1],
+    'cost': [100.0, 250.5, 80.0],
+    'impression': [10, 20, 5],
+    'users': [3, 7, 1],
+  })
+
+def test_hit_has_the_dtypes_of_the_miss(tmp_path):
+  cache = result_cache.ResultCache(str(tmp_path))
+  backend = db.LocalBackend()
+  miss = optimizer.convert_chunk(_spots())
+
+  cache.put('SELECT 1', miss, backend = backend, variant = 'spots')
+  hit = cache.get('SELECT 1', backend = backend, variant = 'spots')
+  pd.testing.assert_frame_equal(hit, miss)
+
+def test_categories_survive_unobserved(tmp_path):
+  cache = result_cache.ResultCache(str(tmp_path))
+  backend = db.LocalBackend()
+  df = pd.DataFrame({'timezone': pd.Categorical(['b', 'a'], categories = ['a', 'b', 'c'])})
+
+  cache.put('SELECT 2', df, backend = backend)
+  pd.testing.assert_frame_equal(cache.get('SELECT 2', backend = backend), df)
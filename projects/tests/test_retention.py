@@ -0,0 +1,56 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'customer_retention_dashboard'))
+import retention
+
+## Cohort index and retention matrices, against a groupby reference.
+
+def _orders():
+  # sorted on time like the loaded table, one order without a customer and
+  # one without a month. customer 3 orders last, so a -1 code would land on it
+  return pd.DataFrame({
+    'customer_id': pd.array([1, 2, 1, None, 2, 3, 1, 3], dtype = 'Int64'),
+    'year_month': pd.Categorical(['2021-01', '2021-01', '2021-02', '2021-01', '2021-03', '2021-03', None, '2021-04']),
+  })
+
+def _reference(orders):
+  valid = orders.dropna()
+  month = valid['year_month'].astype(str).map(lambda label: int(label[:4]) * 12 + int(label[5:7]) - 1)
+  cohort = month.groupby(valid['customer_id']).transform('min')
+  return pd.DataFrame({'customer_id': valid['customer_id'], 'cohort': cohort, 'months_since': month - cohort})
+
+def test_orders_without_customer_or_month_have_no_cohort():
+  orders = _orders()
+  index = retention.cohortIndex(orders)
+  reference = _reference(orders)
+
+  valid = orders.notna().all(axis = 1).to_numpy()
+  assert (index.loc[~valid, ['customer', 'cohort', 'months_since']] == -1).all().all()
+  assert index.loc[valid, 'cohort'].tolist() == reference['cohort'].tolist()
+  assert index.loc[valid, 'months_since'].tolist() == reference['months_since'].tolist()
+
+def test_retention_counts_match_groupby():
+  orders = _orders()
+  counts, rates, sizes = retention.cohortRetention(retention.cohortIndex(orders))
+  reference = _reference(orders)
+
+  expected = reference.groupby(['cohort', 'months_since'])['customer_id'].nunique()
+  for (cohort, months_since), customers in expected.items():
+    assert counts.loc[retention.cohortLabels([cohort])[0], months_since] == customers
+  # customer 3 stays in the 2021-03 cohort
+  assert sizes.to_dict() == {'2021-01': 2, '2021-02': 0, '2021-03': 1}
+  assert int(np.nansum(counts.to_numpy())) == expected.sum()
+
+def test_mask_is_aligned_with_the_orders():
+  orders = _orders()
+  index = retention.cohortIndex(orders)
+  mask = np.zeros(len(orders), dtype = bool)
+  mask[[5, 7]] = True
+  counts, _, _ = retention.cohortRetention(index, mask, value = 'orders')
+  assert counts.loc['2021-03', 0] == 1 and counts.loc['2021-03', 1] == 1
+  assert np.nansum(counts.to_numpy()) == 2
@@ -0,0 +1,69 @@
+import datetime
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import time_index
+
+## Range slicing, against the row by row comparisons it replaces.
+
+def _hourly(tz):
+  return pd.Series(pd.date_range('2021-03-28', '2021-10-10', freq = 'h', tz = tz))
+
+@pytest.mark.parametrize('day', ['2021-04-04', '2021-10-03'])
+def test_end_date_is_the_next_local_midnight_across_dst(day):
+  # Melbourne leaves DST on 2021-04-04 (a 25 hour day) and enters it on
+  # 2021-10-03 (a 23 hour day)
+  values = _hourly('Australia/Melbourne')
+  start, end = datetime.date(2021, 4, 1), pd.Timestamp(day).date()
+  lo, hi = time_index.time_range_positions(values, start, end)
+  expected = (values.dt.date >= start) & (values.dt.date <= end)
+  assert (lo, hi) == (int(expected.idxmax()), int(expected[::-1].idxmax()) + 1)
+
+def _frame(tz = None):
+  times = pd.Series(pd.to_datetime(['2021-01-03 08:00', '2021-01-01 00:00', '2021-01-02 23:59',
+    '2021-01-02 00:00', '2021-01-04 12:00', '2021-01-02 12:00']))
+  if tz is not None:
+    times = times.dt.tz_localize(tz)
+  return pd.DataFrame({'at': times, 'row': range(len(times))})
+
+def test_sort_is_stable_and_skips_sorted_tables():
+  df = _frame()
+  ties = pd.concat([df.assign(copy = 0), df.assign(copy = 1)], ignore_index = True)
+  ordered = time_index.sort_by_time(ties, 'at')
+  assert ordered['at'].is_monotonic_increasing
+  # equal timestamps keep their load order
+  assert ordered['copy'].tolist() == [0, 1] * len(df)
+  assert time_index.sort_by_time(ordered, 'at') is ordered
+
+@pytest.mark.parametrize('tz', [None, 'UTC', 'Australia/Sydney'])
+@pytest.mark.parametrize('start, end', [
+  (datetime.date(2021, 1, 2), datetime.date(2021, 1, 3)),
+  (datetime.date(2021, 1, 2), None),
+  (None, datetime.date(2021, 1, 2)),
+  ('2021-01-02 12:00', '2021-01-03 08:00'),
+  (datetime.date(2021, 2, 1), None),
+])
+def test_slice_matches_row_by_row_filter(tz, start, end):
+  df = time_index.sort_by_time(_frame(tz), 'at')
+  got = time_index.slice_time_range(df, 'at', start, end)
+
+  expected = pd.Series(True, index = df.index)
+  for bound, compare in ((start, lambda values, value: values >= value), (end, lambda values, value: values <= value)):
+    if bound is None:
+      continue
+    if isinstance(bound, datetime.date):
+      expected &= compare(df['at'].dt.date, bound)
+    else:
+      value = pd.Timestamp(bound) if tz is None else pd.Timestamp(bound).tz_localize(tz)
+      expected &= compare(df['at'], value)
+  pd.testing.assert_frame_equal(got, df[expected])
+
+def test_aware_bound_is_converted_to_the_column_timezone():
+  df = time_index.sort_by_time(_frame('Australia/Sydney'), 'at')
+  # 2021-01-02 00:00 in Sydney is 2021-01-01 13:00 UTC
+  got = time_index.slice_time_range(df, 'at', start = pd.Timestamp('2021-01-01 13:00', tz = 'UTC'))
+  assert got['at'].min() == pd.Timestamp('2021-01-02 00:00', tz = 'Australia/Sydney')